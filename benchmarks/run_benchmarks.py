@@ -0,0 +1,490 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from types import SimpleNamespace
+
+BENCHMARK_PATH = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_PATH.parent.joinpath("src")))
+
+import flet as ft  # noqa: E402
+
+import main as app_main  # noqa: E402
+import shared_state  # noqa: E402
+from otp_clock import OtpClock  # noqa: E402
+from otp_engine import OtpEngine  # noqa: E402
+from otp_text import OtpText  # noqa: E402
+from otp_timebar import OtpTimeBar  # noqa: E402
+from perf_monitor import StartupTimer  # noqa: E402
+from qr_decoder import QrDecoder  # noqa: E402
+from qr_export import render_qrcode_file  # noqa: E402
+from stub_page import StubPage  # noqa: E402
+from token_record import make_auth_uri, make_timestamp_text  # noqa: E402
+from token_store import open_token_store  # noqa: E402
+from view_add import ViewAdd  # noqa: E402
+
+
+# 既定の計測対象のトークン件数・繰り返し回数
+DEFAULT_SIZES = (10, 1000, 10000)
+DEFAULT_REPEAT = 5
+
+# 計測結果の既定の保存先
+RESULTS_DIR_NAME = "results"
+
+# 合成データの発行者名
+SYNTHETIC_ISSUERS = (
+    "Example", "GitHub", "Google", "Microsoft", "Amazon", "Dropbox",
+    "Slack", "Discord", "Steam", "PyPI")
+
+
+# ベンチマーク実行時の設定
+class BenchmarkContext:
+    def __init__(self, repeat: int, backend: str, work_path: Path):
+        self.repeat = repeat
+        self.backend = backend
+        self.work_path = work_path
+        self.results = []
+
+    # 計測結果の追加
+    # Note: 1回ごとの所要時間(秒)から統計値を求めて記録
+    def add_result(self, name: str, size, samples: list, **extra):
+        result = {
+            "name": name,
+            "size": size,
+            "backend": self.backend,
+            "repeat": len(samples),
+            "min_sec": min(samples),
+            "median_sec": statistics.median(samples),
+            "mean_sec": statistics.fmean(samples),
+            "max_sec": max(samples),
+        }
+        result.update(extra)
+        self.results.append(result)
+        print(f"{name:<28} size={str(size):>6} "
+              f"median={result['median_sec'] * 1000:10.3f} ms")
+        return result
+
+    def add_skipped(self, name: str, size, reason: str):
+        self.results.append({
+            "name": name, "size": size, "backend": self.backend,
+            "skipped": reason})
+        print(f"{name:<28} size={str(size):>6} skipped: {reason}")
+
+
+# 処理の所要時間の計測
+# Note: setupは計測対象外として毎回funcの前に実行する
+def measure(func, repeat: int, setup=None) -> list:
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+#
+# 合成データの作成
+#
+
+# 合成トークン情報の作成
+# Note: 乱数のシードを固定し、実行ごとに同じ内容とする
+def make_synthetic_items(count: int) -> list:
+    rand = random.Random(count)
+    timestamp = make_timestamp_text()
+    items = []
+    for i in range(count):
+        user = f"user{i:05d}@example.com"
+        issuer = SYNTHETIC_ISSUERS[i % len(SYNTHETIC_ISSUERS)]
+        secret = "".join(
+            rand.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ234567")
+            for _ in range(32))
+        items.append((user, {
+            "user": user,
+            "secret": secret,
+            "issuer": issuer,
+            "auth_uri": make_auth_uri(user, secret, issuer),
+            "note": f"synthetic token {i}",
+            "created_at": timestamp,
+            "updated_at": timestamp,
+        }))
+    return items
+
+
+# 合成データの保存先の作成
+def create_synthetic_store(data_path: Path, count: int, backend: str):
+    token_store = open_token_store(data_path, backend)
+    token_store.add_many(make_synthetic_items(count))
+    token_store.close()
+
+
+#
+# アプリの画面の操作
+#
+
+# トップページの表示
+# Note: 環境変数FLET_APP_STORAGE_DATAで保存先を切り替えて表示
+def open_main_page(data_path: Path, startup_timer=None) -> StubPage:
+    os.environ["FLET_APP_STORAGE_DATA"] = str(data_path)
+    page = StubPage()
+    app_main.show_main_page(page, startup_timer=startup_timer)
+    return page
+
+
+def get_shared_state(data_path: Path):
+    return shared_state.shared_states[data_path]
+
+
+# 検索欄・一覧表示の取得
+def get_query_field(page: StubPage) -> ft.TextField:
+    return page.controls[0].controls[0]
+
+
+def get_list_view(page: StubPage):
+    return page.controls[1]
+
+
+#
+# 各ベンチマーク
+#
+
+# 起動処理(ストアの読み込みおよびトップページの表示)
+# Note: startup_show_main_pageは最初の画面表示まで、startup_store_fullは
+#       残りのトークン情報の読み込みと一覧への反映の完了までの経過時間
+def bench_startup(ctx: BenchmarkContext, data_path: Path, size: int):
+    token_store = None
+
+    def load_store():
+        nonlocal token_store
+        token_store = open_token_store(data_path, read_only=True)
+
+    ctx.add_result("store_load", size, measure(load_store, ctx.repeat))
+    token_store.close()
+
+    pages = []
+    update_counts = []
+    phases = []
+
+    def show_page():
+        startup_timer = StartupTimer()
+        page = open_main_page(data_path, startup_timer)
+        pages.append(page)
+        update_counts.append(page.updated_control_count)
+        get_shared_state(data_path).token_store.loaded.wait()
+        page.run_pending_tasks()
+        startup_timer.mark("store_full")
+        phases.append(startup_timer.phases)
+
+    def close_pages():
+        while pages:
+            pages.pop().close_page()
+
+    measure(show_page, ctx.repeat, setup=close_pages)
+    close_pages()
+    ctx.add_result(
+        "startup_show_main_page", size,
+        [phase["first_paint"] for phase in phases],
+        updated_controls=statistics.median(update_counts))
+    ctx.add_result(
+        "startup_store_full", size,
+        [phase["store_full"] for phase in phases])
+
+
+# 変更通知による一覧の差分反映(update_token_info_containers)
+def bench_resync(ctx: BenchmarkContext, page: StubPage, data_path: Path,
+                 size: int):
+    token_store = get_shared_state(data_path).token_store
+    keys = token_store.keys_in_order()
+    count = 0
+
+    def patch_and_sync():
+        nonlocal count
+        count += 1
+        token_store.patch(keys[count % len(keys)], {"note": f"bench {count}"})
+        page.run_pending_tasks()
+
+    ctx.add_result(
+        "resync_after_patch", size, measure(patch_and_sync, ctx.repeat))
+
+
+# 保存処理(ジャーナルへの追記・スナップショットの書き出し)
+def bench_save(ctx: BenchmarkContext, data_path: Path, size: int):
+    token_store = get_shared_state(data_path).token_store
+    keys = token_store.keys_in_order()
+    count = 0
+
+    def patch_keys():
+        nonlocal count
+        count += 1
+        token_store.patch(keys[count % len(keys)], {"note": f"save {count}"})
+
+    ctx.add_result(
+        "save_journal_flush", size,
+        measure(token_store.flush, ctx.repeat, setup=patch_keys))
+    ctx.add_result(
+        "save_snapshot_compact", size,
+        measure(token_store.compact, ctx.repeat, setup=patch_keys))
+
+
+# 検索処理(event_search_token_info)
+# Note: 多数一致・1件一致・検索解除は一致なしの状態から、
+#       narrowは1文字少ない検索中の状態から(入力中の絞り込み)実行
+def bench_search(ctx: BenchmarkContext, page: StubPage, size: int):
+    text_field_query = get_query_field(page)
+    last_user = f"user{size - 1:05d}"
+    queries = [("user0", "zzzz"), (last_user, "zzzz"),
+               (last_user, last_user[:-1]), ("", "zzzz")]
+    for label, (query, reset_query) in zip(
+            ("many", "one", "narrow", "clear"), queries):
+        event = SimpleNamespace(control=SimpleNamespace(value=query))
+        reset_event = SimpleNamespace(
+            control=SimpleNamespace(value=reset_query))
+
+        def search():
+            text_field_query.on_submit(event)
+            page.run_pending_tasks()
+
+        def reset():
+            text_field_query.on_submit(reset_event)
+            page.run_pending_tasks()
+
+        ctx.add_result(
+            f"search_{label}", size, measure(search, ctx.repeat, reset))
+
+
+# 並び替え処理(event_sort_token_info)
+# Note: 並び順の変更通知による差分反映までを含める
+def bench_sort(ctx: BenchmarkContext, page: StubPage, size: int):
+    list_view = get_list_view(page)
+    event = SimpleNamespace(old_index=0, new_index=size // 2)
+
+    def move_row():
+        list_view.on_reorder(event)
+        page.run_pending_tasks()
+
+    ctx.add_result("sort_move_row", size, measure(move_row, ctx.repeat))
+
+
+# 共有クロックの1回分の更新処理(OtpText/OtpTimeBar)
+# Note: boundaryは時間ステップの境界(全行のOTPが変化)、barは残り時間の
+#       バーのみの更新とし、1秒あたりの負荷を合わせて記録する
+def bench_clock_tick(ctx: BenchmarkContext, name: str, otp_clock: OtpClock,
+                     size: int):
+    for bucket in otp_clock.buckets.values():
+        def reset_boundary():
+            bucket.counter = None
+            for control in bucket.texts:
+                control.value = None
+
+        boundary = measure(
+            lambda: otp_clock.tick(bucket), ctx.repeat, reset_boundary)
+        bar = measure(lambda: otp_clock.tick(bucket), ctx.repeat)
+        per_second = (statistics.median(bar) / otp_clock.bar_interval
+                      + statistics.median(boundary) / bucket.period)
+        ctx.add_result(
+            f"{name}_boundary", size, boundary,
+            period=bucket.period, texts=len(bucket.texts),
+            bars=len(bucket.bars))
+        ctx.add_result(
+            f"{name}_bar", size, bar,
+            period=bucket.period, bars=len(bucket.bars),
+            per_second_sec=per_second)
+
+
+# 全行を表示した場合の共有クロックの負荷
+# Note: 仮想化せずにN行分のOtpText/OtpTimeBarを登録した場合を想定
+def bench_clock_all_rows(ctx: BenchmarkContext, data_path: Path, size: int):
+    token_store = open_token_store(data_path, read_only=True)
+    page = StubPage()
+    otp_engine = OtpEngine()
+    otp_clock = OtpClock(page, otp_engine)
+    for key in token_store.keys_in_order():
+        record = token_store[key]
+        otp_key = otp_engine.get_key(record["secret"], record.get("auth_uri"))
+        page.add(ft.Column(controls=[
+            OtpText(otp_key, otp_clock),
+            OtpTimeBar(otp_clock, otp_key.period)]))
+    bench_clock_tick(ctx, "otp_tick_all_rows", otp_clock, size)
+    page.close_page()
+    token_store.close()
+
+
+# QRコード画像の読み取り(ViewAddの読み込み処理)
+# Note: 画像はテスト用に作成し、小さいPNGと大きいJPEG(写真を想定)の
+#       2種類について、キャッシュなし・キャッシュありの場合を計測
+def bench_qr_decode(ctx: BenchmarkContext):
+    try:
+        import pyzbar.pyzbar  # noqa: F401
+        from PIL import Image, ImageFilter
+    except (ImportError, OSError) as e:
+        ctx.add_skipped("qr_decode", None, str(e))
+        return
+
+    fixture_path = ctx.work_path.joinpath("qr_fixtures")
+    fixture_path.mkdir(parents=True, exist_ok=True)
+    auth_uri = make_auth_uri(
+        "bench@example.com", "JBSWY3DPEHPK3PXPJBSWY3DPEHPK3PXP", "Bench")
+    png_path = render_qrcode_file(
+        auth_uri, str(fixture_path.joinpath("small.png")))
+
+    # Note: 大きい画像の中に小さく写ったQRコードを想定
+    jpeg_path = str(fixture_path.joinpath("photo.jpg"))
+    with Image.open(png_path) as qr_img:
+        photo = Image.new("RGB", (3000, 4000), (200, 190, 180))
+        photo.paste(qr_img.convert("RGB").resize((900, 900)), (1050, 1500))
+        photo.filter(ImageFilter.GaussianBlur(1)).save(jpeg_path, quality=85)
+
+    token_store = open_token_store(
+        ctx.work_path.joinpath("qr_store"), "json")
+    page = StubPage()
+    view_add = ViewAdd(token_store, QrDecoder())
+    page.views.append(view_add)
+    page.update(view_add)
+
+    for label, path in (("png", png_path), ("jpeg", jpeg_path)):
+        def reset_decoder():
+            view_add.qr_decoder = QrDecoder()
+
+        def decode():
+            view_add.run_decode_qrcode(path)
+
+        uncached = measure(decode, ctx.repeat, reset_decoder)
+        decoded = view_add.text_field_auth_uri.value == auth_uri
+        stage = view_add.qr_decoder.history[-1].stage
+        cached = measure(decode, ctx.repeat)
+        ctx.add_result(
+            f"qr_decode_{label}", None, uncached,
+            decoded=decoded, stage=stage)
+        ctx.add_result(f"qr_decode_{label}_cached", None, cached)
+
+    page.close_page()
+    token_store.close()
+
+
+# 1件数分のベンチマーク
+def run_size(ctx: BenchmarkContext, size: int):
+    data_path = ctx.work_path.joinpath(f"store_{size}")
+    create_synthetic_store(data_path, size, ctx.backend)
+
+    bench_startup(ctx, data_path, size)
+    page = open_main_page(data_path)
+    get_shared_state(data_path).token_store.loaded.wait()
+    page.run_pending_tasks()
+    try:
+        bench_resync(ctx, page, data_path, size)
+        bench_search(ctx, page, size)
+        bench_sort(ctx, page, size)
+        bench_clock_tick(
+            ctx, "otp_tick_visible",
+            get_shared_state(data_path).otp_clock, size)
+        bench_save(ctx, data_path, size)
+    finally:
+        page.close_page()
+    bench_clock_all_rows(ctx, data_path, size)
+
+
+#
+# 結果の保存・比較
+#
+
+def get_git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BENCHMARK_PATH,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_package_version(name: str):
+    from importlib import metadata
+
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def make_report(ctx: BenchmarkContext, sizes: list) -> dict:
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": get_git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "flet": get_package_version("flet"),
+        "backend": ctx.backend,
+        "sizes": sizes,
+        "repeat": ctx.repeat,
+        "results": ctx.results,
+    }
+
+
+# 前回の結果との比較表示
+# Note: 名前・件数ごとに中央値の比率(今回/前回)を表示
+def print_comparison(report: dict, baseline: dict):
+    def index(results):
+        return {(r["name"], r["size"]): r for r in results
+                if "median_sec" in r}
+
+    current = index(report["results"])
+    previous = index(baseline["results"])
+    print(f"\ncompared with {baseline.get('git_revision')} "
+          f"({baseline.get('created_at')})")
+    for key, result in current.items():
+        before = previous.get(key)
+        if before is None or not before["median_sec"]:
+            continue
+        ratio = result["median_sec"] / before["median_sec"]
+        print(f"{key[0]:<28} size={str(key[1]):>6} x{ratio:6.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the AuthenticatorModoki benchmarks headless")
+    parser.add_argument(
+        "--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+        help="comma separated token counts")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument(
+        "--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--output", help="result JSON file path")
+    parser.add_argument("--compare", help="previous result JSON to compare")
+    parser.add_argument(
+        "--skip-qr", action="store_true", help="skip QR code decoding")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    with tempfile.TemporaryDirectory() as work_dir:
+        ctx = BenchmarkContext(args.repeat, args.backend, Path(work_dir))
+        for size in sizes:
+            run_size(ctx, size)
+        if not args.skip_qr:
+            bench_qr_decode(ctx)
+        report = make_report(ctx, sizes)
+
+    if args.output:
+        output_path = Path(args.output)
+    else:
+        output_path = BENCHMARK_PATH.joinpath(
+            RESULTS_DIR_NAME,
+            datetime.now().strftime("benchmark_%Y%m%d_%H%M%S.json"))
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, indent=4), encoding="utf-8")
+    print(f"\nsaved: {output_path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import asyncio
+from types import SimpleNamespace
+
+from otp_clock import OtpClock
+
+
+# ベンチマーク用のft.Pageの代用
+# Note: 画面を表示せずにアプリの処理をそのまま実行するためのもの
+#       update時に対象コントロール以下をたどってpageの割当・did_mount/
+#       will_unmountの呼び出しを行い、更新回数・更新コントロール数を数える
+#       (Fletとの通信は行わないため、計測値にはその分を含まない)
+#       run_taskのタスクはrun_pending_tasksで順に実行し、共有クロックの
+#       更新ループは実行しない(OtpClock.tickで直接計測する)
+#       run_threadは呼び出し元のスレッドでそのまま実行する
+class StubPage:
+    def __init__(self, route: str = "/"):
+        self.title = None
+        self.appbar = None
+        self.route = route
+        self.window = SimpleNamespace(width=None, height=None)
+        self.controls = []
+        self.overlay = []
+        self.views = []
+        self.dialogs = []
+        self.on_route_change = None
+        self.on_view_pop = None
+        self.on_close = None
+
+        self.pending_tasks = []
+        self.loop = asyncio.new_event_loop()
+        self.mounted = {}
+        self.subtrees = {}
+        self.update_count = 0
+        self.updated_control_count = 0
+
+    #
+    # 画面の更新
+    #
+
+    def add(self, *controls):
+        self.controls.extend(controls)
+        self.update(*controls)
+
+    def update(self, *controls):
+        self.update_count += 1
+        if not controls:
+            controls = self.get_root_controls()
+        for control in controls:
+            self.updated_control_count += 1
+            self.mount_tree(control)
+
+    def get_root_controls(self) -> list:
+        roots = list(self.controls) + list(self.overlay) + list(self.views)
+        if self.appbar is not None:
+            roots.append(self.appbar)
+        return roots
+
+    # コントロール以下の割当・解除
+    # Note: 前回の更新時から外れたコントロールはwill_unmount、
+    #       新たに加わったコントロールはdid_mountを呼び出す
+    def mount_tree(self, root):
+        subtree = {}
+        stack = [root]
+        while stack:
+            control = stack.pop()
+            subtree[id(control)] = control
+            stack.extend(get_children(control))
+
+        for control_id, control in self.subtrees.get(id(root), {}).items():
+            if control_id not in subtree \
+                    and self.mounted.pop(control_id, None) is not None:
+                control.will_unmount()
+                control.page = None
+        self.subtrees[id(root)] = subtree
+
+        added = []
+        for control_id, control in subtree.items():
+            if control_id not in self.mounted:
+                self.mounted[control_id] = control
+                control.page = self
+                added.append(control)
+        for control in added:
+            control.did_mount()
+
+    #
+    # ダイアログ・画面遷移
+    #
+
+    def open(self, dialog):
+        self.dialogs.append(dialog)
+
+    def close(self, dialog):
+        if dialog in self.dialogs:
+            self.dialogs.remove(dialog)
+
+    def go(self, route: str, **kwargs):
+        self.route = route
+
+    #
+    # タスク・スレッドの実行
+    #
+
+    def run_task(self, handler, *args):
+        task = SimpleNamespace(
+            handler=handler, args=args, cancelled=False, done=False)
+        task.cancel = lambda: setattr(task, "cancelled", True)
+        self.pending_tasks.append(task)
+        return task
+
+    def run_pending_tasks(self):
+        while self.pending_tasks:
+            tasks, self.pending_tasks = self.pending_tasks, []
+            for task in tasks:
+                if task.cancelled or is_clock_task(task.handler):
+                    continue
+                self.loop.run_until_complete(task.handler(*task.args))
+                task.done = True
+
+    def run_thread(self, handler, *args):
+        handler(*args)
+
+    def close_page(self):
+        if self.on_close is not None:
+            self.on_close(None)
+        self.loop.close()
+
+
+# 子コントロールの一覧
+# Note: Fletのコントロールは_get_childrenで子の一覧を返す
+def get_children(control) -> list:
+    get = getattr(control, "_get_children", None)
+    if get is None:
+        return []
+    return [child for child in get() if child is not None]
+
+
+# 共有クロックの更新ループか
+def is_clock_task(handler) -> bool:
+    return getattr(handler, "__func__", None) is OtpClock.run_bucket
@@ -0,0 +1,81 @@
+import os
+import time
+from pathlib import Path
+
+
+# UIに依存しない共通処理
+# Note: CLIなどから短時間で呼び出せるよう、flet/qrcode/PIL/pyzbarは
+#       ここからは読み込まず、各処理も必要になった時点でimportする
+
+
+# 保存先のパス情報の取得
+def get_app_data_path() -> Path:
+    # アプリ用のデータパス
+    # Note:
+    #   最初はFlet標準の環境変数を取得
+    #   環境変数の設定がない場合はホームディレクトリ以下のフォルダを指定
+    flet_env_path = os.getenv("FLET_APP_STORAGE_DATA")
+    if flet_env_path is not None:
+        return Path(flet_env_path)
+    else:
+        home_path = Path.home()
+        return home_path.joinpath("flet_data")
+
+
+# トークン情報の読み込み
+# Note: 参照のみの場合はread_onlyとし、ファイルへの書き込みを行わない
+#       暗号化保存の場合はunlock_storeで取得したvault_keyを指定
+def open_store(data_path: Path = None, backend: str = None,
+               read_only: bool = False, vault_key=None):
+    from token_store import open_token_store
+
+    return open_token_store(
+        data_path or get_app_data_path(), backend, read_only, vault_key)
+
+
+# 暗号化保存の解錠
+# Note: 暗号化保存でない場合はNoneを返す(パスフレーズの取得も行わない)
+#       get_passphraseは引数なしで呼び出され、パスフレーズを返す
+def unlock_store(data_path: Path = None, get_passphrase=None):
+    from token_store_vault import is_vault, unlock_vault
+
+    data_path = data_path or get_app_data_path()
+    if not is_vault(data_path):
+        return None
+    return unlock_vault(data_path, get_passphrase())
+
+
+# トークンの検索
+# Note: keyの完全一致を優先し、なければuser/issuer/noteの部分一致
+def find_tokens(token_store, query: str) -> list:
+    if query in token_store:
+        return [query]
+
+    from search_index import TokenSearchIndex
+
+    search_index = TokenSearchIndex()
+    search_index.build(token_store.iter_search_records())
+    keys = search_index.search(query)
+    if keys is None:
+        return token_store.keys_in_order()
+    return [key for key in token_store.keys_in_order() if key in keys]
+
+
+# 現在のOTPの取得
+# Note: (key, OTP, 残り秒数)の一覧を返す
+def get_current_codes(token_store, keys: list,
+                      timestamp: float = None) -> list:
+    from otp_engine import OtpEngine
+
+    timestamp = time.time() if timestamp is None else timestamp
+    otp_engine = OtpEngine()
+    otp_keys = []
+    for key in keys:
+        record = token_store[key]
+        otp_keys.append(
+            otp_engine.get_key(record["secret"], record.get("auth_uri")))
+    codes = otp_engine.codes_at(otp_keys, timestamp)
+    return [
+        (key, code, otp_key.period - timestamp % otp_key.period)
+        for key, code, otp_key in zip(keys, codes, otp_keys)
+    ]
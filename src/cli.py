@@ -0,0 +1,263 @@
+import sys
+import argparse
+
+from authenticator_core import (
+    get_app_data_path, open_store, unlock_store, find_tokens,
+    get_current_codes)
+
+
+# パスフレーズの入力
+def read_passphrase() -> str:
+    import getpass
+
+    return getpass.getpass("パスフレーズ: ")
+
+
+# トークン情報の読み込み(暗号化保存の場合は解錠してから読み込み)
+def open_cli_store(args, read_only: bool = False):
+    vault_key = unlock_store(args.data_path, read_passphrase)
+    return open_store(
+        args.data_path, args.backend, read_only=read_only,
+        vault_key=vault_key)
+
+
+# 現在のOTPの表示
+# Note: 1件に絞り込めた場合はOTPのみを出力(シェルスクリプトからの利用向け)
+def command_now(args) -> int:
+    token_store = open_cli_store(args, read_only=True)
+    keys = find_tokens(token_store, args.user)
+    if not keys:
+        print(f"Error: トークンが見つかりません: {args.user}", file=sys.stderr)
+        return 1
+    if len(keys) > 1 and not args.all:
+        print("Error: 複数のトークンが該当します(--allで全件表示):",
+              file=sys.stderr)
+        for key in keys:
+            print(f"  {key}", file=sys.stderr)
+        return 1
+
+    codes = get_current_codes(token_store, keys)
+    if len(codes) == 1:
+        print(codes[0][1])
+    else:
+        for key, code, _ in codes:
+            print(f"{code}\t{key}")
+    return 0
+
+
+# トークン一覧の表示
+def command_list(args) -> int:
+    token_store = open_cli_store(args, read_only=True)
+    for key, info in token_store.items_in_order():
+        print(f"{key}\t{info.get('issuer') or ''}")
+    return 0
+
+
+# トークンの検索
+def command_search(args) -> int:
+    token_store = open_cli_store(args, read_only=True)
+    for key in find_tokens(token_store, args.query):
+        print(key)
+    return 0
+
+
+# QRコード画像からのインポート
+def command_import(args) -> int:
+    from qr_decoder import QrDecoder
+    from qr_import import BulkQrImporter
+
+    def print_progress(count, total, path):
+        print(f"[{count}/{total}] {path}", file=sys.stderr)
+
+    token_store = open_cli_store(args)
+    importer = BulkQrImporter(token_store, QrDecoder())
+    result = importer.run(args.paths, on_progress=print_progress)
+    token_store.close()
+
+    for key in result.imported_keys:
+        print(key)
+    for name, kind in result.unsupported_tokens:
+        print(f"Notice: 未対応の形式のため登録できません({kind}): {name}",
+              file=sys.stderr)
+    print(f"登録: {len(result.imported_keys)}件 / "
+          f"重複: {result.duplicate_count}件 / "
+          f"読み取り失敗: {len(result.failed_paths)}件 / "
+          f"未対応: {len(result.unsupported_tokens)}件", file=sys.stderr)
+    return 0
+
+
+# QRコード画像のエクスポート
+# Note: 出力先が.pdfの場合はPDF、それ以外はフォルダへ出力
+def command_export(args) -> int:
+    from qr_export import QrExporter
+
+    def print_progress(count, total):
+        print(f"[{count}/{total}]", file=sys.stderr)
+
+    token_store = open_cli_store(args, read_only=True)
+    data_path = args.data_path or get_app_data_path()
+    exporter = QrExporter(
+        token_store, data_path, use_cache=not token_store.ENCRYPTED)
+    keys = find_tokens(token_store, args.query) if args.query else None
+    if args.output.lower().endswith(".pdf"):
+        exporter.export_to_pdf(args.output, keys, on_progress=print_progress)
+    else:
+        exporter.export_to_directory(
+            args.output, keys, on_progress=print_progress)
+    exporter.prune_cache()
+    return 0
+
+
+# 差分バックアップの作成
+# Note: 前回のバックアップ以降に変更・削除されたトークンのみ書き出す
+def command_backup(args) -> int:
+    from token_backup import backup_store
+
+    token_store = open_cli_store(args, read_only=True)
+    result = backup_store(token_store, args.output, full=args.full)
+    if result.archive_path is None:
+        print("変更はありません", file=sys.stderr)
+        return 0
+    print(result.archive_path)
+    print(f"{'全件' if result.full else '差分'}: "
+          f"{result.record_count}件 / 削除: {result.tombstone_count}件",
+          file=sys.stderr)
+    return 0
+
+
+# バックアップからの復元
+# Note: keyごとに復元先より新しい内容のみを反映する
+def command_restore(args) -> int:
+    from token_backup import BackupError, restore_store
+
+    token_store = open_cli_store(args)
+    try:
+        result = restore_store(token_store, args.path)
+    except BackupError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        token_store.close()
+
+    for key in result.restored_keys:
+        print(key)
+    print(f"復元: {len(result.restored_keys)}件 / "
+          f"削除: {len(result.removed_keys)}件 / "
+          f"復元先の方が新しい: {len(result.skipped_keys)}件",
+          file=sys.stderr)
+    return 0
+
+
+# OTPの常駐プロセスの起動
+# Note: Ctrl+Cもしくはシグナルで終了するまで待機
+def command_daemon(args) -> int:
+    from otp_daemon import OtpDaemon
+
+    data_path = args.data_path or get_app_data_path()
+    vault_key = unlock_store(data_path, read_passphrase)
+    daemon = OtpDaemon(
+        data_path, socket_path=args.socket, backend=args.backend,
+        vault_key=vault_key, poll_interval=args.poll_interval)
+    print(f"Listening on {daemon.socket_path}", file=sys.stderr)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+# 暗号化保存への移行
+# Note: 移行後は平文の保存ファイルおよびQRコード画像のキャッシュを削除
+def command_encrypt(args) -> int:
+    from token_store_vault import migrate_to_vault
+
+    data_path = args.data_path or get_app_data_path()
+    passphrase = read_passphrase()
+    if passphrase != read_passphrase():
+        print("Error: パスフレーズが一致しません", file=sys.stderr)
+        return 1
+    if not passphrase:
+        print("Error: パスフレーズが空です", file=sys.stderr)
+        return 1
+    token_store = migrate_to_vault(data_path, passphrase, args.backend)
+    token_store.close()
+    print(f"暗号化保存へ移行しました: {len(token_store)}件", file=sys.stderr)
+    return 0
+
+
+# 引数定義
+def make_argument_parser() -> argparse.ArgumentParser:
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(
+        prog="authenticator", description="Authenticatorもどき CLI")
+    parser.add_argument(
+        "--data-path", type=Path, default=None,
+        help="データ保存先(既定: FLET_APP_STORAGE_DATA もしくは ~/flet_data)")
+    parser.add_argument(
+        "--backend", choices=["json", "sqlite"], default=None,
+        help="保存形式(既定: 自動判定)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_now = subparsers.add_parser("now", help="現在のOTPを表示")
+    parser_now.add_argument("user")
+    parser_now.add_argument(
+        "--all", action="store_true", help="複数該当時に全件表示")
+    parser_now.set_defaults(func=command_now)
+
+    parser_list = subparsers.add_parser("list", help="トークン一覧を表示")
+    parser_list.set_defaults(func=command_list)
+
+    parser_search = subparsers.add_parser("search", help="トークンを検索")
+    parser_search.add_argument("query")
+    parser_search.set_defaults(func=command_search)
+
+    parser_import = subparsers.add_parser(
+        "import", help="QRコード画像(ファイル・フォルダ)からインポート")
+    parser_import.add_argument("paths", nargs="+")
+    parser_import.set_defaults(func=command_import)
+
+    parser_export = subparsers.add_parser(
+        "export", help="QRコード画像をフォルダもしくはPDFへ出力")
+    parser_export.add_argument("output")
+    parser_export.add_argument(
+        "--query", default=None, help="出力対象の絞り込み")
+    parser_export.set_defaults(func=command_export)
+
+    parser_encrypt = subparsers.add_parser(
+        "encrypt", help="保存ファイルを暗号化保存へ移行")
+    parser_encrypt.set_defaults(func=command_encrypt)
+
+    parser_backup = subparsers.add_parser(
+        "backup", help="トークン情報の差分バックアップを作成")
+    parser_backup.add_argument(
+        "output", type=Path, help="バックアップ先フォルダ")
+    parser_backup.add_argument(
+        "--full", action="store_true", help="全件バックアップを作成")
+    parser_backup.set_defaults(func=command_backup)
+
+    parser_restore = subparsers.add_parser(
+        "restore", help="バックアップ(フォルダもしくはファイル)から復元")
+    parser_restore.add_argument("path", type=Path)
+    parser_restore.set_defaults(func=command_restore)
+
+    parser_daemon = subparsers.add_parser(
+        "daemon", help="OTPの常駐プロセスを起動(Unixドメインソケット)")
+    parser_daemon.add_argument(
+        "--socket", type=Path, default=None,
+        help="ソケットのパス(既定: データ保存先/otp_daemon.sock)")
+    parser_daemon.add_argument(
+        "--poll-interval", type=float, default=1.0,
+        help="保存ファイルの変更確認の間隔(秒)")
+    parser_daemon.set_defaults(func=command_daemon)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = make_argument_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,40 +1,108 @@
-import flet as ft
 import os
-import json
-import qrcode
-import pyotp
-import pyperclip
-from pathlib import Path
+import flet as ft
+import asyncio
+import time
 from urllib.parse import urlparse, parse_qsl
 
-from otp_text import OtpText
-from otp_timebar import OtpTimeBar
-from view_add import ViewAdd
-from view_edit import ViewEdit
+from authenticator_core import get_app_data_path, unlock_store
+from perf_monitor import perf_monitor, StartupTimer
+from shared_state import acquire_shared_state, release_shared_state
+from token_list_view import TokenListView
+from token_row import TokenRow, TokenRowPool
+from token_store_vault import VaultUnlockError, is_vault
 
 
-# 保存先のパス情報の取得
-def get_app_data_path() -> Path:
-    # アプリ用のデータパス
-    # Note:
-    #   最初はFlet標準の環境変数を取得
-    #   環境変数の設定がない場合はホームディレクトリ以下のフォルダを指定
-    flet_env_path = os.getenv("FLET_APP_STORAGE_DATA")
-    if flet_env_path is not None:
-        return Path(flet_env_path)
-    else:
-        home_path = Path.home()
-        return home_path.joinpath("flet_data")
+# 検索入力時の待機時間(秒)
+SEARCH_DEBOUNCE_SEC = 0.15
+
+# 変更通知を行単位で反映する最大のトークン数
+# Note: これより多くまとめて変更された場合(一括追加・復元など)は全件を同期
+SYNC_ROWS_LIMIT = 32
+
+
+# 暗号化保存の解錠画面
+# Note: 鍵導出(scrypt)はUIスレッド外で1回のみ実行し、
+#       解錠できた場合はon_unlockに解錠済みの鍵を渡す
+def show_unlock_page(page: ft.Page, app_data_path, on_unlock):
+    page.title = "Authenticatorもどき"
+    text_field_passphrase = ft.TextField(
+        label="パスフレーズ", password=True, can_reveal_password=True,
+        width=400, autofocus=True,
+        on_submit=lambda _: event_unlock())
+    button_unlock = ft.ElevatedButton(
+        "解錠", on_click=lambda _: event_unlock())
+    text_error = ft.Text("", color=ft.Colors.RED)
+
+    def event_unlock():
+        button_unlock.disabled = True
+        text_error.value = ""
+        page.update(button_unlock, text_error)
+        page.run_thread(run_unlock, text_field_passphrase.value or "")
+
+    def run_unlock(passphrase):
+        try:
+            vault_key = unlock_store(app_data_path, lambda: passphrase)
+        except VaultUnlockError:
+            text_field_passphrase.value = ""
+            text_error.value = "パスフレーズが違います"
+            button_unlock.disabled = False
+            page.update(text_field_passphrase, text_error, button_unlock)
+            return
+        page.controls.clear()
+        on_unlock(vault_key)
+
+    page.add(ft.Column(controls=[
+        ft.Text("保存データは暗号化されています"),
+        text_field_passphrase, button_unlock, text_error]))
+    page.update()
 
 
 # main関数
+# Note: 暗号化保存の場合は解錠画面を表示し、解錠後にトップページを表示
+#       (起動時間の計測は解錠後から開始)
 def main(page: ft.Page):
+    app_data_path = get_app_data_path()
+    if is_vault(app_data_path):
+        show_unlock_page(
+            page, app_data_path,
+            on_unlock=lambda vault_key: show_main_page(
+                page, vault_key, StartupTimer()))
+    else:
+        show_main_page(page, startup_timer=StartupTimer())
+
+
+# トップページの表示
+# Note: トークン情報は先頭の一部のみ読み込んだ時点で最初の画面を表示し、
+#       残りは読み込みの完了通知("load")を受けて差分反映する
+#       startup_timerには起動処理の段階ごとの経過時間を記録する
+#       (store_first: 先頭の読み込み、first_paint: 最初の画面表示、
+#       store_full: 全件の表示)
+def show_main_page(page: ft.Page, vault_key=None, startup_timer=None):
+    startup_timer = startup_timer or StartupTimer()
+
     # トップページ設定
     page.title = "Authenticatorもどき"
     page.appbar = ft.AppBar(
         title=ft.Text("Authenticatorもどき"),
-        actions=[ft.IconButton(
-            ft.Icons.ADD, on_click=lambda _: page.go("/add"))]
+        actions=[
+            ft.IconButton(
+                ft.Icons.SPEED, visible=perf_monitor.enabled,
+                on_click=lambda _: event_toggle_perf_overlay()),
+            ft.IconButton(
+                ft.Icons.ADD, on_click=lambda _: page.go("/add")),
+            ft.PopupMenuButton(items=[
+                ft.PopupMenuItem(
+                    text="QRコード一括保存(PNG)",
+                    on_click=lambda _:
+                        dialog_select_export_directory.get_directory_path(
+                            "QRコード画像保存先フォルダの指定")),
+                ft.PopupMenuItem(
+                    text="QRコード一括保存(PDF)",
+                    on_click=lambda _: dialog_select_export_pdf_path.save_file(
+                        "PDF保存先の指定", file_name="qrcodes.pdf",
+                        allowed_extensions=["pdf"])),
+            ])
+        ]
     )
 
     # ウィンドウサイズの設定
@@ -44,101 +112,188 @@ def main(page: ft.Page):
     # アプリ用のデータパス
     # Note: Fletの標準の保存用パスを利用
     app_data_path = get_app_data_path()
-    token_data_json_path = app_data_path.joinpath("token_data.json")
 
-    # トークン情報のファイル読み込みおよびdictの初期化
-    token_data_dict = {}
-    if token_data_json_path.exists():
-        with open(token_data_json_path, "r", encoding="utf-8") as f:
-            token_data_dict = json.load(f)
-
-    # JSONファイルへの保存
-    def save_token_data_json():
-        # データ保存用のフォルダ作成
-        if not app_data_path.exists():
-            app_data_path.mkdir()
-
-        # 並び順の保存
-        # Note: 検索中でListViewのアイテム数減少の場合は値を保存しない
-        if len(token_data_dict) == len(list_view_token_info.controls):
-            for index, container in enumerate(
-                    list_view_token_info.controls, start=1):
-                key = container.data
-                token_data_dict[key]["index"] = index
-
-        # ファイルの保存処理
-        with open(token_data_json_path, "w", encoding="utf-8") as f:
-            json_str = json.dumps(token_data_dict, indent=4)
-            f.write(json_str)
+    # プロセス内で共有するトークン情報・OTPの計算処理・検索インデックス
+    # Note: Webモードで複数のセッションが接続しても読み込みは1回のみで、
+    #       変更は通知によって各セッションの表示へ差分反映する
+    # Note: QRコードの読み取り・出力処理は初回の利用時に作成される
+    shared_state = acquire_shared_state(app_data_path, page, vault_key)
+    otp_engine = shared_state.otp_engine
+    otp_clock = shared_state.otp_clock
+    token_store = shared_state.token_store
+    token_search_index = shared_state.search_index
+    startup_timer.mark("store_first")
+
+    # 行データの生成
+    # Note: 行の表示内容は表示中の行数分のみ生成して使い回し、
+    #       イベント処理は全行で共通の関数を利用する
+    token_row_pool = TokenRowPool(
+        token_store, otp_clock,
+        on_click_qrcode=lambda e: event_click_qrcode_button(e),
+        on_click_edit=lambda e: event_click_edit_button(e),
+        on_click_remove=lambda e: event_click_remove_button(e),
+        on_long_press=lambda e: event_long_press_token_info(e))
 
     # トークン情報描画処理
-    def update_token_info_containers(query=""):
-        list_view_items_list = []
-
-        # 行データの再描画処理
-        for key, info in sorted(
-                token_data_dict.items(), key=lambda x: x[1]["index"]):
-            if query == "" or query in info["user"]:
-                # OTP情報の行データ定義
-                # Note: 名称表示に加えて、QRコードDL・編集・削除ボタンを設定
-                row_top = ft.Row(controls=[
-                    ft.Text(info["user"], width=300, size=16),
-                    ft.IconButton(
-                        ft.Icons.QR_CODE, data=key,
-                        on_click= lambda e: \
-                            dialog_select_qrcode_save_path.save_file(
-                                "QRコード画像保存先の指定",
-                                allowed_extensions=["png"])),
-                    ft.IconButton(
-                        ft.Icons.EDIT, data=key,
-                        on_click=lambda e: event_click_edit_button(e)),
-                    ft.IconButton(
-                        ft.Icons.REMOVE, data=key,
-                        on_click=lambda e: event_click_remove_button(e))
-                ])
-                row_otp = ft.Row(controls=[OtpText(info["secret"])])
-                row_spacer1 = ft.Row(controls=[ft.Divider(height=15)])
-                row_spacer2 = ft.Row(controls=[ft.Divider(height=30)])
-
-                # OTPの有効期限を表示する残り時間のバー表示
-                row_otp_time_bar = ft.Row(controls=[OtpTimeBar()])
-
-                # Columnおよびコンテナの定義
-                token_info_column = ft.Column(controls=[
-                    row_top, row_otp, row_spacer1,
-                    row_otp_time_bar, row_spacer2
-                ])
-                token_info_container = ft.Container(
-                    content=token_info_column, data=key,
-                    on_long_press=lambda e: event_long_press_token_info(e))
-
-                # リストへの行追加
-                list_view_items_list.append(token_info_container)
-
-        list_view_token_info.controls = list_view_items_list
-        list_view_token_info.update()
+    # Note: 変更のあった行のみ差分反映(TokenListView側で制御)
+    #       検索中の場合は検索結果に応じて表示・非表示を切り替え
+    def update_token_info_containers():
+        with perf_monitor.measure("list.render"):
+            items = token_store.items_in_order()
+            list_view_token_info.sync(items, update=False)
+            keys = token_search_index.search(text_field_query.value or "")
+            list_view_token_info.apply_filter(keys, update=False)
+            list_view_token_info.update()
+
+    # 変更のあったトークンの行のみの描画処理
+    # Note: 概要情報・並び順の位置はストアのロック内でまとめて取得
+    def update_token_rows(keys):
+        with perf_monitor.measure("list.render"):
+            query = text_field_query.value or ""
+            removed_keys = []
+            items = []
+            with token_store.lock:
+                for key in keys:
+                    info = token_store.get_summary(key)
+                    if info is None:
+                        removed_keys.append(key)
+                        continue
+                    items.append((
+                        key, info, token_store.find_order_position(key),
+                        token_search_index.matches(key, query)))
+            list_view_token_info.apply_changes(removed_keys, items)
+
+    # トークン情報の変更通知(他のセッションでの変更を含む)
+    # Note: 通知は変更したセッションのスレッドで呼び出されるため、
+    #       このセッションのタスクとして差分反映を予約し、連続した変更は
+    #       1回の反映にまとめる
+    #       追加・更新・削除・移動は変更のあった行のみ反映し、
+    #       読み込み完了時・一括の変更時のみ全件を同期する
+    #       他のインスタンスとの競合時は追加したトークン名を通知する
+    sync_requested = False
+    full_sync_requested = False
+    load_notified = token_store.loaded.is_set()
+    changed_keys = {}
+    conflict_keys = []
+
+    def event_change_token_store(event, key, item):
+        nonlocal sync_requested, full_sync_requested, load_notified
+        if event == "load":
+            load_notified = True
+        if event == "conflict":
+            conflict_keys.append(key)
+        elif event in ("add", "update", "remove", "order"):
+            changed_keys[key] = True
+        else:
+            full_sync_requested = True
+        if sync_requested:
+            return
+        sync_requested = True
+        page.run_task(run_sync_token_info)
+
+    async def run_sync_token_info():
+        nonlocal sync_requested, full_sync_requested
+        sync_requested = False
+        keys = list(changed_keys)
+        for key in keys:
+            changed_keys.pop(key, None)
+        full_sync, full_sync_requested = full_sync_requested, False
+        if page.route == "/":
+            if full_sync or len(keys) > SYNC_ROWS_LIMIT:
+                update_token_info_containers()
+            elif keys:
+                update_token_rows(keys)
+        if load_notified:
+            startup_timer.mark("store_full")
+        if conflict_keys:
+            names = ", ".join(conflict_keys)
+            conflict_keys.clear()
+            page.open(ft.SnackBar(ft.Text(
+                f"他で変更された内容と競合したため別名で保存しました: {names}")))
+
+    token_store.add_listener(event_change_token_store)
 
     # 検索時の動作
-    def event_search_token_info(e):
-        query = e.control.value
-        update_token_info_containers(query)
+    # Note: 入力ごとに一定時間待機してから検索し、古い検索は中断する
+    search_task = None
+
+    def event_search_token_info(e, delay=0.0):
+        nonlocal search_task
+        if search_task is not None:
+            search_task.cancel()
+        search_task = page.run_task(
+            run_search_token_info, e.control.value or "", delay)
+
+    async def run_search_token_info(query, delay):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        with perf_monitor.measure("list.search"):
+            keys = token_search_index.search(query)
+            list_view_token_info.apply_filter(keys)
 
     # QRコードファイル保存先パスの指定
+    # Note: 画像の生成・保存はUIスレッド外で実行
     def event_save_qrcode(e: ft.FilePickerResultEvent):
         if e.path:
             # QRコード化対象情報の取得
             key = e.control.data
-            auth_uri = token_data_dict[key]["auth_uri"]
 
             # QRコード画像生成と保存
-            qr = qrcode.QRCode()
-            qr.add_data(auth_uri)
-            qr.make()
-            img = qr.make_image()
-            img.save(e.path)
+            page.run_thread(shared_state.qr_exporter.export_one, key, e.path)
         else:
             print("Notice: QRコード画像ファイル保存がキャンセルされました")
 
+    # QRコード一括保存先の指定
+    def event_export_qrcode_directory(e: ft.FilePickerResultEvent):
+        if e.path:
+            page.run_thread(
+                run_export_qrcodes,
+                shared_state.qr_exporter.export_to_directory, e.path)
+        else:
+            print("Notice: QRコード画像一括保存がキャンセルされました")
+
+    def event_export_qrcode_pdf(e: ft.FilePickerResultEvent):
+        if e.path:
+            page.run_thread(
+                run_export_qrcodes,
+                shared_state.qr_exporter.export_to_pdf, e.path)
+        else:
+            print("Notice: QRコード画像一括保存がキャンセルされました")
+
+    # QRコード一括保存処理
+    # Note: 進捗をダイアログに表示し、完了後に不要なキャッシュを削除
+    #       失敗した場合もダイアログを閉じ、エラー内容をSnackBarで表示
+    def run_export_qrcodes(export_func, output_path):
+        progress_bar = ft.ProgressBar(width=300, value=0)
+        progress_text = ft.Text("QRコード画像を作成中...")
+        dialog = ft.AlertDialog(
+            modal=True,
+            content=ft.Column(
+                controls=[progress_text, progress_bar], tight=True))
+        page.open(dialog)
+
+        def update_progress(count, total):
+            progress_bar.value = count / total if total else 1
+            progress_text.value = f"QRコード画像を作成中... {count}/{total}"
+            page.update(progress_bar, progress_text)
+
+        try:
+            export_func(output_path, on_progress=update_progress)
+            shared_state.qr_exporter.prune_cache()
+        except Exception as e:
+            print(f"Error: QRコード画像の一括保存に失敗しました: {e}")
+            message = f"QRコード画像の保存に失敗しました: {e}"
+        else:
+            message = "QRコード画像を保存しました"
+        finally:
+            page.close(dialog)
+        page.open(ft.SnackBar(ft.Text(message)))
+
+    def event_click_qrcode_button(e):
+        dialog_select_qrcode_save_path.data = e.control.data
+        dialog_select_qrcode_save_path.save_file(
+            "QRコード画像保存先の指定", allowed_extensions=["png"])
+
     def event_click_edit_button(e):
         key = e.control.data
         page.go("/edit", key=key)
@@ -153,8 +308,7 @@ def main(page: ft.Page):
                 ft.TextButton(
                     "Yes",
                     on_click=lambda _: [
-                          token_data_dict.pop(key),
-                          update_token_info_containers(),
+                          token_store.remove(key),
                           page.close(dialog)]),
                 ft.TextButton(
                     "No",
@@ -165,35 +319,43 @@ def main(page: ft.Page):
         page.open(dialog)
 
     # 並び替え時の動作
-    # Note: controls内の要素のindex入れ替え処理
+    # Note: 移動したトークンのindexのみ更新(検索中は表示中の行の前後に配置)
     def event_sort_token_info(e):
-        # 見た目上の入れ替え処理
-        controls = e.control.controls
-        controls[e.old_index], controls[e.new_index] = \
-            controls[e.new_index], controls[e.old_index]
-
-        # indexの入れ替え処理
-        key1 = controls[e.old_index].data
-        key2 = controls[e.new_index].data
-        token_data_dict[key1]["index"], token_data_dict[key2]["index"] = \
-            token_data_dict[key2]["index"], token_data_dict[key1]["index"]
-
-        # ページの更新・index情報の保存
+        # 見た目上の移動処理
+        key, after_key, before_key = \
+            list_view_token_info.move_row(e.old_index, e.new_index)
+
+        # 並び順の保存
+        token_store.move(key, after_key=after_key, before_key=before_key)
+
+        # ページの更新
+        list_view_token_info.refresh_window(update=False)
         page.update()
-        save_token_data_json()
 
     # 長くクリックしたときの動作
     # Note: 現在のOTPの文字列をクリップボードに保存
     def event_long_press_token_info(e):
+        import pyperclip
+
         key = e.control.data
-        totp = pyotp.TOTP(token_data_dict[key]["secret"])
-        current_otp = str(totp.now())
+        record = token_store[key]
+        otp_key = otp_engine.get_key(
+            record["secret"], record.get("auth_uri"), owner=key)
+        if not otp_key.valid:
+            page.open(ft.SnackBar(ft.Text(
+                "秘密鍵が不正なためワンタイムパスワードを計算できません")))
+            return
+        current_otp = otp_engine.codes_at([otp_key], time.time())[0]
         pyperclip.copy(current_otp)
         show_text = ft.Text("ワンタイムパスワードをコピーしました")
         page.open(ft.SnackBar(show_text))
 
     # routeごとの分岐処理
+    # Note: 追加・編集画面は初回の表示時に読み込む
     def route_change(route: str):
+        from view_add import ViewAdd
+        from view_edit import ViewEdit
+
         u = urlparse(page.route)
         path = u.path
 
@@ -202,13 +364,12 @@ def main(page: ft.Page):
             page.views.clear()
             page.views.append(root_view)
             update_token_info_containers()
-            save_token_data_json()
         elif path == "/add":
-            view_add = ViewAdd(token_data_dict)
+            view_add = ViewAdd(token_store, shared_state.qr_decoder)
             page.views.append(view_add)
         elif path == "/edit":
             params = dict(parse_qsl(u.query))
-            view_edit = ViewEdit(token_data_dict, params["key"])
+            view_edit = ViewEdit(token_store, params["key"])
             page.views.append(view_edit)
 
         page.update()
@@ -224,30 +385,93 @@ def main(page: ft.Page):
     page.on_route_change = route_change
     page.on_view_pop = view_pop
 
+    # 性能計測の表示(環境変数AUTHENTICATOR_PERFの指定時のみ)
+    # Note: アプリバーのボタンで表示を切り替え、表示中のみ1秒ごとに
+    #       直近1秒間の回数と所要時間の分布を更新する
+    text_perf_overlay = ft.Text(
+        "", size=11, font_family="monospace", color=ft.Colors.WHITE)
+    container_perf_overlay = ft.Container(
+        content=text_perf_overlay, visible=False, right=10, bottom=10,
+        padding=8, border_radius=6,
+        bgcolor=ft.Colors.with_opacity(0.85, ft.Colors.BLACK))
+    perf_overlay_running = False
+
+    def event_toggle_perf_overlay():
+        nonlocal perf_overlay_running
+        container_perf_overlay.visible = not container_perf_overlay.visible
+        container_perf_overlay.update()
+        if container_perf_overlay.visible and not perf_overlay_running:
+            perf_overlay_running = True
+            page.run_task(run_perf_overlay)
+
+    async def run_perf_overlay():
+        nonlocal perf_overlay_running
+        previous = perf_monitor.snapshot()
+        while container_perf_overlay.visible:
+            await asyncio.sleep(1.0)
+            previous = perf_monitor.snapshot(previous)
+            text_perf_overlay.value = perf_monitor.format_summary(previous)
+            if container_perf_overlay.visible:
+                text_perf_overlay.update()
+        perf_overlay_running = False
+
+    # セッション終了時の処理
+    # Note: 最後のセッションの終了時に未保存の変更を書き出す
+    def event_close_page(e):
+        container_perf_overlay.visible = False
+        token_store.remove_listener(event_change_token_store)
+        otp_clock.unsubscribe_page(page)
+        release_shared_state(shared_state, page)
+
+    page.on_close = event_close_page
+
     # FilePickerの定義
     # Note: appendによるpage/viewへの追加がないとエラー発生
     dialog_select_qrcode_save_path = \
         ft.FilePicker(on_result=event_save_qrcode)
     page.overlay.append(dialog_select_qrcode_save_path)
+    dialog_select_export_directory = \
+        ft.FilePicker(on_result=event_export_qrcode_directory)
+    page.overlay.append(dialog_select_export_directory)
+    dialog_select_export_pdf_path = \
+        ft.FilePicker(on_result=event_export_qrcode_pdf)
+    page.overlay.append(dialog_select_export_pdf_path)
+    if perf_monitor.enabled:
+        page.overlay.append(container_perf_overlay)
 
     # 検索用テキストフィールドの追加
     text_field_query = ft.TextField(
         label="検索", width=400,
+        on_change=lambda e: event_search_token_info(
+            e, delay=SEARCH_DEBOUNCE_SEC),
         on_submit=lambda e: event_search_token_info(e))
     row_text_field_query = ft.Row(controls=[text_field_query])
     page.add(row_text_field_query)
 
     # 表示用ListViewの定義と各行の表示
-    list_view_token_info = ft.ReorderableListView(
+    list_view_token_info = TokenListView(
+        row_height=TokenRow.ROW_HEIGHT, create_row=token_row_pool.create_row,
+        virtualized=True,
         width=500, height=750,
         on_reorder=lambda e: event_sort_token_info(e))
     page.add(list_view_token_info)
     update_token_info_containers()
 
     # pageの表示
+    # Note: 読み込みが完了済みの場合(2つ目以降のセッションなど)は
+    #       この時点で全件が表示されている
     page.update()
+    startup_timer.mark("first_paint")
+    if token_store.loaded.is_set():
+        startup_timer.mark("store_full")
 
 
 # main関数
+# Note: 環境変数AUTHENTICATOR_WEB_PORTの指定時はWebモードで起動し、
+#       複数のセッションでトークン情報を共有する
 if __name__ == "__main__":
-    ft.app(target=main)
+    web_port = os.getenv("AUTHENTICATOR_WEB_PORT")
+    if web_port:
+        ft.app(target=main, view=ft.AppView.WEB_BROWSER, port=int(web_port))
+    else:
+        ft.app(target=main)
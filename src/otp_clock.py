@@ -0,0 +1,201 @@
+import time
+import asyncio
+import threading
+
+from otp_engine import OtpEngine
+from perf_monitor import perf_monitor
+
+
+# 周期ごとの購読者をまとめるバケット
+# Note: 同じperiodのトークンは同じ境界で値が切り替わるため1つのループで処理
+#       共有時はセッション(page)ごとに分け、pageにはそのセッションのpageを持つ
+class OtpClockBucket:
+    def __init__(self, period: int, page=None):
+        self.period = period
+        self.page = page
+        self.texts = set()
+        self.bars = set()
+        self.counter = None
+        self.prefetched = False
+        self.running = False
+
+    def is_empty(self) -> bool:
+        return not self.texts and not self.bars
+
+
+# OTP表示用の共有クロック
+# Note: 行ごとのループの代わりに周期ごとに1つのタスクのみ起動し、
+#       時間ステップの境界でのみOTPを再計算してまとめてpageを更新する
+#       境界の少し前に次の時間ステップ分のOTPを先読み計算しておく
+#       pageを指定しない場合は複数セッションで共有するものとし、
+#       バケット(更新ループ)はセッションごとに分けてそのpage上で動かす
+#       (1つのセッションの更新の失敗・切断が他のセッションに影響しない)
+#       OTPの計算結果はOtpEngineのキャッシュにより全セッションで共有される
+class OtpClock:
+    def __init__(self, page=None, otp_engine: OtpEngine = None,
+                 bar_interval: float = 0.5, prefetch_lead: float = 1.0):
+        self.page = page
+        self.otp_engine = otp_engine or OtpEngine()
+        self.bar_interval = bar_interval
+        self.prefetch_lead = prefetch_lead
+        self.buckets = {}
+        self.control_buckets = {}
+        self.lock = threading.Lock()
+
+    # OTPテキストの登録・解除
+    def subscribe_text(self, control):
+        bucket = self.get_bucket(control.period, control.page)
+        control.value = self.otp_engine.code_now(control.otp_key)
+        with self.lock:
+            bucket.texts.add(control)
+            self.control_buckets[control] = bucket
+        self.start_bucket(bucket)
+
+    def unsubscribe_text(self, control):
+        with self.lock:
+            bucket = self.control_buckets.pop(control, None)
+            if bucket is not None:
+                bucket.texts.discard(control)
+
+    # 残り時間バーの登録・解除
+    def subscribe_bar(self, control):
+        bucket = self.get_bucket(control.period, control.page)
+        control.value = self.compute_bar_value(control.period, time.time())
+        with self.lock:
+            bucket.bars.add(control)
+            self.control_buckets[control] = bucket
+        self.start_bucket(bucket)
+
+    def unsubscribe_bar(self, control):
+        with self.lock:
+            bucket = self.control_buckets.pop(control, None)
+            if bucket is not None:
+                bucket.bars.discard(control)
+
+    # セッション終了時の登録解除
+    # Note: 終了したpageのコントロールはwill_unmountが呼ばれないためまとめて解除
+    #       共有時はそのセッションのバケットごと破棄する
+    def unsubscribe_page(self, page):
+        with self.lock:
+            for bucket_key, bucket in list(self.buckets.items()):
+                for control in bucket.texts | bucket.bars:
+                    if control.page is page or bucket.page is page:
+                        bucket.texts.discard(control)
+                        bucket.bars.discard(control)
+                        self.control_buckets.pop(control, None)
+                if bucket.page is page:
+                    del self.buckets[bucket_key]
+
+    # 周期(共有時は周期・セッション)ごとのバケットの取得
+    def get_bucket(self, period: int, page=None) -> OtpClockBucket:
+        page = self.page or page
+        with self.lock:
+            bucket = self.buckets.get((period, page))
+            if bucket is None:
+                bucket = OtpClockBucket(period, page)
+                self.buckets[(period, page)] = bucket
+            return bucket
+
+    # バケット用タスクの起動
+    # Note: すでに起動済みの場合は何もしない
+    def start_bucket(self, bucket: OtpClockBucket):
+        with self.lock:
+            if bucket.running:
+                return
+            bucket.running = True
+        bucket.page.run_task(self.run_bucket, bucket)
+
+    # バケットのpageへのまとめての更新
+    # Note: 更新に失敗した場合(切断されたセッションなど)も以降の更新ループは
+    #       止めず、エラー内容のみ出力する
+    #       更新までの間に画面から外されたコントロールは対象外とする
+    def update_controls(self, controls: list, page):
+        perf_monitor.count("clock.controls_updated", len(controls))
+        controls = [control for control in controls
+                    if control.page is not None]
+        try:
+            page.update(*controls)
+        except Exception as e:
+            print(f"Error: OTP表示の更新に失敗しました: {e!r}")
+
+    # バー表示値の計算
+    def compute_bar_value(self, period: int, now: float) -> float:
+        return (now % period) / period
+
+    # バケットごとの更新ループ
+    # Note: 次の境界(もしくはバー更新時刻)まで待機し、購読者がいなくなれば終了
+    #       計測時は1回分の処理時間と、予定時刻からの遅れを記録
+    #       例外・タスクの中断で終了した場合も起動中の状態を戻し、
+    #       次の購読時にループを起動し直せるようにする
+    async def run_bucket(self, bucket: OtpClockBucket):
+        finished = False
+        try:
+            while True:
+                start = time.perf_counter()
+                next_time = self.tick(bucket)
+                perf_monitor.observe(
+                    "clock.tick", time.perf_counter() - start)
+                if next_time is None:
+                    finished = True
+                    return
+                await asyncio.sleep(max(0.0, next_time - time.time()))
+                perf_monitor.observe(
+                    "clock.tick_lag", max(0.0, time.time() - next_time))
+        finally:
+            if not finished:
+                with self.lock:
+                    bucket.running = False
+                    bucket.counter = None
+
+    # バケットの1回分の更新処理
+    # Note: 次の更新時刻を返す(購読者がいなくなった場合はNone)
+    def tick(self, bucket: OtpClockBucket):
+        period = bucket.period
+        with self.lock:
+            if bucket.is_empty():
+                bucket.running = False
+                bucket.counter = None
+                return None
+            texts = list(bucket.texts)
+            bars = list(bucket.bars)
+
+        now = time.time()
+        counter = int(now // period)
+        changed_controls = []
+
+        # OTPの再計算
+        # Note: 時間ステップが変わった場合のみ、値の変化した行のみ対象
+        #       先読み済みの場合は計算済みの値を利用
+        otp_keys = [control.otp_key for control in texts]
+        if counter != bucket.counter:
+            bucket.counter = counter
+            bucket.prefetched = False
+            codes = self.otp_engine.compute_codes(otp_keys, counter)
+            for control, otp in zip(texts, codes):
+                if otp != control.value:
+                    control.value = otp
+                    changed_controls.append(control)
+            self.otp_engine.prune(now)
+
+        for control in bars:
+            control.value = self.compute_bar_value(period, now)
+            changed_controls.append(control)
+
+        # まとめてページ更新
+        if changed_controls:
+            self.update_controls(changed_controls, bucket.page)
+
+        # 次の時間ステップ分の先読み
+        next_boundary = (counter + 1) * period
+        prefetch_time = next_boundary - self.prefetch_lead
+        if not bucket.prefetched and time.time() >= prefetch_time:
+            self.otp_engine.prefetch(otp_keys, counter)
+            bucket.prefetched = True
+
+        # 次の更新時刻
+        next_time = next_boundary
+        if not bucket.prefetched:
+            next_time = min(next_time, prefetch_time)
+        if bars:
+            next_time = min(next_time, now + self.bar_interval)
+        return next_time
@@ -0,0 +1,386 @@
+import os
+import json
+import time
+import socket
+import struct
+import threading
+import socketserver
+from pathlib import Path
+
+from otp_engine import OtpEngine
+from token_store import (
+    TokenStore, open_token_store, SQLITE_FILE_NAME, VAULT_FILE_NAME,
+    VAULT_JOURNAL_FILE_NAME)
+
+
+# 常駐プロセス用のソケットのファイル名
+DAEMON_SOCKET_FILE_NAME = "otp_daemon.sock"
+
+# 通信フレームの形式
+# Note: 4バイト(ビッグエンディアン)の長さ + UTF-8のJSON本体
+FRAME_HEADER = struct.Struct(">I")
+MAX_FRAME_SIZE = 1024 * 1024
+
+
+# フレームの送信
+def send_frame(sock: socket.socket, message: dict):
+    body = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    sock.sendall(FRAME_HEADER.pack(len(body)) + body)
+
+
+# 指定バイト数の受信
+# Note: 先頭で接続が閉じられた場合はNoneを返す
+def recv_exact(sock: socket.socket, size: int):
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            if remaining == size:
+                return None
+            raise ConnectionError("Connection closed in the middle of frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+# フレームの受信
+# Note: 接続が閉じられた場合はNoneを返す
+def recv_frame(sock: socket.socket):
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame too large: {size} bytes")
+    body = recv_exact(sock, size) if size else b""
+    if body is None:
+        raise ConnectionError("Connection closed in the middle of frame")
+    return json.loads(body.decode("utf-8"))
+
+
+# 保存ファイルの変更検知用の情報
+# Note: 各ファイルの(更新時刻, サイズ)の組を比較に利用
+def get_store_signature(data_path: Path) -> tuple:
+    signature = []
+    for name in (TokenStore.SNAPSHOT_FILE_NAME,
+                 TokenStore.JOURNAL_FILE_NAME,
+                 SQLITE_FILE_NAME, SQLITE_FILE_NAME + "-wal",
+                 VAULT_FILE_NAME, VAULT_JOURNAL_FILE_NAME):
+        try:
+            stat = data_path.joinpath(name).stat()
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+# 常駐プロセスで保持するOTPの計算状態
+# Note: UIと同じプロセスで動かす場合はトークン情報の変更通知から差分を反映し、
+#       単独で動かす場合は保存ファイルの変更を監視して読み取り専用で再読み込み
+#       (秘密鍵・auth_uriが変わったトークンのみ鍵を作り直す)
+#       暗号化保存の場合は解錠済みのvault_keyを再読み込みにも使い回す
+class OtpDaemonState:
+    def __init__(self, data_path: Path, token_store=None, backend: str = None,
+                 otp_engine: OtpEngine = None, vault_key=None):
+        self.data_path = data_path
+        self.backend = backend
+        self.vault_key = vault_key
+        self.token_store = token_store
+        self.shared_store = token_store is not None
+        self.otp_engine = otp_engine or OtpEngine()
+        self.sources = {}
+        self.otp_keys = {}
+        self.signature = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.shared_store:
+            self.apply_records(self.token_store.items())
+            self.token_store.add_listener(self.event_change_token_store)
+        else:
+            self.reload()
+        return self
+
+    def close(self):
+        if self.shared_store:
+            self.token_store.remove_listener(self.event_change_token_store)
+        elif self.token_store is not None:
+            self.token_store.close()
+            self.token_store = None
+
+    # 鍵の一覧への差分の反映
+    def apply_records(self, records, full: bool = True) -> int:
+        sources = dict(self.sources) if not full else {}
+        for key, record in records:
+            sources[key] = (record["secret"], record.get("auth_uri"))
+
+        otp_keys = {}
+        changed = 0
+        for key, source in sources.items():
+            otp_key = self.otp_keys.get(key)
+            if otp_key is None or self.sources.get(key) != source:
+                otp_key = self.otp_engine.get_key(*source, owner=key)
+                changed += 1
+            otp_keys[key] = otp_key
+        removed_keys = self.otp_keys.keys() - otp_keys.keys()
+        for key in removed_keys:
+            self.otp_engine.release_key(key)
+        changed += len(removed_keys)
+
+        with self.lock:
+            self.sources = sources
+            self.otp_keys = otp_keys
+        return changed
+
+    def remove_record(self, key: str):
+        self.otp_engine.release_key(key)
+        with self.lock:
+            self.sources = {
+                k: v for k, v in self.sources.items() if k != key}
+            self.otp_keys = {
+                k: v for k, v in self.otp_keys.items() if k != key}
+
+    # トークン情報の変更通知(UIと同じプロセスの場合)
+    def event_change_token_store(self, event, key, item):
+        if event == "remove":
+            self.remove_record(key)
+        elif event in ("add", "update"):
+            record = item if "secret" in item else self.token_store[key]
+            self.apply_records([(key, record)], full=False)
+
+    # 保存ファイルからの再読み込み(単独で動かす場合)
+    # Note: 保存ファイルが変わっていない場合は何もしない
+    def reload(self) -> bool:
+        signature = get_store_signature(self.data_path)
+        if signature == self.signature:
+            return False
+        token_store = open_token_store(
+            self.data_path, self.backend, read_only=True,
+            vault_key=self.vault_key)
+        self.apply_records(token_store.items())
+        if self.token_store is not None:
+            self.token_store.close()
+        self.token_store = token_store
+        self.signature = signature
+        return True
+
+    # 現在・次の時間ステップ分のOTPの事前計算
+    def precompute(self, timestamp: float = None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            otp_keys = list(self.otp_keys.values())
+        by_period = {}
+        for otp_key in otp_keys:
+            by_period.setdefault(otp_key.period, []).append(otp_key)
+        for period, keys in by_period.items():
+            counter = int(timestamp // period)
+            self.otp_engine.compute_codes(keys, counter)
+            self.otp_engine.prefetch(keys, counter)
+        self.otp_engine.prune(timestamp)
+
+    # 次に時間ステップが切り替わる時刻
+    def next_boundary(self, timestamp: float) -> float:
+        with self.lock:
+            periods = {otp_key.period for otp_key in self.otp_keys.values()}
+        if not periods:
+            return float("inf")
+        return min((timestamp // period + 1) * period for period in periods)
+
+    # 複数トークンのOTPの取得
+    # Note: usersを省略した場合は全件を返す
+    def lookup(self, users: list = None, timestamp: float = None) -> dict:
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            otp_keys = self.otp_keys
+        if users is None:
+            users = list(otp_keys)
+
+        found = [user for user in users if user in otp_keys]
+        keys = [otp_keys[user] for user in found]
+        codes = self.otp_engine.codes_at(keys, timestamp)
+        next_codes = [
+            self.otp_engine.compute_codes(
+                [otp_key], otp_key.counter_at(timestamp) + 1)[0]
+            for otp_key in keys
+        ]
+
+        result = {"codes": {}, "errors": {}}
+        for user, otp_key, code, next_code in zip(
+                found, keys, codes, next_codes):
+            result["codes"][user] = {
+                "code": code,
+                "next_code": next_code,
+                "remaining": otp_key.period - timestamp % otp_key.period,
+            }
+        for user in users:
+            if user not in otp_keys:
+                result["errors"][user] = "not found"
+        return result
+
+    # 要求の処理
+    def handle_request(self, request) -> dict:
+        if not isinstance(request, dict):
+            return {"error": "request must be an object"}
+        users = request.get("users")
+        if users is not None and not (
+                isinstance(users, list)
+                and all(isinstance(user, str) for user in users)):
+            return {"error": "users must be a list of strings"}
+        return self.lookup(users)
+
+
+# 1接続分の処理
+# Note: 接続を維持したまま複数の要求を順に処理する
+class OtpDaemonRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = recv_frame(self.request)
+            except (ValueError, ConnectionError):
+                return
+            if request is None:
+                return
+            send_frame(self.request, self.server.state.handle_request(request))
+
+
+class OtpDaemonServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, state: OtpDaemonState):
+        self.state = state
+        remove_stale_socket(socket_path)
+        super().__init__(str(socket_path), OtpDaemonRequestHandler)
+
+    # ソケットの作成
+    # Note: 所有者以外から接続できないよう、bind直後(listen前)に権限を変更
+    #       (umaskはプロセス全体に影響するため変更しない)
+    def server_bind(self):
+        super().server_bind()
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+# 前回終了時に残ったソケットファイルの削除
+# Note: 接続できる場合は既に起動中のためエラーとする
+def remove_stale_socket(socket_path: Path):
+    if not socket_path.exists():
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            socket_path.unlink(missing_ok=True)
+            return
+    raise RuntimeError(f"OTP daemon is already running: {socket_path}")
+
+
+# OTPの常駐プロセス
+# Note: 時間ステップの切り替わりごとに現在・次のOTPを事前計算し、
+#       単独で動かす場合はpoll_interval秒ごとに保存ファイルの変更を確認
+class OtpDaemon:
+    def __init__(self, data_path: Path, socket_path: Path = None,
+                 token_store=None, backend: str = None,
+                 otp_engine: OtpEngine = None, vault_key=None,
+                 poll_interval: float = 1.0):
+        self.socket_path = socket_path or data_path.joinpath(
+            DAEMON_SOCKET_FILE_NAME)
+        self.state = OtpDaemonState(
+            data_path, token_store, backend, otp_engine, vault_key)
+        self.poll_interval = poll_interval
+        self.server = None
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    # 別スレッドでの起動(UIと同じプロセスで動かす場合)
+    def start(self):
+        self.open()
+        for target in (self.run_refresh, self.server.serve_forever):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    # 起動して終了まで待機(単独で動かす場合)
+    def serve_forever(self):
+        self.open()
+        refresh_thread = threading.Thread(target=self.run_refresh, daemon=True)
+        refresh_thread.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stop()
+
+    def open(self):
+        self.state.data_path.mkdir(parents=True, exist_ok=True)
+        self.state.load()
+        self.state.precompute()
+        self.server = OtpDaemonServer(self.socket_path, self.state)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server is not None:
+            if self.threads:
+                self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.state.close()
+
+    # 事前計算および再読み込みの定期実行
+    def run_refresh(self):
+        while not self.stop_event.is_set():
+            now = time.time()
+            wait = self.state.next_boundary(now) - now
+            if not self.state.shared_store:
+                wait = min(wait, self.poll_interval)
+            if self.stop_event.wait(max(wait, 0.01)):
+                return
+            if not self.state.shared_store:
+                try:
+                    self.state.reload()
+                except (OSError, ValueError):
+                    # Note: 書き込み途中などで読めない場合は次回に再試行
+                    pass
+            self.state.precompute()
+
+
+# 常駐プロセスへの接続
+# Note: 接続を維持して複数回の問い合わせに利用できる
+class OtpDaemonClient:
+    def __init__(self, socket_path: Path, timeout: float = 2.0):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(str(socket_path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def request(self, message: dict) -> dict:
+        send_frame(self.sock, message)
+        response = recv_frame(self.sock)
+        if response is None:
+            raise ConnectionError("OTP daemon closed the connection")
+        return response
+
+    # 複数トークンのOTPの取得
+    def get_codes(self, users: list = None) -> dict:
+        return self.request({"users": users})
+
+
+def request_codes(socket_path: Path, users: list = None,
+                  timeout: float = 2.0) -> dict:
+    with OtpDaemonClient(socket_path, timeout) as client:
+        return client.get_codes(users)
@@ -0,0 +1,205 @@
+import hmac
+import time
+import base64
+import binascii
+import struct
+import threading
+from urllib.parse import urlparse, parse_qsl
+
+
+# OTPのパラメータの既定値
+DEFAULT_OTP_PERIOD = 30
+DEFAULT_OTP_DIGITS = 6
+DEFAULT_OTP_ALGORITHM = "SHA1"
+
+# 対応するハッシュアルゴリズム
+OTP_ALGORITHMS = {"SHA1": "sha1", "SHA256": "sha256", "SHA512": "sha512"}
+
+
+# OTP auth URIからのパラメータ(period/digits/algorithm)の取得
+# Note: 指定がない・不正な値の場合は既定値を利用
+def parse_otp_params(auth_uri: str = None) -> tuple:
+    params = dict(parse_qsl(urlparse(auth_uri).query)) if auth_uri else {}
+    try:
+        period = int(params.get("period", DEFAULT_OTP_PERIOD))
+    except ValueError:
+        period = DEFAULT_OTP_PERIOD
+    try:
+        digits = int(params.get("digits", DEFAULT_OTP_DIGITS))
+    except ValueError:
+        digits = DEFAULT_OTP_DIGITS
+    algorithm = params.get("algorithm", DEFAULT_OTP_ALGORITHM).upper()
+    if algorithm not in OTP_ALGORITHMS:
+        algorithm = DEFAULT_OTP_ALGORITHM
+    return max(period, 1), digits, algorithm
+
+
+# 秘密鍵(base32文字列)のデコード
+def decode_secret(secret: str) -> bytes:
+    normalized = secret.upper().replace(" ", "").rstrip("=")
+    normalized += "=" * (-len(normalized) % 8)
+    return base64.b32decode(normalized)
+
+
+# 鍵のキャッシュ用のキー
+def make_cache_key(secret: str, auth_uri: str = None) -> tuple:
+    return (secret, *parse_otp_params(auth_uri))
+
+
+# 計算用に準備済みのOTPの鍵
+# Note: 秘密鍵のデコードおよびHMACの鍵の準備は生成時に1回のみ行い、
+#       計算時は準備済みのHMACをコピーして利用する
+#       秘密鍵をデコードできない場合(不正なBase32文字列)は例外とせず、
+#       OTPの代わりに桁数分の"-"を返す(他のトークンの表示を妨げない)
+class OtpKey:
+    __slots__ = ("secret", "period", "digits", "algorithm", "hmac_base")
+
+    def __init__(self, secret: str, period: int = DEFAULT_OTP_PERIOD,
+                 digits: int = DEFAULT_OTP_DIGITS,
+                 algorithm: str = DEFAULT_OTP_ALGORITHM):
+        self.secret = secret
+        self.period = period
+        self.digits = digits
+        self.algorithm = algorithm
+        try:
+            self.hmac_base = hmac.new(
+                decode_secret(secret), digestmod=OTP_ALGORITHMS[algorithm])
+        except (binascii.Error, ValueError):
+            self.hmac_base = None
+
+    # 秘密鍵をデコードできたか
+    @property
+    def valid(self) -> bool:
+        return self.hmac_base is not None
+
+    # 時間ステップのカウンタ値
+    def counter_at(self, timestamp: float) -> int:
+        return int(timestamp // self.period)
+
+    # カウンタ値に対するOTPの計算(RFC 4226/6238)
+    def code_at_counter(self, counter: int, counter_bytes=None) -> str:
+        if self.hmac_base is None:
+            return "-" * self.digits
+        h = self.hmac_base.copy()
+        h.update(counter_bytes or struct.pack(">Q", counter))
+        digest = h.digest()
+        offset = digest[-1] & 0x0F
+        value = struct.unpack_from(">I", digest, offset)[0] & 0x7FFFFFFF
+        return str(value % (10 ** self.digits)).zfill(self.digits)
+
+    def code_at(self, timestamp: float) -> str:
+        return self.code_at_counter(self.counter_at(timestamp))
+
+
+# OTPの計算処理
+# Note: 鍵は秘密鍵とパラメータの組ごとに1回だけ準備してキャッシュし、
+#       計算結果は(鍵, カウンタ値)ごとに現在・次の時間ステップ分を保持する
+#       ownerにトークンのkeyを指定して取得した鍵は、トークンの削除時・
+#       秘密鍵の変更時にrelease_keyで解除し、どのトークンからも
+#       使われなくなった時点でキャッシュから削除する
+class OtpEngine:
+    def __init__(self):
+        self.keys = {}
+        self.codes = {}
+        self.owners = {}
+        self.owner_counts = {}
+        self.lock = threading.Lock()
+
+    # 鍵の取得
+    def get_key(self, secret: str, auth_uri: str = None,
+                owner: str = None) -> OtpKey:
+        cache_key = make_cache_key(secret, auth_uri)
+        with self.lock:
+            otp_key = self.keys.get(cache_key)
+        if otp_key is None:
+            otp_key = OtpKey(*cache_key)
+        with self.lock:
+            otp_key = self.keys.setdefault(cache_key, otp_key)
+            if owner is not None:
+                previous_key = self.owners.get(owner)
+                if previous_key != cache_key:
+                    self.owners[owner] = cache_key
+                    self.owner_counts[cache_key] = \
+                        self.owner_counts.get(cache_key, 0) + 1
+                    if previous_key is not None:
+                        self.drop_owner(previous_key)
+        return otp_key
+
+    # トークンによる鍵の利用の解除
+    # Note: secretを指定した場合は、秘密鍵・パラメータが変わっていない
+    #       (更新後も同じ鍵を使う)ときは解除しない
+    def release_key(self, owner: str, secret: str = None,
+                    auth_uri: str = None):
+        with self.lock:
+            cache_key = self.owners.get(owner)
+            if cache_key is None:
+                return
+            if secret is not None \
+                    and cache_key == make_cache_key(secret, auth_uri):
+                return
+            del self.owners[owner]
+            self.drop_owner(cache_key)
+
+    # Note: self.lockの取得中に呼び出す
+    def drop_owner(self, cache_key: tuple):
+        count = self.owner_counts[cache_key] - 1
+        if count > 0:
+            self.owner_counts[cache_key] = count
+            return
+        del self.owner_counts[cache_key]
+        self.keys.pop(cache_key, None)
+
+    # 複数の鍵に対するOTPのまとめての計算
+    # Note: 計算済み(先読み済み)のものは再計算しない
+    def compute_codes(self, otp_keys: list, counter: int) -> list:
+        counter_bytes = struct.pack(">Q", counter)
+        with self.lock:
+            codes = self.codes.get(counter, {})
+        new_codes = {}
+        result = []
+        for otp_key in otp_keys:
+            code = codes.get(otp_key) or new_codes.get(otp_key)
+            if code is None:
+                code = otp_key.code_at_counter(counter, counter_bytes)
+                new_codes[otp_key] = code
+            result.append(code)
+        if new_codes:
+            with self.lock:
+                self.codes.setdefault(counter, {}).update(new_codes)
+        return result
+
+    def codes_at(self, otp_keys: list, timestamp: float) -> list:
+        if not otp_keys:
+            return []
+        # Note: 周期ごとにカウンタ値が異なるためまとめて計算
+        by_period = {}
+        for i, otp_key in enumerate(otp_keys):
+            by_period.setdefault(otp_key.period, []).append(i)
+        result = [None] * len(otp_keys)
+        for period, indexes in by_period.items():
+            keys = [otp_keys[i] for i in indexes]
+            codes = self.compute_codes(keys, int(timestamp // period))
+            for i, code in zip(indexes, codes):
+                result[i] = code
+        return result
+
+    def code_now(self, otp_key: OtpKey) -> str:
+        return self.codes_at([otp_key], time.time())[0]
+
+    # 次の時間ステップ分の先読み計算
+    def prefetch(self, otp_keys: list, counter: int):
+        self.compute_codes(otp_keys, counter + 1)
+
+    # 過去の時間ステップ分の計算結果の削除
+    # Note: 周期の異なる鍵が混在するため、カウンタ値ではなく
+    #       各計算結果の鍵の周期をもとに判定する
+    def prune(self, timestamp: float = None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            for counter in list(self.codes):
+                codes = self.codes[counter]
+                for otp_key in list(codes):
+                    if counter < otp_key.counter_at(timestamp):
+                        del codes[otp_key]
+                if not codes:
+                    del self.codes[counter]
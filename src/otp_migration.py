@@ -0,0 +1,167 @@
+import base64
+from urllib.parse import urlparse, parse_qsl, quote, urlencode
+
+from otp_engine import OTP_ALGORITHMS
+
+
+# otpauth-migration(複数アカウントのエクスポート形式)の解析処理
+# Note: data部分はprotobuf形式のMigrationPayloadをbase64化したもの
+#       protobufのライブラリは使わず、必要なフィールドのみ読み取る
+
+# MigrationPayload.OtpParametersの列挙値
+MIGRATION_ALGORITHMS = {
+    0: "SHA1", 1: "SHA1", 2: "SHA256", 3: "SHA512", 4: "MD5"}
+MIGRATION_DIGITS = {0: 6, 1: 6, 2: 8}
+MIGRATION_TYPE_HOTP = 1
+MIGRATION_TYPE_TOTP = 2
+
+
+# protobufの可変長整数の読み取り
+def read_varint(data: bytes, pos: int) -> tuple:
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated varint")
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+# protobufのフィールドの読み取り
+# Note: (フィールド番号, 値)を順に返す(値は整数もしくはbytes)
+def iter_protobuf_fields(data: bytes):
+    pos = 0
+    while pos < len(data):
+        tag, pos = read_varint(data, pos)
+        field_number, wire_type = tag >> 3, tag & 0x07
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = int.from_bytes(data[pos:pos + 8], "little"), pos + 8
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type == 5:
+            value, pos = int.from_bytes(data[pos:pos + 4], "little"), pos + 4
+        else:
+            raise ValueError(f"Unsupported wire type: {wire_type}")
+        if pos > len(data):
+            raise ValueError("Truncated field")
+        yield field_number, value
+
+
+# エクスポートされたバッチの情報
+class MigrationBatch:
+    def __init__(self):
+        self.version = 0
+        self.batch_size = 1
+        self.batch_index = 0
+        self.batch_id = 0
+        self.otp_parameters = []
+
+
+# OtpParametersの解析
+def parse_otp_parameters(data: bytes) -> dict:
+    params = {"secret": b"", "name": "", "issuer": "", "algorithm": 0,
+              "digits": 0, "type": 0, "counter": 0}
+    names = {1: "secret", 2: "name", 3: "issuer", 4: "algorithm",
+             5: "digits", 6: "type", 7: "counter"}
+    for field_number, value in iter_protobuf_fields(data):
+        name = names.get(field_number)
+        if name in ("name", "issuer"):
+            params[name] = value.decode("utf-8")
+        elif name is not None:
+            params[name] = value
+    return params
+
+
+# MigrationPayloadの解析
+def parse_migration_payload(data: bytes) -> MigrationBatch:
+    batch = MigrationBatch()
+    for field_number, value in iter_protobuf_fields(data):
+        if field_number == 1:
+            batch.otp_parameters.append(parse_otp_parameters(value))
+        elif field_number == 2:
+            batch.version = value
+        elif field_number == 3:
+            batch.batch_size = value
+        elif field_number == 4:
+            batch.batch_index = value
+        elif field_number == 5:
+            batch.batch_id = value
+    return batch
+
+
+# otpauth-migration URIの解析
+def parse_migration_uri(migration_uri: str) -> MigrationBatch:
+    u = urlparse(migration_uri)
+    if u.scheme != "otpauth-migration":
+        raise ValueError("Not an otpauth-migration URI")
+    params = dict(parse_qsl(u.query))
+    data = params["data"]
+    data += "=" * (-len(data) % 4)
+    return parse_migration_payload(base64.b64decode(data))
+
+
+# OtpParametersからのOTP auth URIの作成
+def make_otp_auth_uri(params: dict) -> str:
+    secret = base64.b32encode(params["secret"]).decode("ascii").rstrip("=")
+    query = {"secret": secret}
+    if params["issuer"]:
+        query["issuer"] = params["issuer"]
+    algorithm = MIGRATION_ALGORITHMS.get(params["algorithm"], "SHA1")
+    if algorithm != "SHA1":
+        query["algorithm"] = algorithm
+    digits = MIGRATION_DIGITS.get(params["digits"], 6)
+    if digits != 6:
+        query["digits"] = digits
+    label = quote(params["name"], safe=":@")
+    return f"otpauth://totp/{label}?{urlencode(query)}"
+
+
+# バッチ内のTOTPトークン情報の取得
+# Note: HOTP(カウンタ方式)・計算処理の対応していないアルゴリズム(MD5)は
+#       本アプリの対象外のため読み飛ばし、unsupportedの指定時は
+#       (名称, 種類)を追加する
+def iter_migration_token_infos(batch: MigrationBatch, unsupported=None):
+    for params in batch.otp_parameters:
+        if params["type"] == MIGRATION_TYPE_HOTP:
+            kind = "HOTP"
+        else:
+            kind = MIGRATION_ALGORITHMS.get(params["algorithm"], "SHA1")
+        if kind not in OTP_ALGORITHMS:
+            if unsupported is not None:
+                unsupported.append((params["name"], kind))
+            continue
+        yield {
+            "user": params["name"],
+            "secret": base64.b32encode(
+                params["secret"]).decode("ascii").rstrip("="),
+            "issuer": params["issuer"],
+            "auth_uri": make_otp_auth_uri(params),
+        }
+
+
+# 複数画像に分割されたバッチの受信状況
+class MigrationBatchTracker:
+    def __init__(self):
+        self.batches = {}
+
+    def add(self, batch: MigrationBatch):
+        size, indexes = self.batches.get(batch.batch_id, (0, set()))
+        indexes.add(batch.batch_index)
+        self.batches[batch.batch_id] = (
+            max(size, batch.batch_size), indexes)
+
+    # 未受信の画像があるバッチ一覧
+    # Note: (batch_id, 受信済み件数, 全件数)を返す
+    def get_incomplete_batches(self) -> list:
+        return [
+            (batch_id, len(indexes), size)
+            for batch_id, (size, indexes) in self.batches.items()
+            if len(indexes) < size
+        ]
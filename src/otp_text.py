@@ -1,30 +1,39 @@
 import flet as ft
-import pyotp
-import asyncio
 
 
 # ft.Textを継承してクラス化
+# Note: 行の表示内容を使い回すため、bindで表示対象の鍵を付け替えられる
 class OtpText(ft.Text):
-    def __init__(self, secret: str):
+    def __init__(self, otp_key, otp_clock):
         super().__init__()
         self.size = 40
-        self.secret = secret
+        self.otp_key = None
+        self.period = None
+        self.otp_clock = otp_clock
+        self.subscribed = False
+        if otp_key is not None:
+            self.bind(otp_key)
+
+    # 表示対象の鍵の付け替え
+    # Note: 表示中の場合は共有クロックへの登録をやり直す
+    def bind(self, otp_key):
+        if otp_key is self.otp_key:
+            return
+        if self.subscribed:
+            self.otp_clock.unsubscribe_text(self)
+        self.otp_key = otp_key
+        self.period = otp_key.period
+        if self.subscribed:
+            self.otp_clock.subscribe_text(self)
 
     # did_mountおよびwill_unmountの定義
     # Note: それぞれpage.controlsへの割当/削除時に実行される
+    #       OTPの更新処理は共有クロック側でまとめて実施
     def did_mount(self):
-        self.running = True
-        self.page.run_task(self.update_otp_text)
+        self.subscribed = True
+        self.otp_clock.subscribe_text(self)
+        self.update()
 
     def will_unmount(self):
-        self.running = False
-
-    # OTPテキスト更新処理
-    # Note: runningフラグが有効な限り無限ループ処理とする
-    async def update_otp_text(self):
-        while self.running:
-            totp = pyotp.TOTP(self.secret)
-            current_otp = str(totp.now())
-            self.value = current_otp
-            self.update()
-            await asyncio.sleep(1)
+        self.subscribed = False
+        self.otp_clock.unsubscribe_text(self)
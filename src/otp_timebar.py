@@ -1,30 +1,36 @@
 import flet as ft
-import asyncio
-from datetime import datetime
 
 
 # ft.ProgressBarを継承してクラス化
+# Note: 行の表示内容を使い回すため、bindで周期を付け替えられる
 class OtpTimeBar(ft.ProgressBar):
-    def __init__(self):
+    def __init__(self, otp_clock, period: int = 30):
         super().__init__()
         self.value = 1
         self.width = 450
+        self.period = period
+        self.otp_clock = otp_clock
+        self.subscribed = False
+
+    # 周期の付け替え
+    # Note: 表示中の場合は共有クロックへの登録をやり直す
+    def bind(self, period: int):
+        if period == self.period:
+            return
+        if self.subscribed:
+            self.otp_clock.unsubscribe_bar(self)
+        self.period = period
+        if self.subscribed:
+            self.otp_clock.subscribe_bar(self)
 
     # did_mountおよびwill_unmountの定義
     # Note: それぞれpage.controlsへの割当/削除時に実行される
+    #       残り時間の更新処理は共有クロック側でまとめて実施
     def did_mount(self):
-        self.running = True
-        self.page.run_task(self.update_time_bar)
+        self.subscribed = True
+        self.otp_clock.subscribe_bar(self)
+        self.update()
 
     def will_unmount(self):
-        self.running = False
-
-    # 残り時間バー表示処理
-    # Note: runningフラグが有効な限り無限ループ処理とする
-    async def update_time_bar(self):
-        while self.running:
-            now = datetime.now()
-            remaining_sec = now.second % 30
-            self.value = remaining_sec / 30
-            self.update()
-            await asyncio.sleep(0.05)
+        self.subscribed = False
+        self.otp_clock.unsubscribe_bar(self)
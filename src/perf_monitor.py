@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+
+# 計測の有効化および計測結果の書き出し間隔(秒)を指定する環境変数
+# Note: FLET_APP_STORAGE_DATAと同様にアプリの起動時に指定する
+PERF_ENV_NAME = "AUTHENTICATOR_PERF"
+PERF_INTERVAL_ENV_NAME = "AUTHENTICATOR_PERF_INTERVAL"
+DEFAULT_DUMP_INTERVAL = 10.0
+
+# 計測結果の書き出し先(アプリ用のデータパス直下)
+PERF_DUMP_FILE_NAME = "perf_stats.json"
+
+# 所要時間のヒストグラムの区切り(ミリ秒)
+HISTOGRAM_BOUNDS_MS = (
+    0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+# 所要時間のヒストグラム
+# Note: 区切りごとの件数のみ保持し、パーセンタイルは区切りの上限値で近似
+class LatencyHistogram:
+    def __init__(self):
+        self.bucket_counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, seconds: float):
+        ms = seconds * 1000
+        self.bucket_counts[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, ratio: float) -> float:
+        target = self.count * ratio
+        seen = 0
+        for bound, count in zip(HISTOGRAM_BOUNDS_MS, self.bucket_counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max_ms,
+            "bounds_ms": list(HISTOGRAM_BOUNDS_MS),
+            "bucket_counts": list(self.bucket_counts),
+        }
+
+
+# 性能計測(カウンタ・所要時間のヒストグラム)
+# Note: 環境変数AUTHENTICATOR_PERFの指定時のみ有効とし、無効時の各記録処理は
+#       何もせずに戻る(計測箇所の負荷を増やさないため)
+#       カウンタは累計値を保持し、1秒あたりの値はsnapshot同士の差分で求める
+class PerfMonitor:
+    def __init__(self, enabled: bool = False,
+                 dump_interval: float = DEFAULT_DUMP_INTERVAL):
+        self.enabled = enabled
+        self.dump_interval = dump_interval
+        self.started_at = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.dump_path = None
+        self.dump_stop_event = threading.Event()
+        self.dump_thread = None
+
+    @classmethod
+    def from_env(cls) -> "PerfMonitor":
+        if not os.getenv(PERF_ENV_NAME):
+            return cls()
+        try:
+            interval = float(os.getenv(
+                PERF_INTERVAL_ENV_NAME, DEFAULT_DUMP_INTERVAL))
+        except ValueError:
+            interval = DEFAULT_DUMP_INTERVAL
+        return cls(enabled=True, dump_interval=interval)
+
+    #
+    # 記録処理
+    #
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self.histograms[name] = histogram
+            histogram.add(seconds)
+
+    # with文で囲んだ処理の所要時間の記録
+    @contextmanager
+    def measure(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    #
+    # 参照処理
+    #
+
+    # 現時点の計測値
+    # Note: previous(前回のsnapshot)を指定した場合は、その時点からの
+    #       1秒あたりのカウンタの増分をratesに含める
+    def snapshot(self, previous: dict = None) -> dict:
+        now = time.time()
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {
+                name: histogram.to_dict()
+                for name, histogram in self.histograms.items()}
+        rates = {}
+        if previous is not None and now > previous["time"]:
+            elapsed = now - previous["time"]
+            rates = {
+                name: (value - previous["counters"].get(name, 0)) / elapsed
+                for name, value in counters.items()}
+        return {
+            "time": now,
+            "uptime_sec": now - self.started_at,
+            "counters": counters,
+            "rates_per_sec": rates,
+            "histograms": histograms,
+        }
+
+    # 画面表示用の要約
+    @staticmethod
+    def format_summary(snapshot: dict) -> str:
+        lines = []
+        for name, rate in sorted(snapshot["rates_per_sec"].items()):
+            lines.append(f"{name}: {rate:.1f}/s")
+        for name, stats in sorted(snapshot["histograms"].items()):
+            lines.append(
+                f"{name}: n={stats['count']} p50={stats['p50_ms']:.1f}ms "
+                f"p95={stats['p95_ms']:.1f}ms max={stats['max_ms']:.1f}ms")
+        return "\n".join(lines) or "no samples yet"
+
+    #
+    # 計測結果の書き出し
+    #
+
+    # 定期的な書き出しの開始・終了
+    # Note: 有効時のみ、書き出し用のスレッドを1つだけ起動する
+    def start_dump(self, data_path):
+        if not self.enabled or self.dump_thread is not None:
+            return
+        self.dump_path = data_path.joinpath(PERF_DUMP_FILE_NAME)
+        self.dump_stop_event.clear()
+        self.dump_thread = threading.Thread(
+            target=self.run_dump, daemon=True)
+        self.dump_thread.start()
+
+    def stop_dump(self):
+        if self.dump_thread is None:
+            return
+        self.dump_stop_event.set()
+        self.dump_thread.join()
+        self.dump_thread = None
+        self.dump()
+
+    def run_dump(self):
+        previous = self.snapshot()
+        while not self.dump_stop_event.wait(self.dump_interval):
+            previous = self.dump(previous)
+
+    def dump(self, previous: dict = None) -> dict:
+        from token_store import write_file_atomic
+
+        snapshot = self.snapshot(previous)
+        try:
+            self.dump_path.parent.mkdir(parents=True, exist_ok=True)
+            write_file_atomic(self.dump_path, json.dumps(snapshot, indent=4))
+        except OSError:
+            pass
+        return snapshot
+
+
+# プロセス内で共通の計測
+perf_monitor = PerfMonitor.from_env()
+
+
+# 起動処理の段階ごとの経過時間
+# Note: 作成時点からの経過時間(秒)を段階名ごとに記録し、計測の有効時は
+#       "startup.<段階名>"のヒストグラムにも記録する
+#       同じ段階名は最初の1回のみ記録する
+class StartupTimer:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases = {}
+
+    def mark(self, name: str) -> float:
+        if name in self.phases:
+            return self.phases[name]
+        elapsed = time.perf_counter() - self.started_at
+        self.phases[name] = elapsed
+        perf_monitor.observe(f"startup.{name}", elapsed)
+        return elapsed
@@ -0,0 +1,222 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from perf_monitor import perf_monitor
+
+
+# 縮小画像で読み取りを試す際の長辺サイズ(小さい順)
+DECODE_PYRAMID_SIZES = (800, 1600)
+
+# 中央部分の切り出しで読み取りを試す際の切り出し比率・長辺サイズ
+DECODE_ROI_RATIO = 0.6
+DECODE_ROI_SIZE = 1024
+
+# 二値化の閾値
+DECODE_BINARIZE_THRESHOLD = 128
+
+
+# QRコード読み取りの計測情報
+class QrDecodeStats:
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.cache_hit = False
+        self.stage = None
+        self.stage_timings = []
+        self.total_sec = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "file_path": self.file_path,
+            "cache_hit": self.cache_hit,
+            "stage": self.stage,
+            "stage_timings": self.stage_timings,
+            "total_sec": self.total_sec,
+        }
+
+
+# ファイル内容のハッシュ値
+def make_file_hash(file_path: str) -> str:
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# 画像の縮小
+def downscale_image(img, size: int):
+    if max(img.size) <= size:
+        return img
+    small = img.copy()
+    small.thumbnail((size, size))
+    return small
+
+
+# 画像の二値化
+def binarize_image(img):
+    from PIL import ImageOps
+
+    threshold = DECODE_BINARIZE_THRESHOLD
+    return ImageOps.autocontrast(img).point(
+        lambda v: 255 if v >= threshold else 0)
+
+
+# 画像中央部分の切り出し
+def crop_center_image(img, ratio: float):
+    width, height = img.size
+    crop_width, crop_height = int(width * ratio), int(height * ratio)
+    left, top = (width - crop_width) // 2, (height - crop_height) // 2
+    return img.crop((left, top, left + crop_width, top + crop_height))
+
+
+# QRコード画像の読み込み・URI文字列の取得
+# Note: 処理の軽い順(縮小グレースケール→二値化→中央切り出し→原寸)に試し、
+#       読み取れた時点で終了する
+#       プロセスプール上で実行するためモジュール直下の関数として定義
+def decode_qrcode_file(file_path: str) -> tuple:
+    from PIL import Image
+    import pyzbar.pyzbar as pyzbar
+    from pyzbar.pyzbar import ZBarSymbol
+
+    stats = QrDecodeStats(file_path)
+    start = time.perf_counter()
+
+    def try_decode(stage: str, make_image) -> list:
+        stage_start = time.perf_counter()
+        decoded_objects = pyzbar.decode(
+            make_image(), symbols=[ZBarSymbol.QRCODE])
+        stats.stage_timings.append(
+            (stage, time.perf_counter() - stage_start))
+        if decoded_objects:
+            stats.stage = stage
+        return [obj.data.decode("utf-8") for obj in decoded_objects]
+
+    def run_stages() -> list:
+        # 縮小画像での読み取り
+        # Note: JPEGの場合はdraftにより縮小した状態で読み込まれる
+        with Image.open(file_path) as img:
+            img.draft("L", (DECODE_PYRAMID_SIZES[-1],) * 2)
+            gray = img.convert("L")
+        for size in DECODE_PYRAMID_SIZES:
+            small = downscale_image(gray, size)
+            uris = try_decode(f"gray_{size}", lambda: small)
+            if uris:
+                return uris
+            uris = try_decode(
+                f"binarize_{size}", lambda: binarize_image(small))
+            if uris:
+                return uris
+
+        # 原寸画像での読み取り
+        with Image.open(file_path) as img:
+            full = img.convert("L")
+        uris = try_decode("roi", lambda: downscale_image(
+            crop_center_image(full, DECODE_ROI_RATIO), DECODE_ROI_SIZE))
+        if uris:
+            return uris
+        uris = try_decode("full", lambda: full)
+        if uris:
+            return uris
+        return try_decode("full_binarize", lambda: binarize_image(full))
+
+    uris = run_stages()
+    stats.total_sec = time.perf_counter() - start
+    return uris, stats
+
+
+# QRコード読み取り処理
+# Note: 読み取り結果はファイル内容のハッシュ値をキーにメモリ上へ保持し、
+#       同じファイルの再指定時は読み取り処理を省略する
+#       (URIには秘密鍵が含まれるためディスクには保存しない)
+class QrDecoder:
+    def __init__(self, max_cache_entries: int = 256,
+                 max_history_entries: int = 100):
+        self.max_cache_entries = max_cache_entries
+        self.max_history_entries = max_history_entries
+        self.cache = OrderedDict()
+        self.history = []
+        self.lock = threading.Lock()
+
+    # キャッシュの参照・登録
+    def get_cached(self, file_hash: str):
+        with self.lock:
+            uris = self.cache.get(file_hash)
+            if uris is not None:
+                self.cache.move_to_end(file_hash)
+            return uris
+
+    def put_cached(self, file_hash: str, uris: list):
+        with self.lock:
+            self.cache[file_hash] = uris
+            self.cache.move_to_end(file_hash)
+            while len(self.cache) > self.max_cache_entries:
+                self.cache.popitem(last=False)
+
+    # 計測情報の記録
+    def record_stats(self, stats: QrDecodeStats):
+        if stats.cache_hit:
+            perf_monitor.count("qr.decode_cache_hit")
+        else:
+            perf_monitor.observe("qr.decode", stats.total_sec)
+        with self.lock:
+            self.history.append(stats)
+            del self.history[:-self.max_history_entries]
+
+    # キャッシュ済みの場合の計測情報
+    def make_cache_hit_stats(self, file_path: str, start: float):
+        stats = QrDecodeStats(file_path)
+        stats.cache_hit = True
+        stats.total_sec = time.perf_counter() - start
+        self.record_stats(stats)
+        return stats
+
+    # 1ファイルの読み取り
+    def decode(self, file_path: str) -> list:
+        start = time.perf_counter()
+        file_hash = make_file_hash(file_path)
+        uris = self.get_cached(file_hash)
+        if uris is not None:
+            self.make_cache_hit_stats(file_path, start)
+            return uris
+
+        uris, stats = decode_qrcode_file(file_path)
+        self.record_stats(stats)
+        if uris:
+            self.put_cached(file_hash, uris)
+        return uris
+
+    # 複数ファイルの読み取り
+    # Note: キャッシュにないファイルのみexecutorで並列実行し、
+    #       完了したものから(ファイルパス, URI一覧)を返す
+    def decode_many(self, file_paths: list, executor):
+        from concurrent.futures import as_completed
+
+        futures = {}
+        for file_path in file_paths:
+            start = time.perf_counter()
+            try:
+                file_hash = make_file_hash(file_path)
+            except OSError:
+                yield file_path, []
+                continue
+            uris = self.get_cached(file_hash)
+            if uris is not None:
+                self.make_cache_hit_stats(file_path, start)
+                yield file_path, uris
+            else:
+                future = executor.submit(decode_qrcode_file, file_path)
+                futures[future] = (file_path, file_hash)
+
+        for future in as_completed(futures):
+            file_path, file_hash = futures[future]
+            try:
+                uris, stats = future.result()
+            except Exception:
+                yield file_path, []
+                continue
+            self.record_stats(stats)
+            if uris:
+                self.put_cached(file_hash, uris)
+            yield file_path, uris
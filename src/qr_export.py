@@ -0,0 +1,213 @@
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+
+# QRコード画像の生成・保存
+# Note: プロセスプール上で実行するためモジュール直下の関数として定義
+#       一時ファイルへ書き込んでからrenameし、書き込み途中の画像を残さない
+def render_qrcode_file(auth_uri: str, output_path: str) -> str:
+    import qrcode
+
+    qr = qrcode.QRCode()
+    qr.add_data(auth_uri)
+    qr.make()
+    img = qr.make_image()
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        img.save(f, format="PNG")
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+# キャッシュファイル名用のハッシュ値
+def make_uri_hash(auth_uri: str) -> str:
+    return hashlib.sha256(auth_uri.encode("utf-8")).hexdigest()
+
+
+# PDFの1ページ分の画像(QRコードの下に発行者・ユーザー名を表示)
+# Note: ラベルが画像の幅に収まらない場合は末尾を省略する
+PDF_LABEL_HEIGHT = 40
+
+
+def make_pdf_page(qr_image, label: str):
+    from PIL import Image, ImageDraw, ImageFont
+
+    page = Image.new(
+        "RGB", (qr_image.width, qr_image.height + PDF_LABEL_HEIGHT), "white")
+    page.paste(qr_image, (0, 0))
+    draw = ImageDraw.Draw(page)
+    font = ImageFont.load_default()
+    max_width = qr_image.width - 20
+    text = label
+    while text and draw.textlength(text, font=font) > max_width:
+        text = text[:-1]
+    if text != label:
+        text = text[:-1] + "…"
+    text_width = draw.textlength(text, font=font)
+    draw.text(((page.width - text_width) / 2,
+               qr_image.height + PDF_LABEL_HEIGHT / 4),
+              text, fill="black", font=font)
+    return page
+
+
+# PDFのラベル文字列
+def make_pdf_label(item) -> str:
+    issuer = item.get("issuer")
+    if issuer:
+        return f"{issuer} ({item['user']})"
+    return item["user"]
+
+
+# 保存用のファイル名(使用できない文字を置き換え)
+def make_export_file_name(key: str) -> str:
+    return re.sub(r'[\\/:*?"<>|\s]+', "_", key).strip("_") or "token"
+
+
+# QRコード画像の一括出力処理
+# Note: 生成した画像はauth_uriのハッシュ値をファイル名としてキャッシュし、
+#       auth_uriが変わらない限り再生成しない(出力時はコピーのみ)
+#       キャッシュには秘密鍵を含むため所有者のみ読み書き可能とする
+#       use_cache=False(暗号化保存時)の場合は出力ごとの一時フォルダで生成し、
+#       平文の秘密鍵を含む画像をデータフォルダに残さない
+class QrExporter:
+    CACHE_DIR_NAME = "qrcode_cache"
+
+    def __init__(self, token_store, data_path: Path, max_workers: int = None,
+                 use_cache: bool = True):
+        self.token_store = token_store
+        self.cache_path = data_path.joinpath(self.CACHE_DIR_NAME)
+        self.max_workers = max_workers or min(os.cpu_count() or 1, 8)
+        self.use_cache = use_cache
+
+    def get_cache_file_path(self, auth_uri: str,
+                            cache_path: Path = None) -> Path:
+        cache_path = cache_path or self.cache_path
+        return cache_path.joinpath(make_uri_hash(auth_uri) + ".png")
+
+    # 画像の生成先フォルダ
+    @contextmanager
+    def open_cache_dir(self):
+        if self.use_cache:
+            self.cache_path.mkdir(parents=True, exist_ok=True)
+            os.chmod(self.cache_path, 0o700)
+            yield self.cache_path
+        else:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                yield Path(tmp_dir)
+
+    # キャッシュ画像の作成
+    # Note: 未生成のもののみプロセスプールで生成し、(key, 画像パス)を返す
+    #       on_progressは(完了件数, 全件数)を引数に呼び出される
+    def render_all(self, keys: list, on_progress=None,
+                   cache_path: Path = None) -> list:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        cache_path = cache_path or self.cache_path
+        cache_path.mkdir(parents=True, exist_ok=True)
+        os.chmod(cache_path, 0o700)
+
+        image_paths = []
+        missing = {}
+        for key in keys:
+            auth_uri = self.token_store[key]["auth_uri"]
+            image_path = self.get_cache_file_path(auth_uri, cache_path)
+            image_paths.append((key, image_path))
+            if not image_path.exists():
+                missing[str(image_path)] = auth_uri
+
+        total = len(keys)
+        count = total - len(missing)
+        if on_progress is not None:
+            on_progress(count, total)
+        if len(missing) == 1:
+            # Note: 1件のみの場合はプロセスプールを起動しない
+            [(path, auth_uri)] = missing.items()
+            render_qrcode_file(auth_uri, path)
+            count += 1
+            if on_progress is not None:
+                on_progress(count, total)
+        elif missing:
+            with ProcessPoolExecutor(
+                    max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(render_qrcode_file, auth_uri, path)
+                    for path, auth_uri in missing.items()
+                ]
+                for future in as_completed(futures):
+                    future.result()
+                    count += 1
+                    if on_progress is not None:
+                        on_progress(count, total)
+        return image_paths
+
+    # 使われなくなったキャッシュ画像の削除
+    # Note: キャッシュを使わない場合は以前のキャッシュをすべて削除
+    def prune_cache(self):
+        if not self.cache_path.exists():
+            return
+        if not self.use_cache:
+            shutil.rmtree(self.cache_path, ignore_errors=True)
+            return
+        valid_names = {
+            self.get_cache_file_path(info["auth_uri"]).name
+            for _, info in self.token_store.items()
+        }
+        for path in self.cache_path.glob("*.png"):
+            if path.name not in valid_names:
+                path.unlink()
+
+    # 1件分の保存
+    def export_one(self, key: str, output_path: str):
+        with self.open_cache_dir() as cache_path:
+            [(_, image_path)] = self.render_all(
+                [key], cache_path=cache_path)
+            shutil.copyfile(image_path, output_path)
+
+    # フォルダへの一括保存
+    def export_to_directory(self, output_dir: str, keys: list = None,
+                            on_progress=None) -> list:
+        keys = self.token_store.keys_in_order() if keys is None else keys
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        output_paths = []
+        used_names = set()
+        with self.open_cache_dir() as cache_path:
+            for key, image_path in self.render_all(
+                    keys, on_progress, cache_path):
+                name = make_export_file_name(key)
+                file_name, count = name, 2
+                while file_name in used_names:
+                    file_name = f"{name}_{count}"
+                    count += 1
+                used_names.add(file_name)
+                output_path = output_dir.joinpath(file_name + ".png")
+                shutil.copyfile(image_path, output_path)
+                output_paths.append(output_path)
+        return output_paths
+
+    # PDF(1ページ1件)への一括保存
+    # Note: 各ページのQRコードの下に発行者・ユーザー名を表示
+    def export_to_pdf(self, output_path: str, keys: list = None,
+                      on_progress=None):
+        from PIL import Image
+
+        keys = self.token_store.keys_in_order() if keys is None else keys
+        pages = []
+        with self.open_cache_dir() as cache_path:
+            for key, image_path in self.render_all(
+                    keys, on_progress, cache_path):
+                label = make_pdf_label(self.token_store[key])
+                with Image.open(image_path) as img:
+                    pages.append(make_pdf_page(img.convert("RGB"), label))
+        if not pages:
+            return
+        pages[0].save(
+            output_path, format="PDF", save_all=True,
+            append_images=pages[1:])
@@ -0,0 +1,176 @@
+import os
+import hashlib
+from pathlib import Path
+from urllib.parse import urlparse, parse_qsl
+
+from otp_migration import (
+    MigrationBatchTracker, parse_migration_uri, iter_migration_token_infos)
+from token_record import make_timestamp_text
+
+
+# 読み込み対象のQRコード画像の拡張子
+QRCODE_FILE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif")
+
+
+# OTP auth URIの解析
+# Note: otpauth://totp/... 以外の場合はNoneを返す
+def parse_otp_auth_uri(otp_auth_uri: str):
+    u = urlparse(otp_auth_uri)
+    if u.scheme != "otpauth" or u.netloc != "totp":
+        return None
+    params = dict(parse_qsl(u.query))
+    if "secret" not in params:
+        return None
+    return {
+        "user": u.path[1:],
+        "secret": params["secret"],
+        "issuer": params.get("issuer", ""),
+        "auth_uri": otp_auth_uri,
+    }
+
+
+# QRコードのURI一覧からのトークン情報の取得
+# Note: otpauth://totp/... は1件、otpauth-migration://... は複数件を返す
+#       解析できないURIは読み飛ばす
+#       対応していない形式のトークンはunsupportedに(名称, 種類)を追加する
+def iter_token_infos(uris: list, batch_tracker=None, unsupported=None):
+    for uri in uris:
+        if uri.startswith("otpauth-migration:"):
+            try:
+                batch = parse_migration_uri(uri)
+            except (ValueError, KeyError):
+                continue
+            if batch_tracker is not None:
+                batch_tracker.add(batch)
+            yield from iter_migration_token_infos(batch, unsupported)
+        else:
+            token_info = parse_otp_auth_uri(uri)
+            if token_info is not None:
+                yield token_info
+
+
+# 秘密鍵の重複判定用ハッシュ値
+# Note: 大文字小文字・空白・パディングの違いは同一とみなす
+def make_secret_hash(secret: str) -> str:
+    normalized = secret.upper().replace(" ", "").rstrip("=")
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+# 指定パス(ファイル・フォルダ)からのQRコード画像一覧の取得
+def list_qrcode_files(paths: list) -> list:
+    file_paths = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            file_paths.extend(
+                sorted(p for p in path.iterdir()
+                       if p.suffix.lower() in QRCODE_FILE_EXTENSIONS))
+        elif path.is_file():
+            file_paths.append(path)
+    return [str(p) for p in file_paths]
+
+
+# 登録用トークン情報の作成
+def make_token_item(token_info: dict, note: str = "") -> dict:
+    dt_now_str = make_timestamp_text()
+    return {
+        "user": token_info["user"],
+        "secret": token_info["secret"],
+        "issuer": token_info["issuer"],
+        "auth_uri": token_info["auth_uri"],
+        "note": note,
+        "created_at": dt_now_str,
+        "updated_at": dt_now_str
+    }
+
+
+# 一括インポート結果
+# Note: unsupported_tokensは対応していない形式のため登録しなかった
+#       トークンの(名称, 種類)の一覧
+class BulkImportResult:
+    def __init__(self):
+        self.imported_keys = []
+        self.duplicate_count = 0
+        self.failed_paths = []
+        self.incomplete_batches = []
+        self.unsupported_tokens = []
+
+
+# QRコード画像の一括インポート処理
+# Note: 画像のデコードはプロセスプールで並列実行し、
+#       有効なトークンは最後に1回の書き込みでストアへ登録する
+class BulkQrImporter:
+    def __init__(self, token_store, qr_decoder, max_workers: int = None):
+        self.token_store = token_store
+        self.qr_decoder = qr_decoder
+        self.max_workers = max_workers or min(os.cpu_count() or 1, 8)
+
+    # 登録済みトークンの秘密鍵ハッシュ一覧
+    # Note: 保存方式ごとに秘密鍵のみをまとめて取得する
+    def build_secret_hash_index(self) -> set:
+        return {
+            make_secret_hash(secret)
+            for secret in self.token_store.get_secrets()
+        }
+
+    # 同名トークンがある場合のkeyの作成
+    def make_unique_key(self, user: str, used_keys) -> str:
+        key = user
+        count = 2
+        while key in self.token_store or key in used_keys:
+            key = f"{user} ({count})"
+            count += 1
+        return key
+
+    # 一括インポートの実行
+    # Note: on_progressは(完了件数, 全件数, ファイルパス)を引数に呼び出される
+    def run(self, paths: list, on_progress=None) -> BulkImportResult:
+        from concurrent.futures import ProcessPoolExecutor
+
+        file_paths = list_qrcode_files(paths)
+        result = BulkImportResult()
+        batch_tracker = MigrationBatchTracker()
+
+        def iter_decoded_token_infos(executor):
+            decoded_results = self.qr_decoder.decode_many(file_paths, executor)
+            for count, (file_path, uris) in enumerate(
+                    decoded_results, start=1):
+                unsupported_count = len(result.unsupported_tokens)
+                found = False
+                for token_info in iter_token_infos(
+                        uris, batch_tracker, result.unsupported_tokens):
+                    found = True
+                    yield token_info
+                if len(result.unsupported_tokens) > unsupported_count:
+                    found = True
+                if not found:
+                    result.failed_paths.append(file_path)
+                if on_progress is not None:
+                    on_progress(count, len(file_paths), file_path)
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            self.import_token_infos(
+                iter_decoded_token_infos(executor), result)
+        result.incomplete_batches = batch_tracker.get_incomplete_batches()
+        return result
+
+    # トークン情報の取り込み
+    # Note: 順に受け取ったトークン情報を重複除外し、最後に1回の書き込みで
+    #       ストアへまとめて登録する
+    def import_token_infos(self, token_infos,
+                           result: BulkImportResult = None):
+        result = result or BulkImportResult()
+        secret_hashes = self.build_secret_hash_index()
+        new_items = {}
+        for token_info in token_infos:
+            secret_hash = make_secret_hash(token_info["secret"])
+            if secret_hash in secret_hashes:
+                result.duplicate_count += 1
+                continue
+            secret_hashes.add(secret_hash)
+            key = self.make_unique_key(token_info["user"], new_items)
+            new_items[key] = make_token_item(token_info)
+
+        # ストアへの一括登録
+        self.token_store.add_many(list(new_items.items()))
+        result.imported_keys = list(new_items)
+        return result
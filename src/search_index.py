@@ -0,0 +1,117 @@
+import threading
+from collections import defaultdict
+
+
+# トークン検索用のインデックス
+# Note: user/issuer/noteを小文字化して連結した文字列のトライグラムを保持し、
+#       追加・更新・削除のたびに対象トークン分のみ差分更新する
+#       複数セッション・保存ファイルの監視スレッドから更新・検索されるため、
+#       各処理はself.lockを取得して行う(検索時の部分一致の確認はロック外)
+class TokenSearchIndex:
+    FIELDS = ("user", "issuer", "note")
+    NGRAM_SIZE = 3
+
+    def __init__(self):
+        self.texts = {}
+        self.postings = defaultdict(set)
+        self.lock = threading.RLock()
+
+    # 検索対象文字列の正規化
+    # Note: 項目間にまたがる一致を避けるため改行で連結
+    @classmethod
+    def normalize(cls, info: dict) -> str:
+        return "\n".join(
+            (info.get(field) or "").casefold() for field in cls.FIELDS)
+
+    @classmethod
+    def make_ngrams(cls, text: str) -> set:
+        n = cls.NGRAM_SIZE
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    # インデックスの一括作成
+    # Note: recordsは(key, info)の組を順に返すもの
+    #       検索中の画面から参照されるため、新しい一覧を作成してから
+    #       まとめて差し替える(作成途中の内容で検索されないようにする)
+    def build(self, records):
+        texts = {}
+        postings = defaultdict(set)
+        for key, info in records:
+            text = self.normalize(info)
+            texts[key] = text
+            for gram in self.make_ngrams(text):
+                postings[gram].add(key)
+        with self.lock:
+            self.texts, self.postings = texts, postings
+
+    # トークンの追加・更新・削除
+    def add(self, key: str, info: dict):
+        text = self.normalize(info)
+        with self.lock:
+            if key in self.texts:
+                self.remove(key)
+            self.texts[key] = text
+            for gram in self.make_ngrams(text):
+                self.postings[gram].add(key)
+
+    def update(self, key: str, info: dict):
+        with self.lock:
+            if self.texts.get(key) != self.normalize(info):
+                self.add(key, info)
+
+    def remove(self, key: str):
+        with self.lock:
+            text = self.texts.pop(key, None)
+            if text is None:
+                return
+            for gram in self.make_ngrams(text):
+                keys = self.postings.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.postings[gram]
+
+    # 1件分の一致判定
+    # Note: 変更のあったトークンの表示・非表示の判定用(空文字の場合は一致)
+    def matches(self, key: str, query: str) -> bool:
+        with self.lock:
+            text = self.texts.get(key, "")
+        return query.casefold() in text
+
+    # 検索処理
+    # Note: 空文字の場合はNone(全件)を返す
+    #       トライグラム未満の短い文字列は全件走査で判定
+    #       ロック内では候補のkeyの集合(全件走査の場合は一覧の複製)の
+    #       作成のみ行い、部分一致の確認はロック外で行う
+    def search(self, query: str):
+        query = query.casefold()
+        if query == "":
+            return None
+
+        with self.lock:
+            if len(query) < self.NGRAM_SIZE:
+                texts = dict(self.texts)
+                candidates = texts
+            else:
+                texts = self.texts
+                candidates = self.find_candidates(query)
+
+        return {key for key in candidates if query in texts.get(key, "")}
+
+    # トライグラムによる候補のkeyの絞り込み
+    # Note: 件数の少ない順に積集合を取り、新しい集合として返す
+    #       self.lockの取得中に呼び出す
+    def find_candidates(self, query: str) -> set:
+        posting_list = []
+        for gram in self.make_ngrams(query):
+            keys = self.postings.get(gram)
+            if not keys:
+                return set()
+            posting_list.append(keys)
+
+        posting_list.sort(key=len)
+        candidates = set(posting_list[0])
+        for keys in posting_list[1:]:
+            candidates &= keys
+            if not candidates:
+                break
+        return candidates
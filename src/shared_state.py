@@ -0,0 +1,170 @@
+import os
+import threading
+from pathlib import Path
+
+from otp_clock import OtpClock
+from otp_engine import OtpEngine
+from perf_monitor import perf_monitor
+from search_index import TokenSearchIndex
+from store_watcher import StoreWatcher
+from token_store import open_token_store
+
+
+# 起動時に先に読み込むトークン数
+# Note: 最初の画面に表示する行数より多めに指定し、残りは別スレッドで読み込む
+STARTUP_TOKEN_COUNT = 32
+
+
+# プロセス内で共有するアプリの状態
+# Note: Webモードで複数のセッションが接続した場合も、トークン情報・OTPの
+#       計算処理(共有クロック)・検索インデックスはプロセス内で1つのみ持つ
+#       書き込みは共有のTokenStoreを通じて直列化され(単一の書き込み元)、
+#       変更は各セッションのlistenerへ通知される
+class SharedAppState:
+    def __init__(self, data_path: Path, vault_key=None):
+        self.data_path = data_path
+        self.vault_key = vault_key
+        self.sessions = set()
+        self.lock = threading.Lock()
+
+        # OTPの計算処理および表示更新用の共有クロック
+        # Note: 各セッションの行は同じクロックに登録され、
+        #       OTPの計算は時間ステップごとに1回のみ行われる
+        self.otp_engine = OtpEngine()
+        self.otp_clock = OtpClock(None, self.otp_engine)
+
+        # トークン情報の読み込み
+        # Note: JSON保存の場合、変更はジャーナルへまとめて追記され、
+        #       終了時にスナップショット化される
+        #       また並び順の先頭のみ読み込んだ時点で戻り、残りは別スレッドで
+        #       読み込む(完了時に"load"が通知される)
+        #       暗号化保存の場合、秘密鍵は行の表示時に初めて復号される
+        self.token_store = open_token_store(
+            data_path, vault_key=vault_key, first_count=STARTUP_TOKEN_COUNT)
+
+        # OTPの常駐プロセス(環境変数AUTHENTICATOR_DAEMONの指定時のみ)
+        # Note: UIと同じトークン情報・計算処理を共有し、変更は通知で反映
+        #       全件の読み込み完了後に起動する
+        #       (完了の通知はlistenerの登録直後から届きうるため先に初期化)
+        self.otp_daemon = None
+        self.loaded_handled = False
+
+        # 検索用インデックスの作成
+        # Note: 以降はトークンの追加・更新・削除の通知ごとに差分更新
+        #       各セッションのlistenerより先に登録し、更新済みの状態で通知する
+        #       読み込みの完了時に全件で作り直す
+        self.search_index = TokenSearchIndex()
+        self.search_index.build(self.token_store.iter_search_records())
+        self.token_store.add_listener(self.event_change_token_store)
+
+        # 保存ファイルの監視
+        # Note: 他のインスタンスや同期ツールによる変更を差分反映する
+        self.store_watcher = StoreWatcher(self.token_store).start()
+
+        # QRコード読み取り処理・QRコード画像の出力処理
+        # Note: 初回の利用時に作成する(qr_decoder・qr_exporterを参照)
+        self.qr_decoder_instance = None
+        self.qr_exporter_instance = None
+
+        # 読み込みが完了済みの場合(段階的な読み込みなし)
+        if self.token_store.loaded.is_set():
+            self.event_loaded()
+
+        # 性能計測結果の定期的な書き出し(環境変数AUTHENTICATOR_PERFの指定時のみ)
+        perf_monitor.start_dump(data_path)
+
+    # QRコード読み取り処理
+    @property
+    def qr_decoder(self):
+        with self.lock:
+            if self.qr_decoder_instance is None:
+                from qr_decoder import QrDecoder
+                self.qr_decoder_instance = QrDecoder()
+            return self.qr_decoder_instance
+
+    # QRコード画像の出力処理
+    # Note: 暗号化保存の場合は平文の画像を残さないためキャッシュしない
+    @property
+    def qr_exporter(self):
+        with self.lock:
+            if self.qr_exporter_instance is None:
+                from qr_export import QrExporter
+                self.qr_exporter_instance = QrExporter(
+                    self.token_store, self.data_path,
+                    use_cache=not self.token_store.ENCRYPTED)
+            return self.qr_exporter_instance
+
+    # Note: 削除時・秘密鍵の変更時はOTPの鍵のキャッシュを解除する
+    #       (秘密鍵を含まない概要情報のみの通知の場合は常に解除し、
+    #       行の表示時に取得し直す)
+    def event_change_token_store(self, event, key, item):
+        if event == "add":
+            self.search_index.add(key, item)
+        elif event == "update":
+            self.search_index.update(key, item)
+            if "secret" in item:
+                self.otp_engine.release_key(
+                    key, item["secret"], item.get("auth_uri"))
+            else:
+                self.otp_engine.release_key(key)
+        elif event == "remove":
+            self.search_index.remove(key)
+            self.otp_engine.release_key(key)
+        elif event == "load":
+            self.event_loaded()
+
+    # 全件の読み込み完了時の処理
+    # Note: 通知と__init__での確認の両方から呼ばれるため1回のみ実行する
+    def event_loaded(self):
+        with self.lock:
+            if self.loaded_handled:
+                return
+            self.loaded_handled = True
+        if self.token_store.load_error is not None:
+            print(f"Error: トークン情報の読み込みに失敗しました"
+                  f"(読み取り専用で開きます): {self.token_store.load_error}")
+        self.search_index.build(self.token_store.iter_search_records())
+
+        if os.getenv("AUTHENTICATOR_DAEMON"):
+            from otp_daemon import OtpDaemon
+            self.otp_daemon = OtpDaemon(
+                self.data_path, token_store=self.token_store,
+                otp_engine=self.otp_engine, vault_key=self.vault_key).start()
+
+    def close(self):
+        perf_monitor.stop_dump()
+        self.store_watcher.stop()
+        self.token_store.loaded.wait()
+        if self.otp_daemon is not None:
+            self.otp_daemon.stop()
+        self.token_store.close()
+
+
+# データパスごとの共有状態
+shared_states = {}
+shared_states_lock = threading.Lock()
+
+
+# 共有状態の取得(最初のセッションの場合は作成)
+# Note: sessionはセッションごとに一意なオブジェクト(page)を指定
+def acquire_shared_state(data_path: Path, session,
+                         vault_key=None) -> SharedAppState:
+    with shared_states_lock:
+        state = shared_states.get(data_path)
+        if state is None:
+            state = SharedAppState(data_path, vault_key)
+            shared_states[data_path] = state
+        state.sessions.add(session)
+        return state
+
+
+# 共有状態の解放
+# Note: 最後のセッションの終了時に未保存の変更を書き出して破棄
+def release_shared_state(state: SharedAppState, session):
+    with shared_states_lock:
+        state.sessions.discard(session)
+        if state.sessions:
+            return
+        if shared_states.get(state.data_path) is state:
+            del shared_states[state.data_path]
+    state.close()
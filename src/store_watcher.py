@@ -0,0 +1,217 @@
+import os
+import select
+import ctypes
+import ctypes.util
+import threading
+
+
+# inotifyによるフォルダの監視
+# Note: Linux以外やinotifyが使えない環境では生成時にOSErrorとなる
+class InotifyWatch:
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = (self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+                | self.IN_CREATE | self.IN_DELETE)
+        if libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+    # 変更があるまで待機(timeout秒で打ち切り)
+    # Note: 溜まっているイベントは読み捨て、変更の有無のみ返す
+    def wait(self, timeout: float) -> bool:
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        while True:
+            try:
+                if not os.read(self.fd, 65536):
+                    break
+            except BlockingIOError:
+                break
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+# 保存ファイルの監視および他のインスタンスによる変更の反映
+# Note: inotifyが使えない場合はpoll_interval秒ごとに更新時刻・サイズを確認
+#       変更の読み込みと差分計算は監視用のスレッドで行い、変更のあった
+#       トークンのみストアへ反映する(ストアの変更通知により各行へ反映)
+#       自身の書き込みによる変更はストアの記録と比較して無視する
+#
+#       差分は前回確認時の状態を基準に3方向で比較し、
+#       両方で異なる内容に変更された場合は競合として扱う
+#       競合時は手元の内容を残し、ファイル側の内容は別名のトークンとして
+#       追加して、どちらも失われないようにする
+#       基準の状態はトークンごとの変更確認値(get_revisions)のみ保持し、
+#       ファイル側(known)と手元(local)で別々に持つ(暗号化保存では同じ内容
+#       でも暗号化し直すと値が変わるため)
+#       トークン情報の全項目は変更のあったトークンのみ読み込む
+#       (暗号化保存の復号・SQLiteの読み込みを全件で行わないため)
+class StoreWatcher:
+    CONFLICT_SUFFIX = " (conflict)"
+
+    def __init__(self, token_store, poll_interval: float = 1.0,
+                 settle_delay: float = 0.05):
+        self.token_store = token_store
+        self.poll_interval = poll_interval
+        self.settle_delay = settle_delay
+        self.known = {}
+        self.local = {}
+        self.signature = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        with self.token_store.lock:
+            self.signature = self.token_store.file_signature
+            self.token_store.flushed_keys = set()
+            self.known = self.token_store.get_revisions()
+        self.local = dict(self.known)
+
+        try:
+            self.token_store.data_path.mkdir(parents=True, exist_ok=True)
+            watch = InotifyWatch(self.token_store.data_path)
+        except OSError:
+            watch = None
+        try:
+            while not self.stop_event.is_set():
+                if watch is not None:
+                    if watch.wait(self.poll_interval):
+                        # Note: 書き込みが続く場合に備えて少し待機
+                        self.stop_event.wait(self.settle_delay)
+                elif self.stop_event.wait(self.poll_interval):
+                    break
+                try:
+                    self.check()
+                except (OSError, ValueError):
+                    # Note: 書き込み途中などで読めない場合は次回に再試行
+                    self.signature = None
+        finally:
+            if watch is not None:
+                watch.close()
+
+    # 保存済みの自身の変更を基準の状態へ反映
+    # Note: 保存後のファイルの内容は手元と同じため、両方を手元の値にする
+    def refresh_known(self):
+        with self.token_store.lock:
+            keys = self.token_store.flushed_keys
+            self.token_store.flushed_keys = set()
+            if not keys:
+                return
+            revisions = self.token_store.get_revisions()
+        for key in keys:
+            revision = revisions.get(key)
+            if revision is None:
+                self.known.pop(key, None)
+                self.local.pop(key, None)
+            else:
+                self.known[key] = revision
+                self.local[key] = revision
+
+    # 変更の確認
+    # Note: 変更がない場合・自身の書き込みの場合は何もしない
+    def check(self) -> list:
+        self.refresh_known()
+        signature = self.token_store.get_file_signature()
+        if signature == self.signature:
+            return []
+        self.signature = signature
+        if signature == self.token_store.file_signature:
+            return []
+
+        remote_store = self.token_store.open_read_only_copy()
+        try:
+            return self.apply_remote(remote_store)
+        finally:
+            remote_store.close()
+
+    # ファイル側の内容との差分の反映
+    # Note: 変更確認値の変わったトークンのみ全項目を読み込んで比較し、
+    #       競合したkeyの一覧を返す
+    def apply_remote(self, remote_store) -> list:
+        remote = remote_store.get_revisions()
+        current = self.token_store.get_revisions()
+        conflicts = []
+        for key in self.known.keys() | remote.keys():
+            if remote.get(key) == self.known.get(key):
+                continue
+            theirs = remote_store.get(key)
+
+            with self.token_store.lock:
+                ours = self.token_store.get(key)
+                locally_changed = (
+                    key in self.token_store.dirty_keys
+                    or current.get(key) != self.local.get(key))
+            if ours == theirs:
+                # Note: SQLiteでは同じデータベースを参照するため内容は
+                #       一致するが、一覧表示用の概要情報は更新が必要
+                self.sync_summary(key, theirs)
+                continue
+            if not locally_changed:
+                self.token_store.apply_external(key, theirs)
+            elif ours is None:
+                # Note: 手元で削除・ファイル側で変更の場合は変更を残す
+                #       (未保存の削除を打ち消すためジャーナルにも記録)
+                self.token_store.add(key, dict(theirs))
+                self.token_store.notify("conflict", key, theirs)
+                conflicts.append(key)
+            else:
+                self.keep_both(key, ours, theirs)
+                conflicts.append(key)
+        self.known = remote
+        self.local = self.token_store.get_revisions()
+        return conflicts
+
+    # 一覧表示用の概要情報の反映(内容が異なる場合のみ)
+    def sync_summary(self, key: str, item):
+        with self.token_store.lock:
+            summary = self.token_store.tokens.get(key)
+            expected = None if item is None \
+                else self.token_store.make_summary(dict(item), key)
+            if summary == expected or key in self.token_store.dirty_keys:
+                return
+        self.token_store.apply_external(key, item)
+
+    # 競合時の処理
+    # Note: 手元の内容を書き直して確実に保存し、ファイル側の内容があれば
+    #       別名のトークンとして追加する
+    def keep_both(self, key: str, ours: dict, theirs):
+        self.token_store.add(key, dict(ours))
+        if theirs is None:
+            self.token_store.notify("conflict", key, ours)
+            return
+        conflict_key = key + self.CONFLICT_SUFFIX
+        count = 2
+        while conflict_key in self.token_store:
+            conflict_key = f"{key}{self.CONFLICT_SUFFIX[:-1]} {count})"
+            count += 1
+        item = dict(theirs, user=conflict_key)
+        item.pop("index", None)
+        self.token_store.add(conflict_key, item)
+        self.token_store.notify("conflict", conflict_key, item)
@@ -0,0 +1,310 @@
+import os
+import json
+import gzip
+import uuid
+from pathlib import Path
+
+from token_record import make_timestamp_text
+
+
+# バックアップの保存形式
+# Note: 1ファイル = gzip圧縮したJSON Lines
+#       (1行目がヘッダ、最終行が件数を含む終端、間が1行1件のレコード)
+#       レコードは{"key", "item"}、削除は{"key", "deleted_at"}(tombstone)
+#       暗号化保存のバックアップでは各行を{"sealed"}として暗号化し、
+#       トークン名も平文では残さない
+BACKUP_FORMAT = "authenticator-backup"
+BACKUP_VERSION = 1
+BACKUP_FILE_SUFFIX = ".jsonl.gz"
+BACKUP_STATE_FILE_NAME = "backup_state.json"
+
+# 1回の書き込みにまとめるレコード数
+BACKUP_CHUNK_SIZE = 256
+
+
+# バックアップ・復元の失敗(ファイルの破損・鍵違いなど)
+class BackupError(Exception):
+    pass
+
+
+# バックアップの結果
+class BackupResult:
+    def __init__(self):
+        self.archive_path = None
+        self.full = False
+        self.record_count = 0
+        self.tombstone_count = 0
+
+
+# 復元の結果
+# Note: skipped_keysは復元先の方が新しいため反映しなかったトークン
+class RestoreResult:
+    def __init__(self):
+        self.archive_paths = []
+        self.restored_keys = []
+        self.removed_keys = []
+        self.skipped_keys = []
+
+
+#
+# バックアップ
+#
+
+# 差分バックアップの作成
+# Note: 前回のバックアップ時から変更確認値(更新日時・並び順)の変わった
+#       トークンと削除されたトークンのみを書き出す
+#       前回の状態がない場合・fullの場合は全件を書き出す
+#       変更がない場合はファイルを作成しない(archive_pathはNone)
+#       アーカイブの書き出し完了後に状態ファイルを更新するため、
+#       途中で失敗した場合は次回も同じ差分が対象となる
+def backup_store(token_store, backup_path: Path,
+                 full: bool = False) -> BackupResult:
+    vault_key = get_vault_key(token_store)
+    backup_path.mkdir(parents=True, exist_ok=True)
+    state = load_backup_state(backup_path, vault_key)
+    if state is None:
+        full = True
+
+    marks = token_store.get_change_marks()
+    previous_marks = {} if full else state["marks"]
+    changed_keys = [
+        key for key in token_store.keys_in_order()
+        if previous_marks.get(key) != marks.get(key)]
+    removed_keys = [key for key in previous_marks if key not in marks]
+
+    result = BackupResult()
+    result.full = full
+    if not full and not changed_keys and not removed_keys:
+        return result
+
+    sequence = state["sequence"] + 1 if state is not None else 1
+    kind = "full" if full else "incremental"
+    header = {
+        "format": BACKUP_FORMAT,
+        "version": BACKUP_VERSION,
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "sequence": sequence,
+        "base": None if full else state["archive"],
+        "created_at": make_timestamp_text(),
+        "encrypted": vault_key is not None,
+    }
+    if vault_key is not None:
+        header["kdf"] = vault_key.kdf
+
+    def iter_entries():
+        for key in changed_keys:
+            item = token_store.get(key)
+            if item is not None:
+                result.record_count += 1
+                yield {"key": key, "item": dict(item)}
+        for key in removed_keys:
+            result.tombstone_count += 1
+            yield {"key": key, "deleted_at": header["created_at"]}
+
+    archive_path = backup_path.joinpath(
+        f"backup_{sequence:06d}_{kind}{BACKUP_FILE_SUFFIX}")
+    write_archive(archive_path, header, iter_entries(), vault_key)
+    result.archive_path = archive_path
+
+    save_backup_state(backup_path, {
+        "sequence": sequence, "archive": archive_path.name, "marks": marks,
+    }, vault_key)
+    return result
+
+
+# アーカイブの書き出し
+# Note: BACKUP_CHUNK_SIZE件ごとにまとめて圧縮ストリームへ書き込み、
+#       一時ファイルへの書き込み完了後にrenameする
+def write_archive(archive_path: Path, header: dict, entries, vault_key=None):
+    tmp_path = archive_path.with_name(archive_path.name + ".tmp")
+    count = 0
+    with open(tmp_path, "wb") as raw:
+        os.chmod(tmp_path, 0o600)
+        with gzip.open(raw, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            chunk = []
+            for entry in entries:
+                chunk.append(dump_entry(entry, header, vault_key))
+                count += 1
+                if len(chunk) >= BACKUP_CHUNK_SIZE:
+                    f.write("".join(chunk))
+                    chunk = []
+            f.write("".join(chunk))
+            f.write(json.dumps({"end": True, "count": count}) + "\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, archive_path)
+
+
+def dump_entry(entry: dict, header: dict, vault_key=None) -> str:
+    if vault_key is not None:
+        entry = {"sealed": vault_key.seal(entry, make_backup_aad(header))}
+    return json.dumps(entry, ensure_ascii=False) + "\n"
+
+
+#
+# 復元
+#
+
+# バックアップからの復元
+# Note: backup_pathがフォルダの場合は最後の全件バックアップと
+#       それ以降の差分バックアップを順に、ファイルの場合はそのファイルのみ読む
+#       各アーカイブを1件ずつ読みながらkeyごとに最新の内容へまとめ、
+#       復元先と比べて新しいもののみを1回の書き込みで反映する
+#       (途中で破損したアーカイブがある場合は何も反映しない)
+def restore_store(token_store, backup_path: Path) -> RestoreResult:
+    vault_key = get_vault_key(token_store)
+    result = RestoreResult()
+    result.archive_paths = list_restore_archives(backup_path)
+
+    entries = {}
+    base = None
+    for archive_path in result.archive_paths:
+        header, archive_entries = open_archive(archive_path, vault_key)
+        if header["kind"] == "incremental" and base is not None \
+                and header["base"] != base:
+            raise BackupError(
+                f"Backup chain is broken before {archive_path.name}")
+        for entry in archive_entries:
+            entries[entry["key"]] = entry
+        base = archive_path.name
+
+    items = []
+    remove_keys = []
+    for key, entry in entries.items():
+        current = token_store.get(key)
+        if "deleted_at" in entry:
+            if current is None:
+                continue
+            if get_updated_at(current) <= entry["deleted_at"]:
+                remove_keys.append(key)
+                result.removed_keys.append(key)
+            else:
+                result.skipped_keys.append(key)
+            continue
+
+        item = entry["item"]
+        if current is not None:
+            if dict(current) == item:
+                continue
+            if get_updated_at(current) > get_updated_at(item):
+                result.skipped_keys.append(key)
+                continue
+        items.append((key, item))
+        result.restored_keys.append(key)
+
+    token_store.apply_many(items, remove_keys)
+    return result
+
+
+# 復元対象のアーカイブの一覧(適用順)
+def list_restore_archives(backup_path: Path) -> list:
+    if backup_path.is_file():
+        return [backup_path]
+    archive_paths = sorted(
+        backup_path.glob(f"backup_*{BACKUP_FILE_SUFFIX}"))
+    for i in range(len(archive_paths) - 1, -1, -1):
+        if archive_paths[i].name.endswith(f"_full{BACKUP_FILE_SUFFIX}"):
+            return archive_paths[i:]
+    raise BackupError(f"No full backup found: {backup_path}")
+
+
+# アーカイブの読み込み
+# Note: ヘッダを確認して(ヘッダ, レコード一覧のイテレータ)を返す
+#       レコードは読み進めながら返し、終端行の件数が合わない場合
+#       (書き込み途中・破損)は最後にBackupErrorとする
+def open_archive(archive_path: Path, vault_key=None):
+    f = gzip.open(archive_path, "rt", encoding="utf-8")
+    try:
+        header = json.loads(f.readline() or "null")
+    except (OSError, EOFError, json.JSONDecodeError):
+        f.close()
+        raise BackupError(f"Invalid backup file: {archive_path}")
+    if not isinstance(header, dict) or header.get("format") != BACKUP_FORMAT:
+        f.close()
+        raise BackupError(f"Invalid backup file: {archive_path}")
+    if header["encrypted"] and (
+            vault_key is None or header.get("kdf") != vault_key.kdf):
+        f.close()
+        raise BackupError(
+            f"Backup was made with a different vault key: {archive_path}")
+
+    errors = (OSError, EOFError, json.JSONDecodeError)
+    if vault_key is not None:
+        from cryptography.exceptions import InvalidTag
+        errors += (InvalidTag,)
+
+    def iter_entries():
+        count = 0
+        try:
+            with f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry.get("end"):
+                        if entry["count"] != count:
+                            break
+                        return
+                    if "sealed" in entry:
+                        entry = vault_key.open(
+                            entry["sealed"], make_backup_aad(header))
+                    count += 1
+                    yield entry
+        except errors:
+            pass
+        raise BackupError(f"Backup file is incomplete: {archive_path}")
+
+    return header, iter_entries()
+
+
+#
+# 共通処理
+#
+
+# 暗号化保存の場合の暗号鍵
+def get_vault_key(token_store):
+    if not token_store.ENCRYPTED:
+        return None
+    return token_store.vault_key
+
+
+# 暗号化したレコードの追加認証データ(他のアーカイブとの入れ替え検知用)
+def make_backup_aad(header: dict) -> bytes:
+    return f"backup:{header['id']}".encode("utf-8")
+
+
+def get_updated_at(item) -> str:
+    return item.get("updated_at") or ""
+
+
+# 前回のバックアップの状態(連番・アーカイブ名・変更確認値)
+# Note: 暗号化保存の場合はトークン名を含む変更確認値を暗号化して保存する
+def load_backup_state(backup_path: Path, vault_key=None):
+    state_path = backup_path.joinpath(BACKUP_STATE_FILE_NAME)
+    if not state_path.exists():
+        return None
+    with open(state_path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if "sealed" in state:
+        if vault_key is None or state.get("kdf") != vault_key.kdf:
+            raise BackupError(
+                f"Backup was made with a different vault key: {backup_path}")
+        state["marks"] = vault_key.open(
+            state.pop("sealed"), b"backup-state")["marks"]
+    elif vault_key is not None:
+        raise BackupError(
+            f"Backup was made without encryption: {backup_path}")
+    return state
+
+
+def save_backup_state(backup_path: Path, state: dict, vault_key=None):
+    from token_store import write_file_atomic
+
+    if vault_key is not None:
+        sealed = vault_key.seal({"marks": state["marks"]}, b"backup-state")
+        state = {
+            "sequence": state["sequence"], "archive": state["archive"],
+            "kdf": vault_key.kdf, "sealed": sealed}
+    state_path = backup_path.joinpath(BACKUP_STATE_FILE_NAME)
+    write_file_atomic(state_path, json.dumps(state, ensure_ascii=False))
+    os.chmod(state_path, 0o600)
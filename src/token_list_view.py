@@ -0,0 +1,223 @@
+import flet as ft
+
+from perf_monitor import perf_monitor
+
+
+# ft.ReorderableListViewを継承してクラス化
+# Note: 仮想化モードでは表示領域付近の行のみ実体化し、それ以外は
+#       プレースホルダとしてOTP計算を停止させる
+class TokenListView(ft.ReorderableListView):
+    def __init__(self, row_height: int, create_row,
+                 virtualized: bool = True, overscan: int = 2, **kwargs):
+        super().__init__(**kwargs)
+        self.row_height = row_height
+        self.create_row = create_row
+        self.rows_by_key = {}
+        self.active_rows = {}
+        self.filter_keys = None
+        self.virtualized = virtualized
+        self.overscan = overscan
+        self.scroll_offset = 0.0
+        self.viewport_height = float(self.height or 0)
+        self.on_scroll_interval = 50
+        self.on_scroll = self.event_scroll
+
+    # 行データの差分反映
+    # Note: トークンのkeyをもとに既存の行を再利用し、追加・削除・移動・
+    #       内容変更のあった行のみ反映する(既存行のタイマーは維持される)
+    #       削除された行は表示内容をプールへ返却する
+    def sync(self, items: list, update: bool = True):
+        rows = []
+        rows_by_key = {}
+        for key, info in items:
+            row = self.rows_by_key.get(key)
+            if row is None:
+                row = self.create_row(key, info)
+                row.visible = self.is_filtered_in(key)
+            else:
+                row.patch(info)
+            rows.append(row)
+            rows_by_key[key] = row
+
+        for key, row in self.rows_by_key.items():
+            if key not in rows_by_key:
+                self.deactivate_row(row)
+        self.rows_by_key = rows_by_key
+        self.controls = rows
+        if update:
+            self.refresh_window(update=False)
+            self.update()
+
+    # 一部の行の差分反映
+    # Note: ストアの変更通知(add/update/remove)のあったトークン分のみ反映
+    #       itemsは(key, 概要情報, 並び順の位置, 検索条件に一致するか)の
+    #       一覧とし、位置は反映後の一覧での位置とする
+    #       行の追加・削除・移動がない場合は変更のあった行のみ更新し、
+    #       ある場合は対象の行を外してから位置の順に挿入し直す
+    def apply_changes(self, removed_keys: list, items: list,
+                      update: bool = True):
+        if self.filter_keys is not None:
+            self.filter_keys.difference_update(removed_keys)
+            for key, _, _, matched in items:
+                if matched:
+                    self.filter_keys.add(key)
+                else:
+                    self.filter_keys.discard(key)
+        items = [(key, info, position, self.is_filtered_in(key))
+                 for key, info, position, _ in items]
+
+        in_place = not any(key in self.rows_by_key for key in removed_keys)
+        for key, _, position, _ in items:
+            row = self.rows_by_key.get(key)
+            if row is None or position >= len(self.controls) \
+                    or self.controls[position] is not row:
+                in_place = False
+
+        changed_rows = []
+        if in_place:
+            for key, info, _, visible in items:
+                row = self.rows_by_key[key]
+                if row.patch(info) or row.visible is not visible:
+                    row.visible = visible
+                    changed_rows.append(row)
+            changed_rows.extend(self.refresh_window(update=False))
+            if update and changed_rows:
+                self.page.update(*dict.fromkeys(changed_rows))
+            return
+
+        detached_rows = [
+            self.rows_by_key[key]
+            for key in list(removed_keys) + [item[0] for item in items]
+            if key in self.rows_by_key]
+        for row in detached_rows:
+            self.controls.remove(row)
+        for key in removed_keys:
+            row = self.rows_by_key.pop(key, None)
+            if row is not None:
+                self.deactivate_row(row)
+
+        for key, info, position, visible in sorted(
+                items, key=lambda item: item[2]):
+            row = self.rows_by_key.get(key)
+            if row is None:
+                row = self.create_row(key, info)
+                self.rows_by_key[key] = row
+            else:
+                row.patch(info)
+            row.visible = visible
+            self.controls.insert(position, row)
+
+        self.refresh_window(update=False)
+        if update:
+            self.update()
+
+    # 検索結果の反映
+    # Note: 行は作り直さずに表示・非表示の切り替えのみ行う
+    #       keysがNoneの場合は全件表示
+    #       前回の検索結果(filter_keys)との差分のkeyの行のみ切り替える
+    #       (各行の表示状態は常にfilter_keysに一致させておく)
+    #       差分が多い場合は行の並び順に確認する(更新順を一覧の順に揃える)
+    def apply_filter(self, keys, update: bool = True):
+        previous_keys = self.filter_keys
+        if keys is None and previous_keys is None:
+            target_keys = ()
+        elif previous_keys is None:
+            target_keys = self.rows_by_key.keys() - keys
+        elif keys is None:
+            target_keys = self.rows_by_key.keys() - previous_keys
+        else:
+            target_keys = keys ^ previous_keys
+        self.filter_keys = None if keys is None else set(keys)
+
+        if len(target_keys) * 4 > len(self.controls):
+            target_rows = [row for row in self.controls
+                           if row.data in target_keys]
+        else:
+            target_rows = [self.rows_by_key[key] for key in target_keys
+                           if key in self.rows_by_key]
+
+        changed_rows = []
+        for row in target_rows:
+            visible = keys is None or row.data in keys
+            if row.visible is not visible:
+                row.visible = visible
+                changed_rows.append(row)
+
+        changed_rows.extend(self.refresh_window(update=False))
+        if update and changed_rows:
+            self.page.update(*dict.fromkeys(changed_rows))
+
+    # 検索結果に含まれるか(検索中でない場合は常にTrue)
+    def is_filtered_in(self, key: str) -> bool:
+        return self.filter_keys is None or key in self.filter_keys
+
+    # 表示上の並び替え
+    # Note: old_index/new_indexは表示中の行に対する位置
+    #       移動後の直前の行(先頭の場合は直後の行)のkeyをあわせて返す
+    def move_row(self, old_index: int, new_index: int) -> tuple:
+        visible_rows = self.get_visible_rows()
+        row = visible_rows.pop(old_index)
+        visible_rows.insert(new_index, row)
+        self.controls.remove(row)
+
+        after_key = before_key = None
+        if new_index > 0:
+            prev_row = visible_rows[new_index - 1]
+            self.controls.insert(self.controls.index(prev_row) + 1, row)
+            after_key = prev_row.data
+        elif len(visible_rows) > 1:
+            next_row = visible_rows[1]
+            self.controls.insert(self.controls.index(next_row), row)
+            before_key = next_row.data
+        else:
+            self.controls.append(row)
+        return row.data, after_key, before_key
+
+    # 表示中(非表示設定でない)の行一覧
+    def get_visible_rows(self) -> list:
+        return [row for row in self.controls if row.visible is not False]
+
+    # 表示範囲の行番号の計算
+    # Note: 前後にoverscan行分の余裕を持たせる
+    def get_window_range(self) -> tuple:
+        first = int(self.scroll_offset // self.row_height) - self.overscan
+        last = int((self.scroll_offset + self.viewport_height)
+                   // self.row_height) + self.overscan
+        return max(first, 0), last
+
+    # 表示範囲に応じた行の実体化・プレースホルダ化
+    # Note: 状態の変わった行のみまとめて更新し、変更行の一覧を返す
+    #       実体化中の行はactive_rowsで管理し、表示範囲外・非表示・削除済みの
+    #       行のみOTP計算を停止する(全行の走査は行わない)
+    def refresh_window(self, update: bool = True) -> list:
+        visible_rows = self.get_visible_rows()
+        if self.virtualized:
+            first, last = self.get_window_range()
+            visible_rows = visible_rows[first:last + 1]
+        wanted = {id(row): row for row in visible_rows}
+
+        changed_rows = []
+        for row_id, row in list(self.active_rows.items()):
+            if row_id not in wanted and self.deactivate_row(row):
+                changed_rows.append(row)
+        for row_id, row in wanted.items():
+            if row.set_active(True):
+                self.active_rows[row_id] = row
+                changed_rows.append(row)
+
+        perf_monitor.count("list.rows_changed", len(changed_rows))
+        if update and changed_rows:
+            self.page.update(*changed_rows)
+        return changed_rows
+
+    # 行のプレースホルダ化(表示内容はプールへ返却)
+    def deactivate_row(self, row) -> bool:
+        self.active_rows.pop(id(row), None)
+        return row.set_active(False)
+
+    # スクロール時の動作
+    def event_scroll(self, e: ft.OnScrollEvent):
+        self.scroll_offset = e.pixels
+        if e.viewport_dimension:
+            self.viewport_height = e.viewport_dimension
+        self.refresh_window()
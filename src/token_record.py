@@ -0,0 +1,316 @@
+import base64
+import string
+from datetime import datetime, timedelta
+from urllib.parse import quote, quote_plus
+
+
+# 登録日時・更新日時の保存形式
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIMESTAMP_EPOCH = datetime(1970, 1, 1)
+TIMESTAMP_ONE_SECOND = timedelta(seconds=1)
+
+# Base32の文字と32進数の数字の対応(秘密鍵の変換用)
+BASE32_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ234567"
+BASE32_TO_DIGITS = str.maketrans(
+    BASE32_ALPHABET, "0123456789abcdefghijklmnopqrstuv")
+BASE32_REMOVE = str.maketrans("", "", BASE32_ALPHABET)
+
+# URI内でエスケープ不要な文字
+URI_SAFE_CHARS = string.ascii_letters + string.digits + "_.-~"
+
+# 未設定の項目を表す値
+MISSING = object()
+
+
+# 現在日時の文字列(登録・更新時の保存用)
+def make_timestamp_text() -> str:
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+
+# 日時の文字列と整数(秒)の変換
+# Note: タイムゾーンは扱わず、保存されたローカル時刻をそのまま秒数にする
+#       (夏時間の切り替え前後でも元の文字列に戻せるようにするため)
+#       形式が異なる場合は変換せずにそのまま保持し、元が整数の場合は
+#       変換後の値と区別するためタプルに包む
+def pack_timestamp(text):
+    if not isinstance(text, str):
+        return (text,) if isinstance(text, int) else text
+    if not (len(text) == 19 and text[4] == "-" and text[7] == "-"
+            and text[10] == " " and text[13] == ":" and text[16] == ":"):
+        return text
+    try:
+        dt = datetime.fromisoformat(text)
+    except ValueError:
+        return text
+    return (dt - TIMESTAMP_EPOCH) // TIMESTAMP_ONE_SECOND
+
+
+def unpack_timestamp(value):
+    if type(value) is int:
+        return (TIMESTAMP_EPOCH + value * TIMESTAMP_ONE_SECOND).isoformat(" ")
+    if type(value) is tuple:
+        return value[0]
+    return value
+
+
+# 秘密鍵の文字列とバイト列の変換
+# Note: 大文字・パディングなしのBase32で元の文字列に戻せる場合のみ変換し、
+#       それ以外(小文字・空白入りなど)は文字列のまま保持する
+#       読み込み時の負荷を抑えるため、32進数の整数を経由して変換する
+def pack_secret(secret):
+    if not isinstance(secret, str) or not secret \
+            or len(secret) % 8 not in (0, 2, 4, 5, 7) \
+            or secret.translate(BASE32_REMOVE):
+        return secret
+    size, pad_bits = divmod(len(secret) * 5, 8)
+    value = int(secret.translate(BASE32_TO_DIGITS), 32)
+    if value & ((1 << pad_bits) - 1):
+        return secret
+    return (value >> pad_bits).to_bytes(size, "big")
+
+
+def unpack_secret(value):
+    if not isinstance(value, bytes):
+        return value
+    return base64.b32encode(value).decode("ascii").rstrip("=")
+
+
+# 名称・秘密鍵・発行者からの認証URIの作成
+# Note: otp_migration.make_otp_auth_uriと同じ形式(既定の設定のみ)
+#       エスケープ不要な文字のみの場合はquoteを呼ばずにそのまま使う
+def make_auth_uri(user: str, secret: str, issuer) -> str:
+    label = user if not user.strip(URI_SAFE_CHARS + ":@") \
+        else quote(user, safe=":@")
+    uri = f"otpauth://totp/{label}?secret={quote_uri_value(secret)}"
+    if issuer:
+        uri += f"&issuer={quote_uri_value(issuer)}"
+    return uri
+
+
+def quote_uri_value(value: str) -> str:
+    return value if not value.strip(URI_SAFE_CHARS) else quote_plus(value)
+
+
+# auth_uriを名称・秘密鍵・発行者から作成し直せるか
+# Note: 発行者が未設定(MISSING)の場合は作成し直さずにそのまま保持する
+def is_default_auth_uri(auth_uri, user, secret, issuer) -> bool:
+    return (isinstance(auth_uri, str) and auth_uri.startswith("otpauth://")
+            and isinstance(user, str) and isinstance(secret, str)
+            and (issuer is None or isinstance(issuer, str))
+            and auth_uri == make_auth_uri(user, secret, issuer))
+
+
+# トークン1件分の情報
+# Note: 件数が多い場合のメモリ使用量を抑えるため、dictではなく__slots__で
+#       項目を保持する
+#       秘密鍵はバイト列、日時は整数(秒)として保持し、保存時に元の文字列へ
+#       戻す(JSONの形式は従来どおり)
+#       auth_uriは名称・秘密鍵・発行者から作成できる場合は保持せず、
+#       参照時(QRコード出力時など)に作成する
+#       従来のdictと同じく["user"]やget("auth_uri")で参照できる
+#       既知の項目以外はextraへdictのまま保持し、保存時にそのまま書き出す
+class TokenRecord:
+    FIELDS = ("user", "secret", "issuer", "auth_uri", "note",
+              "created_at", "updated_at", "index")
+    FIELD_SET = frozenset(FIELDS)
+
+    __slots__ = ("user", "secret_value", "issuer", "auth_uri_value", "note",
+                 "created_value", "updated_value", "index", "extra")
+
+    def __init__(self):
+        self.user = MISSING
+        self.secret_value = MISSING
+        self.issuer = MISSING
+        self.auth_uri_value = MISSING
+        self.note = MISSING
+        self.created_value = MISSING
+        self.updated_value = MISSING
+        self.index = MISSING
+        self.extra = None
+
+    # 保存形式(dict)との変換
+    # Note: 読み込み時に全件で実行されるため、updateを経由せず直接設定する
+    #       名称がkeyと同じ場合はkeyの文字列を共有する
+    @classmethod
+    def from_dict(cls, item, key: str = None) -> "TokenRecord":
+        record = cls()
+        get = item.get
+        user = get("user", MISSING)
+        if user == key:
+            user = key
+        secret = get("secret", MISSING)
+        issuer = get("issuer", MISSING)
+        auth_uri = get("auth_uri", MISSING)
+        record.user = user
+        record.secret_value = pack_secret(secret)
+        record.issuer = issuer
+        record.auth_uri_value = (
+            None if is_default_auth_uri(auth_uri, user, secret, issuer)
+            else auth_uri)
+        record.note = get("note", MISSING)
+        record.created_value = pack_timestamp(get("created_at", MISSING))
+        record.updated_at = get("updated_at", MISSING)
+        record.index = get("index", MISSING)
+        if not item.keys() <= cls.FIELD_SET:
+            record.extra = {
+                field: value for field, value in item.items()
+                if field not in cls.FIELD_SET}
+        return record
+
+    def to_dict(self) -> dict:
+        return {field: self[field] for field in self.keys()}
+
+    def copy(self) -> "TokenRecord":
+        record = TokenRecord()
+        for name in self.__slots__:
+            setattr(record, name, getattr(self, name))
+        if self.extra is not None:
+            record.extra = dict(self.extra)
+        return record
+
+    #
+    # 各項目の参照・設定
+    #
+
+    @property
+    def secret(self):
+        return unpack_secret(self.secret_value)
+
+    @secret.setter
+    def secret(self, secret):
+        self.secret_value = pack_secret(secret)
+
+    # Note: auth_uri_valueがNoneの場合は名称・秘密鍵・発行者から作成
+    @property
+    def auth_uri(self):
+        if self.auth_uri_value is None:
+            return make_auth_uri(self.user, self.secret, self.issuer)
+        return self.auth_uri_value
+
+    @auth_uri.setter
+    def auth_uri(self, auth_uri):
+        self.auth_uri_value = auth_uri
+        self.pack_auth_uri()
+
+    @property
+    def created_at(self):
+        return unpack_timestamp(self.created_value)
+
+    @created_at.setter
+    def created_at(self, text):
+        self.created_value = pack_timestamp(text)
+
+    @property
+    def updated_at(self):
+        return unpack_timestamp(self.updated_value)
+
+    @updated_at.setter
+    def updated_at(self, text):
+        # Note: 登録時は登録日時と同じ値のため同じオブジェクトを共有
+        value = pack_timestamp(text)
+        self.updated_value = (
+            self.created_value if value == self.created_value else value)
+
+    # 保存ファイルの監視用の変更確認値
+    # Note: 全項目の内部の値のタプル(内容が同じ場合のみ一致する)
+    @property
+    def revision(self) -> tuple:
+        extra = dict(self.extra) if self.extra is not None else None
+        return (self.user, self.secret_value, self.issuer,
+                self.auth_uri_value, self.note, self.created_value,
+                self.updated_value, self.index, extra)
+
+    # バックアップの差分判定用の値([更新日時, index])
+    # Note: 更新日時は文字列に戻さず内部の値のままJSONで保存できる形にする
+    @property
+    def change_mark(self) -> list:
+        updated = self.updated_value
+        if updated is MISSING:
+            updated = None
+        elif type(updated) is tuple:
+            updated = list(updated)
+        return [updated, self.index]
+
+    # 作成し直せるauth_uriの省略
+    def pack_auth_uri(self):
+        if is_default_auth_uri(
+                self.auth_uri_value, self.user, self.secret, self.issuer):
+            self.auth_uri_value = None
+
+    #
+    # dict互換の参照処理
+    #
+
+    def __getitem__(self, field: str):
+        if field not in self.FIELDS:
+            if self.extra is None:
+                raise KeyError(field)
+            return self.extra[field]
+        value = getattr(self, field)
+        if value is MISSING:
+            raise KeyError(field)
+        return value
+
+    def __setitem__(self, field: str, value):
+        self.update({field: value})
+
+    def __contains__(self, field) -> bool:
+        if field not in self.FIELDS:
+            return self.extra is not None and field in self.extra
+        return getattr(self, field) is not MISSING
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def get(self, field: str, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def keys(self) -> list:
+        keys = [field for field in self.FIELDS
+                if getattr(self, field) is not MISSING]
+        if self.extra is not None:
+            keys.extend(self.extra)
+        return keys
+
+    def items(self) -> list:
+        return [(field, self[field]) for field in self.keys()]
+
+    def values(self) -> list:
+        return [self[field] for field in self.keys()]
+
+    # 項目の更新
+    # Note: auth_uriの省略可否は名称・秘密鍵・発行者に依存するため、
+    #       それらの変更前に作成済みの値へ戻してから更新する
+    def update(self, fields):
+        fields = dict(fields)
+        for field in fields.keys() - self.FIELD_SET:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[field] = fields[field]
+        if self.auth_uri_value is None and (
+                fields.keys() & {"user", "secret", "issuer"}):
+            self.auth_uri_value = self.auth_uri
+        for field in self.FIELDS:
+            if field in fields:
+                setattr(self, field, fields[field])
+        if self.auth_uri_value is not None:
+            self.pack_auth_uri()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, TokenRecord):
+            return all(getattr(self, name) == getattr(other, name)
+                       for name in self.__slots__)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"TokenRecord({self.to_dict()!r})"
@@ -0,0 +1,148 @@
+import flet as ft
+
+from otp_text import OtpText
+from otp_timebar import OtpTimeBar
+
+
+# 行の表示内容(名称・ボタン・OTP・残り時間バー)
+# Note: 表示領域に入った行へ貸し出し、keyを付け替えて使い回す
+#       ボタンのイベント処理は全行で共通の関数とし、keyはdataで受け渡す
+class TokenRowContent(ft.Column):
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+        self.mounted = False
+        self.release_on_unmount = False
+
+        self.text_user = ft.Text(width=300, size=16)
+        self.buttons = [
+            ft.IconButton(ft.Icons.QR_CODE, on_click=pool.on_click_qrcode),
+            ft.IconButton(ft.Icons.EDIT, on_click=pool.on_click_edit),
+            ft.IconButton(ft.Icons.REMOVE, on_click=pool.on_click_remove),
+        ]
+        self.otp_text = OtpText(None, pool.otp_clock)
+
+        # OTPの有効期限を表示する残り時間のバー表示
+        self.otp_time_bar = OtpTimeBar(pool.otp_clock)
+
+        self.controls = [
+            ft.Row(controls=[self.text_user] + self.buttons),
+            ft.Row(controls=[self.otp_text]),
+            ft.Row(controls=[ft.Divider(height=15)]),
+            ft.Row(controls=[self.otp_time_bar]),
+            ft.Row(controls=[ft.Divider(height=30)]),
+        ]
+
+    # 表示対象のトークンの付け替え
+    def bind(self, key: str, info: dict, otp_key):
+        self.text_user.value = info["user"]
+        for button in self.buttons:
+            button.data = key
+        self.otp_text.bind(otp_key)
+        self.otp_time_bar.bind(otp_key.period)
+
+    # did_mountおよびwill_unmountの定義
+    # Note: 画面から外された後にのみプールへ戻し、同じ更新内で
+    #       別の行へ付け替えられないようにする
+    def did_mount(self):
+        self.mounted = True
+
+    def will_unmount(self):
+        self.mounted = False
+        if self.release_on_unmount:
+            self.release_on_unmount = False
+            self.pool.release(self)
+
+
+# 行の表示内容のプール
+# Note: 表示内容は同時に表示される行数分のみ生成し、以降は使い回す
+#       トークンストア・共有クロック・イベント処理は各行で持たずにここで共有
+class TokenRowPool:
+    def __init__(self, token_store, otp_clock, on_click_qrcode,
+                 on_click_edit, on_click_remove, on_long_press):
+        self.token_store = token_store
+        self.otp_clock = otp_clock
+        self.on_click_qrcode = on_click_qrcode
+        self.on_click_edit = on_click_edit
+        self.on_click_remove = on_click_remove
+        self.on_long_press = on_long_press
+        self.free_contents = []
+        self.created_count = 0
+
+    # 行の生成(TokenListViewのcreate_rowとして利用)
+    def create_row(self, key: str, info: dict):
+        return TokenRow(key, info, self)
+
+    def acquire(self) -> TokenRowContent:
+        if self.free_contents:
+            return self.free_contents.pop()
+        self.created_count += 1
+        return TokenRowContent(self)
+
+    def release(self, content: TokenRowContent):
+        self.free_contents.append(content)
+
+    # 表示内容の返却
+    # Note: 画面に表示済みの場合は画面から外された時点で返却
+    def release_later(self, content: TokenRowContent):
+        if content.mounted:
+            content.release_on_unmount = True
+        else:
+            self.release(content)
+
+
+# トークン1件分の行表示
+# Note: 表示領域外ではプレースホルダ(名称のみ)とし、OTP計算を停止させる
+#       表示領域内ではプールから表示内容を借りて、このトークンに付け替える
+#       infoは一覧表示用の概要情報とし、秘密鍵は実体化時にストアから取得
+class TokenRow(ft.Container):
+    # 行の高さ(仮想化時の表示範囲計算に利用)
+    ROW_HEIGHT = 200
+
+    def __init__(self, key: str, info: dict, pool: TokenRowPool):
+        super().__init__()
+        self.data = key
+        self.height = TokenRow.ROW_HEIGHT
+        self.on_long_press = pool.on_long_press
+        self.pool = pool
+        self.info = info.copy()
+        self.row_content = None
+        self.placeholder = ft.Text(info["user"], size=16)
+        self.content = self.placeholder
+
+    @property
+    def active(self) -> bool:
+        return self.row_content is not None
+
+    # 表示状態の切り替え
+    # Note: 状態が変化した場合のみTrueを返す
+    def set_active(self, active: bool) -> bool:
+        if self.active == active:
+            return False
+        if active:
+            self.row_content = self.pool.acquire()
+            self.bind_content()
+            self.content = self.row_content
+        else:
+            self.pool.release_later(self.row_content)
+            self.row_content = None
+            self.content = self.placeholder
+        return True
+
+    # 行の内容変更の反映
+    # Note: 内容に変化がない場合は何もしない
+    def patch(self, info: dict) -> bool:
+        if info == self.info:
+            return False
+        self.info = info.copy()
+        self.placeholder.value = info["user"]
+        if self.active:
+            self.bind_content()
+        return True
+
+    def bind_content(self):
+        key = self.data
+        record = self.pool.token_store[key]
+        otp_key = self.pool.otp_clock.otp_engine.get_key(
+            record["secret"], record.get("auth_uri"), owner=key)
+        self.row_content.bind(key, self.info, otp_key)
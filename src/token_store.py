@@ -0,0 +1,702 @@
+import os
+import re
+import json
+import time
+import bisect
+import contextlib
+import threading
+from pathlib import Path
+
+from perf_monitor import perf_monitor
+from token_record import TokenRecord
+
+
+# トークン情報の保存処理
+# Note: 変更内容は追記専用のジャーナルに記録し、一定件数ごとに
+#       スナップショット(token_data.json)へまとめて書き出す
+#       スナップショットは一時ファイルへの書き込み後にrenameで差し替える
+#       並び順は間隔を空けたindex値で管理し、移動時は対象のみ書き換える
+#       メモリ上ではトークン情報をTokenRecordとして保持する
+class TokenStore:
+    SNAPSHOT_FILE_NAME = "token_data.json"
+    JOURNAL_FILE_NAME = "token_data.journal"
+
+    # 秘密鍵を暗号化して保存するか
+    ENCRYPTED = False
+
+    # スナップショットを先頭から段階的に読み込めるか
+    STREAMING_LOAD = True
+
+    # 並び順のindex間隔および再割り当てを行う最小間隔
+    ORDER_GAP = 1024.0
+    ORDER_MIN_GAP = 1e-6
+
+    def __init__(self, data_path: Path, flush_delay: float = 0.5,
+                 compact_threshold: int = 500, read_only: bool = False):
+        self.data_path = data_path
+        self.read_only = read_only
+        self.snapshot_path = data_path.joinpath(self.SNAPSHOT_FILE_NAME)
+        self.journal_path = data_path.joinpath(self.JOURNAL_FILE_NAME)
+        self.flush_delay = flush_delay
+        self.compact_threshold = compact_threshold
+
+        self.tokens = {}
+        self.order_keys = []
+        self.order_indexes = []
+        self.pending_ops = []
+        self.journal_count = 0
+        self.flush_timer = None
+        self.listeners = []
+        self.lock = threading.RLock()
+
+        # 読み込みの完了状態
+        # Note: 段階的な読み込みの途中のみ未完了となる
+        self.loaded = threading.Event()
+        self.loaded.set()
+        self.load_error = None
+
+        # 保存ファイルの変更検知用
+        # Note: dirty_keysは未保存の変更のあるkey、flushed_keysは保存済みで
+        #       監視側に未通知のkey、file_signatureは自身の最後の書き込み後の
+        #       ファイルの状態
+        self.dirty_keys = set()
+        self.flushed_keys = set()
+        self.file_signature = None
+
+    #
+    # 読み込み処理
+    #
+
+    # スナップショットの読み込みおよびジャーナルの再適用
+    def load(self):
+        with self.lock:
+            self.tokens = {}
+            if self.snapshot_path.exists():
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    self.tokens = {
+                        key: TokenRecord.from_dict(item, key)
+                        for key, item in json.load(f).items()}
+
+            self.journal_count = 0
+            if self.journal_path.exists():
+                self.replay_journal()
+            self.rebuild_order()
+            self.file_signature = self.get_file_signature()
+        return self
+
+    # スナップショットの段階的な読み込み
+    # Note: 並び順の先頭first_count件のみ読み込んだ時点で戻り(起動時の
+    #       最初の画面表示用)、残りは別スレッドで続けて読み込む
+    #       読み込み中はロックを保持して書き込み操作を待機させ、完了時に
+    #       loadedをセットしてlistenerへ"load"を通知する
+    #       ジャーナルがある場合(前回の終了時に書き出されていない場合)や
+    #       段階的に読み込めない保存形式では、通常の読み込みを行う
+    def load_progressive(self, first_count: int):
+        if not self.STREAMING_LOAD or self.journal_path.exists() \
+                or not self.snapshot_path.exists():
+            return self.load()
+
+        with self.lock:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                items = iter_json_object_items(f.read())
+            tokens = {}
+            for key, item in items:
+                tokens[key] = TokenRecord.from_dict(item, key)
+                if len(tokens) >= first_count:
+                    break
+            # Note: 並び順に書き出す前の保存ファイルでは先頭が並び順の
+            #       先頭とは限らないため、通常の読み込みを行う
+            if not self.is_ascending_order(tokens):
+                return self.load()
+            self.tokens = tokens
+            self.journal_count = 0
+            self.rebuild_order()
+            self.file_signature = self.get_file_signature()
+
+            self.loaded.clear()
+            ready = threading.Event()
+            threading.Thread(
+                target=self.run_progressive_load,
+                args=(items, tokens, ready), daemon=True).start()
+        ready.wait()
+        return self
+
+    # 残りのトークン情報の読み込み
+    # Note: 読み込み済みの一覧は書き換えずに新しい一覧を作成して差し替える
+    #       (読み込み中に画面側から参照されるため)
+    #       一定件数ごとにGILを手放し、最初の画面表示の処理を優先させる
+    #       一覧・並び順はすべて作成できた時点でまとめて差し替え、
+    #       途中で失敗した場合(解析エラー・項目の欠落など)は一部のみの
+    #       内容で上書きしないよう、読み取り専用に切り替える
+    #       loadedは"load"の通知後に設定する(待機側が通知後の状態を参照できる)
+    def run_progressive_load(self, items, tokens: dict, ready):
+        with self.lock:
+            ready.set()
+            try:
+                tokens = dict(tokens)
+                for count, (key, item) in enumerate(items, start=1):
+                    tokens[key] = TokenRecord.from_dict(item, key)
+                    if count % PROGRESSIVE_LOAD_YIELD_COUNT == 0:
+                        time.sleep(0)
+                order_indexes, order_keys = self.make_order(tokens)
+            except Exception as e:
+                self.load_error = e
+                self.read_only = True
+            else:
+                self.tokens = tokens
+                self.order_indexes = order_indexes
+                self.order_keys = order_keys
+        try:
+            self.notify("load", None, None)
+        finally:
+            self.loaded.set()
+
+    # 同じ保存ファイルを読み取り専用で開いたストアの作成
+    # Note: 他のインスタンスによる変更の確認用
+    def open_read_only_copy(self):
+        return type(self)(self.data_path, read_only=True).load()
+
+    # 保存ファイルの状態(更新時刻・サイズ)
+    def get_file_paths(self) -> list:
+        return [self.snapshot_path, self.journal_path]
+
+    def get_file_signature(self) -> tuple:
+        signature = []
+        for path in self.get_file_paths():
+            try:
+                stat = path.stat()
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    # ジャーナルの再適用
+    # Note: 書き込み途中で終了した末尾行は無視し、以降の追記に備えて切り詰める
+    #       読み取り専用の場合は他プロセスが追記中の可能性があるため切り詰めない
+    def replay_journal(self):
+        valid_size = 0
+        mode = "rb" if self.read_only else "r+b"
+        with open(self.journal_path, mode) as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self.apply_op(op)
+                self.journal_count += 1
+                valid_size += len(line)
+            if not self.read_only:
+                f.truncate(valid_size)
+
+    # ジャーナルの1操作分の反映
+    def apply_op(self, op: dict):
+        kind = op["op"]
+        key = op.get("key")
+        if kind == "put":
+            self.tokens[key] = self.make_summary(op["item"], key)
+        elif kind == "patch":
+            if key in self.tokens:
+                self.update_summary(self.tokens[key], op["fields"])
+        elif kind == "delete":
+            self.tokens.pop(key, None)
+        elif kind == "order":
+            gap = op.get("gap", 1)
+            for i, order_key in enumerate(op["keys"], start=1):
+                if order_key in self.tokens:
+                    self.tokens[order_key]["index"] = i * gap
+
+    #
+    # 並び順の管理
+    #
+
+    # 読み込み順がindexの昇順になっているかの確認
+    # Note: indexのない(数値でない)トークンがある場合も昇順ではないものとする
+    @staticmethod
+    def is_ascending_order(tokens: dict) -> bool:
+        indexes = [info.get("index") for info in tokens.values()]
+        if not all(isinstance(index, (int, float))
+                   and not isinstance(index, bool) for index in indexes):
+            return False
+        return all(a <= b for a, b in zip(indexes, indexes[1:]))
+
+    # 並び順の一覧の再作成
+    # Note: 読み込み時および再割り当て時のみ実行(以降は差分更新)
+    def rebuild_order(self):
+        self.order_indexes, self.order_keys = self.make_order(self.tokens)
+
+    @staticmethod
+    def make_order(tokens: dict) -> tuple:
+        pairs = sorted((info["index"], key) for key, info in tokens.items())
+        return [index for index, _ in pairs], [key for _, key in pairs]
+
+    def insert_order(self, key: str):
+        index = self.tokens[key]["index"]
+        pos = bisect.bisect_right(self.order_indexes, index)
+        self.order_indexes.insert(pos, index)
+        self.order_keys.insert(pos, key)
+
+    def remove_order(self, key: str):
+        pos = self.find_order_position(key)
+        del self.order_indexes[pos]
+        del self.order_keys[pos]
+
+    # 並び順の中での位置の取得
+    # Note: 同じindex値のトークンが複数ある場合に備えて前方から確認
+    def find_order_position(self, key: str) -> int:
+        index = self.tokens[key]["index"]
+        pos = bisect.bisect_left(self.order_indexes, index)
+        while self.order_keys[pos] != key:
+            pos += 1
+        return pos
+
+    # 末尾に追加する際のindex値
+    def next_order_index(self) -> float:
+        if not self.order_indexes:
+            return self.ORDER_GAP
+        return self.order_indexes[-1] + self.ORDER_GAP
+
+    # 並び順の再割り当て
+    # Note: 間隔が詰まった場合のみ全件のindexを振り直す
+    def rebalance_order(self):
+        for i, key in enumerate(self.order_keys, start=1):
+            self.tokens[key]["index"] = i * self.ORDER_GAP
+        self.order_indexes = [
+            i * self.ORDER_GAP for i in range(1, len(self.order_keys) + 1)]
+        self.record_op({
+            "op": "order", "keys": list(self.order_keys),
+            "gap": self.ORDER_GAP})
+
+    #
+    # 参照処理
+    #
+
+    def __contains__(self, key) -> bool:
+        return key in self.tokens
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __getitem__(self, key: str) -> dict:
+        return self.tokens[key]
+
+    def get(self, key: str, default=None):
+        return self.tokens.get(key, default)
+
+    def keys(self):
+        return self.tokens.keys()
+
+    def items(self):
+        return self.tokens.items()
+
+    # 検索インデックス作成用のトークン一覧
+    def iter_search_records(self):
+        return iter(self.tokens.items())
+
+    # 全トークンの秘密鍵の一覧(重複確認用)
+    # Note: トークン情報全体を1件ずつ取得せず、秘密鍵のみまとめて取得する
+    def get_secrets(self) -> list:
+        with self.lock:
+            secrets = [record.get("secret") for record in self.tokens.values()]
+        return [secret for secret in secrets if secret is not None]
+
+    # 保存ファイルの監視用の変更確認値(key: 値)
+    # Note: 値が同じトークンは内容も同じとみなし、全項目を読み込まない
+    #       JSON保存ではメモリ上の全項目から作成する
+    def get_revisions(self) -> dict:
+        with self.lock:
+            return {
+                key: record.revision for key, record in self.tokens.items()}
+
+    # バックアップ用の変更確認値(key: [更新日時, index])
+    # Note: 前回のバックアップ時の値と異なるトークンのみ差分バックアップする
+    def get_change_marks(self) -> dict:
+        with self.lock:
+            return {
+                key: record.change_mark
+                for key, record in self.tokens.items()}
+
+    # 一覧表示用の概要情報
+    # Note: JSON保存ではトークン情報をすべて保持する
+    def make_summary(self, item: dict, key: str = None) -> TokenRecord:
+        return TokenRecord.from_dict(item, key)
+
+    def update_summary(self, summary, fields: dict):
+        summary.update(fields)
+
+    # 一覧表示用の参照時のロック
+    # Note: 段階的な読み込み中はself.lockを読み込み処理が保持し続けるため、
+    #       最初の画面表示を待たせないようロックを取らずに参照する
+    #       (読み込み中は書き込みが行われず、参照側は並び順を複製して
+    #       概要情報はgetで取得するため、途中で差し替えられても問題ない)
+    def lock_for_read(self):
+        if self.loaded.is_set():
+            return self.lock
+        return contextlib.nullcontext()
+
+    # 並び順どおりのトークン一覧
+    # Note: 他のセッションの変更と同時に呼ばれるため、ロック内で一覧を作成
+    #       (並び順にあって概要情報のないkeyは読み飛ばす)
+    def keys_in_order(self) -> list:
+        with self.lock_for_read():
+            return list(self.order_keys)
+
+    # 一覧表示用の概要情報の取得(ない場合はNone)
+    def get_summary(self, key: str):
+        with self.lock_for_read():
+            return self.tokens.get(key)
+
+    def items_in_order(self) -> list:
+        with self.lock_for_read():
+            tokens = self.tokens
+            items = []
+            for key in list(self.order_keys):
+                info = tokens.get(key)
+                if info is not None:
+                    items.append((key, info))
+            return items
+
+    #
+    # 更新処理
+    #
+
+    # トークンの追加(同一keyの場合は置き換え)
+    # Note: indexの指定がない場合は、既存の位置もしくは末尾に配置
+    def add(self, key: str, item: dict):
+        with self.lock:
+            self.put_item(key, item)
+        self.notify("add", key, item)
+
+    # トークンの一括追加
+    # Note: 追加後すぐに1回の書き込みでまとめて保存する
+    def add_many(self, items: list):
+        if not items:
+            return
+        with self.lock:
+            for key, item in items:
+                self.put_item(key, item)
+        for key, item in items:
+            self.notify("add", key, item)
+        self.flush()
+
+    # 複数トークンの追加・置き換えおよび削除(バックアップからの復元用)
+    # Note: まとめて反映してから1回のみ保存する
+    def apply_many(self, items: list, remove_keys: list):
+        if not items and not remove_keys:
+            return
+        put_events = []
+        removed_items = []
+        with self.lock:
+            for key, item in items:
+                put_events.append(
+                    ("update" if key in self.tokens else "add", key))
+                self.put_item(key, item)
+            for key in remove_keys:
+                if key not in self.tokens:
+                    continue
+                self.remove_order(key)
+                removed_items.append((key, self.tokens.pop(key)))
+                self.record_op({"op": "delete", "key": key})
+        for event, key in put_events:
+            self.notify(event, key, self[key])
+        for key, item in removed_items:
+            self.notify("remove", key, item)
+        self.flush()
+
+    def put_item(self, key: str, item: dict):
+        if key in self.tokens:
+            item.setdefault("index", self.tokens[key]["index"])
+            self.remove_order(key)
+        else:
+            item.setdefault("index", self.next_order_index())
+        self.tokens[key] = self.make_summary(item, key)
+        self.insert_order(key)
+        self.record_op({"op": "put", "key": key, "item": dict(item)})
+
+    # トークンの一部項目の更新
+    def patch(self, key: str, fields: dict):
+        with self.lock:
+            if "index" in fields:
+                self.remove_order(key)
+            self.update_summary(self.tokens[key], fields)
+            if "index" in fields:
+                self.insert_order(key)
+            self.record_op({"op": "patch", "key": key, "fields": fields})
+        self.notify("update", key, self[key])
+
+    # トークンの削除
+    def remove(self, key: str):
+        with self.lock:
+            self.remove_order(key)
+            item = self.tokens.pop(key)
+            self.record_op({"op": "delete", "key": key})
+        self.notify("remove", key, item)
+
+    # 並び順の移動
+    # Note: after_key(直後に配置)もしくはbefore_key(直前に配置)を指定
+    #       前後のindex値の中間値を設定し、対象トークンのみ書き換える
+    def move(self, key: str, after_key=None, before_key=None):
+        with self.lock:
+            self.remove_order(key)
+            if after_key is not None:
+                pos = self.find_order_position(after_key) + 1
+            elif before_key is not None:
+                pos = self.find_order_position(before_key)
+            else:
+                pos = len(self.order_keys)
+
+            index = self.get_index_between(pos)
+            if index is None:
+                self.tokens[key]["index"] = self.next_order_index()
+                self.insert_order(key)
+                self.rebalance_order()
+                self.move(key, after_key, before_key)
+                return
+            self.tokens[key]["index"] = index
+            self.order_indexes.insert(pos, index)
+            self.order_keys.insert(pos, key)
+            self.record_op({
+                "op": "patch", "key": key, "fields": {"index": index}})
+        self.notify("order", key, self.tokens[key])
+
+    # 指定位置に挿入する際のindex値
+    # Note: 間隔が詰まっている場合はNoneを返す
+    def get_index_between(self, pos: int):
+        if not self.order_keys:
+            return self.ORDER_GAP
+        if pos == 0:
+            return self.order_indexes[0] - self.ORDER_GAP
+        if pos == len(self.order_keys):
+            return self.order_indexes[-1] + self.ORDER_GAP
+        low = self.order_indexes[pos - 1]
+        high = self.order_indexes[pos]
+        if high - low < self.ORDER_MIN_GAP:
+            return None
+        return (low + high) / 2
+
+    # 他のインスタンスによる変更の反映
+    # Note: 保存ファイルにはすでに反映済みのため、メモリ上のみ更新して
+    #       ジャーナルには記録しない(itemがNoneの場合は削除)
+    def apply_external(self, key: str, item):
+        with self.lock:
+            exists = key in self.tokens
+            if exists:
+                self.remove_order(key)
+            if item is None:
+                self.tokens.pop(key, None)
+            else:
+                self.tokens[key] = self.make_summary(dict(item), key)
+                self.insert_order(key)
+        if item is None:
+            if exists:
+                self.notify("remove", key, None)
+        else:
+            self.notify("update" if exists else "add", key, item)
+
+    #
+    # 変更通知
+    #
+
+    # Note: listenerは(event, key, item)を引数に呼び出される
+    #       eventは"add"/"update"/"remove"/"order"/"conflict"/"load"のいずれか
+    #       ("conflict"は他のインスタンスとの競合時に追加したトークン、
+    #       "load"は段階的な読み込みの完了でkey・itemはNone)
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def notify(self, event: str, key, item):
+        for listener in list(self.listeners):
+            listener(event, key, item)
+
+    #
+    # 保存処理
+    #
+
+    # 変更操作の記録および保存予約
+    def record_op(self, op: dict):
+        self.check_writable()
+        self.mark_dirty(op)
+        self.pending_ops.append(op)
+        self.request_flush()
+
+    # 変更のあったkeyの記録
+    def mark_dirty(self, op: dict):
+        if "key" in op:
+            self.dirty_keys.add(op["key"])
+        else:
+            self.dirty_keys.update(op.get("keys", []))
+
+    # 保存完了の記録
+    def mark_flushed(self):
+        self.flushed_keys |= self.dirty_keys
+        self.dirty_keys = set()
+        self.file_signature = self.get_file_signature()
+
+    def check_writable(self):
+        if self.read_only:
+            raise RuntimeError("Token store is opened as read-only")
+
+    def is_dirty(self) -> bool:
+        return bool(self.pending_ops)
+
+    # 保存の予約
+    # Note: 一定時間内の変更をまとめて1回の書き込みにする
+    def request_flush(self):
+        with self.lock:
+            if self.flush_timer is not None:
+                return
+            self.flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self.flush_timer.start()
+
+    # ジャーナルへの追記
+    # Note: 未保存の変更がない場合は何もしない
+    def flush(self):
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            if not self.pending_ops:
+                return
+
+            with perf_monitor.measure("store.flush"):
+                self.data_path.mkdir(parents=True, exist_ok=True)
+                lines = "".join(
+                    json.dumps(op, ensure_ascii=False) + "\n"
+                    for op in self.pending_ops)
+                with open(self.journal_path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.journal_count += len(self.pending_ops)
+            self.pending_ops = []
+            self.mark_flushed()
+
+            if self.journal_count >= self.compact_threshold:
+                self.compact()
+
+    # スナップショットへの書き出しおよびジャーナルの削除
+    def compact(self):
+        with self.lock, perf_monitor.measure("store.compact"):
+            self.check_writable()
+            self.data_path.mkdir(parents=True, exist_ok=True)
+            self.pending_ops = []
+            # Note: 段階的な読み込みで先頭から表示できるよう並び順に書き出す
+            tokens = {
+                key: self.tokens[key].to_dict() for key in self.order_keys}
+            write_file_atomic(
+                self.snapshot_path, json.dumps(tokens, indent=4))
+            if self.journal_path.exists():
+                self.journal_path.unlink()
+            self.journal_count = 0
+            self.mark_flushed()
+
+    # 終了時の処理
+    # Note: JSON保存ではスナップショットへ書き出してジャーナルを削除
+    def close(self):
+        if self.read_only:
+            return
+        with self.lock:
+            if self.pending_ops or self.journal_count > 0:
+                self.compact()
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+
+
+# 段階的な読み込みでGILを手放す間隔(件数)
+PROGRESSIVE_LOAD_YIELD_COUNT = 256
+
+
+# JSONオブジェクトの項目を先頭から1件ずつ解析して返す
+# Note: 途中で打ち切った場合、残りの部分は解析しない
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def iter_json_object_items(text: str):
+    decoder = json.JSONDecoder()
+
+    def skip(pos: int) -> int:
+        return JSON_WHITESPACE.match(text, pos).end()
+
+    pos = skip(0)
+    if text[pos:pos + 1] != "{":
+        raise ValueError("Expected a JSON object")
+    pos = skip(pos + 1)
+    if text[pos:pos + 1] == "}":
+        return
+    while True:
+        key, pos = decoder.raw_decode(text, pos)
+        pos = skip(pos)
+        if not isinstance(key, str) or text[pos:pos + 1] != ":":
+            raise ValueError(f"Invalid JSON object key at {pos}")
+        value, pos = decoder.raw_decode(text, skip(pos + 1))
+        yield key, value
+        pos = skip(pos)
+        separator = text[pos:pos + 1]
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or '}}' at {pos}")
+        pos = skip(pos + 1)
+
+
+# 一時ファイルへの書き込みとrenameによるファイル保存
+def write_file_atomic(path: Path, text: str):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# SQLite保存時のファイル名
+SQLITE_FILE_NAME = "token_data.sqlite3"
+
+# 暗号化保存時のファイル名
+VAULT_FILE_NAME = "token_vault.json"
+VAULT_JOURNAL_FILE_NAME = "token_vault.journal"
+
+
+# 保存形式に応じたストアの作成
+# Note: 環境変数AUTHENTICATOR_STORE_BACKENDで"json"/"sqlite"/"vault"を指定
+#       未指定の場合は暗号化保存ファイルがあれば暗号化保存、
+#       SQLiteのファイルがあればSQLite、なければJSONを利用
+#       暗号化保存の場合は解錠済みのvault_keyが必要
+#       read_onlyの場合はファイルへの書き込みを一切行わない
+#       first_countを指定した場合は先頭の件数分のみ読み込んだ時点で戻り、
+#       残りは別スレッドで読み込む(TokenStore.load_progressive)
+def open_token_store(data_path: Path, backend: str = None,
+                     read_only: bool = False, vault_key=None,
+                     first_count: int = None) -> TokenStore:
+    if backend is None:
+        backend = os.getenv("AUTHENTICATOR_STORE_BACKEND")
+    if backend is None:
+        if data_path.joinpath(VAULT_FILE_NAME).exists():
+            backend = "vault"
+        elif data_path.joinpath(SQLITE_FILE_NAME).exists():
+            backend = "sqlite"
+        else:
+            backend = "json"
+
+    if backend == "vault":
+        from token_store_vault import EncryptedTokenStore, VaultUnlockError
+        if vault_key is None:
+            raise VaultUnlockError("Vault is locked")
+        return EncryptedTokenStore(
+            data_path, vault_key, read_only=read_only).load()
+    elif backend == "sqlite":
+        from token_store_sqlite import SqliteTokenStore
+        return SqliteTokenStore(data_path, read_only=read_only).load()
+    elif backend == "json":
+        token_store = TokenStore(data_path, read_only=read_only)
+        if first_count is not None:
+            return token_store.load_progressive(first_count)
+        return token_store.load()
+    else:
+        raise ValueError(f"Unknown token store backend: {backend}")
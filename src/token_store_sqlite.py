@@ -0,0 +1,237 @@
+import sqlite3
+from pathlib import Path
+
+from perf_monitor import perf_monitor
+from token_store import TokenStore, SQLITE_FILE_NAME
+
+
+# SQLiteによるトークン情報の保存処理
+# Note: 起動時は一覧表示用の概要情報(index/user/issuer)のみ読み込み、
+#       秘密鍵やメモは行の表示・編集時にのみ取得する
+#       変更はトランザクション内で実行し、保存予約のタイミングでcommit
+class SqliteTokenStore(TokenStore):
+    STREAMING_LOAD = False
+    SUMMARY_FIELDS = ("index", "user", "issuer")
+    RECORD_FIELDS = (
+        "index", "user", "secret", "issuer", "auth_uri", "note",
+        "created_at", "updated_at")
+
+    # Note: "index"はSQLの予約語のためカラム名をidxとする
+    COLUMN_NAMES = {field: field for field in RECORD_FIELDS}
+    COLUMN_NAMES["index"] = "idx"
+
+    def __init__(self, data_path: Path, flush_delay: float = 0.5,
+                 read_only: bool = False):
+        super().__init__(
+            data_path, flush_delay=flush_delay, read_only=read_only)
+        self.database_path = data_path.joinpath(SQLITE_FILE_NAME)
+        self.connection = None
+
+    #
+    # 読み込み処理
+    #
+
+    def load(self):
+        with self.lock:
+            if self.read_only:
+                self.connect_read_only()
+            else:
+                self.data_path.mkdir(parents=True, exist_ok=True)
+                is_new = not self.database_path.exists()
+                self.connection = sqlite3.connect(
+                    self.database_path, check_same_thread=False)
+                self.create_tables()
+                if is_new:
+                    self.migrate_from_json()
+
+            cursor = self.connection.execute(
+                "SELECT key, idx, user, issuer FROM tokens")
+            self.tokens = {
+                key: {"index": idx, "user": user, "issuer": issuer}
+                for key, idx, user, issuer in cursor
+            }
+            self.rebuild_order()
+            self.file_signature = self.get_file_signature()
+        return self
+
+    def get_file_paths(self) -> list:
+        return [
+            self.database_path,
+            self.database_path.with_name(self.database_path.name + "-wal")]
+
+    # 読み取り専用での接続
+    # Note: データベースがない場合は空のメモリ上のデータベースを利用
+    def connect_read_only(self):
+        if self.database_path.exists():
+            self.connection = sqlite3.connect(
+                f"{self.database_path.as_uri()}?mode=ro", uri=True,
+                check_same_thread=False)
+        else:
+            self.connection = sqlite3.connect(
+                ":memory:", check_same_thread=False)
+            self.create_tables()
+
+    def create_tables(self):
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS tokens (
+                key TEXT PRIMARY KEY,
+                idx REAL NOT NULL,
+                user TEXT NOT NULL,
+                secret TEXT NOT NULL,
+                issuer TEXT,
+                auth_uri TEXT,
+                note TEXT,
+                created_at TEXT,
+                updated_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS tokens_idx ON tokens(idx);
+            CREATE INDEX IF NOT EXISTS tokens_user ON tokens(user);
+            CREATE INDEX IF NOT EXISTS tokens_issuer ON tokens(issuer);
+        """)
+
+    # 既存のJSONファイルからの移行
+    # Note: データベース新規作成時に1回のみ実行し、移行後のJSONは改名して残す
+    def migrate_from_json(self):
+        json_store = TokenStore(self.data_path)
+        if not (json_store.snapshot_path.exists()
+                or json_store.journal_path.exists()):
+            return
+
+        json_store.load()
+        with self.connection:
+            self.connection.executemany(
+                self.make_insert_sql(),
+                [self.make_row(key, item) for key, item in json_store.items()])
+        json_store.close()
+        json_store.snapshot_path.rename(
+            json_store.snapshot_path.with_name(
+                json_store.snapshot_path.name + ".migrated"))
+
+    #
+    # 参照処理
+    #
+
+    # トークン情報の取得
+    # Note: 秘密鍵・メモを含む全項目をデータベースから取得
+    def __getitem__(self, key: str) -> dict:
+        with self.lock:
+            columns = ", ".join(
+                self.COLUMN_NAMES[field] for field in self.RECORD_FIELDS)
+            row = self.connection.execute(
+                f"SELECT {columns} FROM tokens WHERE key = ?",
+                (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return dict(zip(self.RECORD_FIELDS, row))
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        return [(key, self[key]) for key in self.order_keys]
+
+    def iter_search_records(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, user, issuer, note FROM tokens").fetchall()
+        for key, user, issuer, note in rows:
+            yield key, {"user": user, "issuer": issuer, "note": note}
+
+    # 全トークンの秘密鍵の一覧
+    # Note: 1件ずつ取得せず、1回の問い合わせで秘密鍵のみ取得する
+    def get_secrets(self) -> list:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT secret FROM tokens").fetchall()
+        return [secret for secret, in rows]
+
+    # バックアップ用の変更確認値
+    # Note: 更新日時は概要情報に含まないためデータベースから取得
+    def get_change_marks(self) -> dict:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, updated_at, idx FROM tokens").fetchall()
+        return {key: [updated_at, idx] for key, updated_at, idx in rows}
+
+    # 保存ファイルの監視用の変更確認値
+    # Note: 秘密鍵などを読み込まないよう、更新日時とindexで判定する
+    def get_revisions(self) -> dict:
+        return self.get_change_marks()
+
+    # 一覧表示用の概要情報
+    def make_summary(self, item: dict, key: str = None) -> dict:
+        return {
+            field: item[field]
+            for field in self.SUMMARY_FIELDS if field in item
+        }
+
+    def update_summary(self, summary: dict, fields: dict):
+        summary.update(self.make_summary(fields))
+
+    #
+    # 保存処理
+    #
+
+    def make_insert_sql(self) -> str:
+        columns = ", ".join(
+            self.COLUMN_NAMES[field] for field in self.RECORD_FIELDS)
+        placeholders = ", ".join("?" for _ in self.RECORD_FIELDS)
+        return (f"INSERT OR REPLACE INTO tokens (key, {columns}) "
+                f"VALUES (?, {placeholders})")
+
+    def make_row(self, key: str, item: dict) -> tuple:
+        return (key,) + tuple(item.get(field) for field in self.RECORD_FIELDS)
+
+    # 変更操作のデータベースへの反映
+    # Note: commitは保存予約のタイミングでまとめて実行
+    def record_op(self, op: dict):
+        self.check_writable()
+        self.mark_dirty(op)
+        kind = op["op"]
+        key = op.get("key")
+        if kind == "put":
+            self.connection.execute(
+                self.make_insert_sql(), self.make_row(key, op["item"]))
+        elif kind == "patch":
+            fields = [f for f in op["fields"] if f in self.COLUMN_NAMES]
+            assignments = ", ".join(
+                f"{self.COLUMN_NAMES[f]} = ?" for f in fields)
+            self.connection.execute(
+                f"UPDATE tokens SET {assignments} WHERE key = ?",
+                [op["fields"][f] for f in fields] + [key])
+        elif kind == "delete":
+            self.connection.execute(
+                "DELETE FROM tokens WHERE key = ?", (key,))
+        elif kind == "order":
+            gap = op.get("gap", 1)
+            self.connection.executemany(
+                "UPDATE tokens SET idx = ? WHERE key = ?",
+                [(i * gap, k) for i, k in enumerate(op["keys"], start=1)])
+        self.pending_ops.append(op)
+        self.request_flush()
+
+    def flush(self):
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            if not self.pending_ops:
+                return
+            with perf_monitor.measure("store.flush"):
+                self.connection.commit()
+            self.pending_ops = []
+            self.mark_flushed()
+
+    def compact(self):
+        self.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.read_only:
+                self.flush()
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
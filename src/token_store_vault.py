@@ -0,0 +1,412 @@
+import os
+import json
+import uuid
+import base64
+import hashlib
+from pathlib import Path
+
+from perf_monitor import perf_monitor
+from token_store import (
+    TokenStore, open_token_store, write_file_atomic,
+    SQLITE_FILE_NAME, VAULT_FILE_NAME, VAULT_JOURNAL_FILE_NAME)
+
+
+# 鍵導出(scrypt)のパラメータ
+# Note: 約32MBのメモリを使用し、解錠時に1回のみ実行する
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_MAXMEM = 64 * 1024 * 1024
+
+# 解錠確認用のデータ
+VERIFIER_AAD = b"authenticator-vault-verifier"
+
+
+# 解錠の失敗(パスフレーズ違い・未解錠)
+class VaultUnlockError(Exception):
+    pass
+
+
+# 解錠済みの暗号鍵
+# Note: scryptによる鍵導出は生成時に1回のみ行い、以降はセッション中
+#       メモリ上に保持して各レコードのAES-GCMによる暗号化・復号に利用する
+class VaultKey:
+    def __init__(self, key: bytes, kdf: dict):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        self.aead = AESGCM(key)
+        self.kdf = kdf
+
+    @classmethod
+    def derive(cls, passphrase: str, kdf: dict = None):
+        if kdf is None:
+            kdf = {
+                "name": "scrypt",
+                "salt": base64.b64encode(os.urandom(16)).decode("ascii"),
+                "n": SCRYPT_N, "r": SCRYPT_R, "p": SCRYPT_P,
+            }
+        key = hashlib.scrypt(
+            passphrase.encode("utf-8"),
+            salt=base64.b64decode(kdf["salt"]),
+            n=kdf["n"], r=kdf["r"], p=kdf["p"],
+            maxmem=SCRYPT_MAXMEM, dklen=32)
+        return cls(key, kdf)
+
+    # 暗号化(nonce + 暗号文をbase64文字列で返す)
+    def seal(self, data: dict, aad: bytes) -> str:
+        nonce = os.urandom(12)
+        plain = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        return base64.b64encode(
+            nonce + self.aead.encrypt(nonce, plain, aad)).decode("ascii")
+
+    # 復号
+    # Note: 改ざん・鍵違いの場合はcryptographyのInvalidTagが発生
+    def open(self, sealed: str, aad: bytes) -> dict:
+        raw = base64.b64decode(sealed)
+        plain = self.aead.decrypt(raw[:12], raw[12:], aad)
+        return json.loads(plain.decode("utf-8"))
+
+    def make_verifier(self) -> str:
+        return self.seal({"vault": 1}, VERIFIER_AAD)
+
+    def check_verifier(self, verifier: str):
+        from cryptography.exceptions import InvalidTag
+
+        try:
+            self.open(verifier, VERIFIER_AAD)
+        except InvalidTag:
+            raise VaultUnlockError("Invalid passphrase for the vault")
+
+
+# 暗号化保存ファイルの有無
+def is_vault(data_path: Path) -> bool:
+    return data_path.joinpath(VAULT_FILE_NAME).exists()
+
+
+# 暗号化保存ファイルの解錠
+# Note: 鍵導出はここでのみ行い、得られたVaultKeyを各ストアで使い回す
+def unlock_vault(data_path: Path, passphrase: str) -> VaultKey:
+    with open(data_path.joinpath(VAULT_FILE_NAME), "r",
+              encoding="utf-8") as f:
+        document = json.load(f)
+    vault_key = VaultKey.derive(passphrase, document["kdf"])
+    vault_key.check_verifier(document["verifier"])
+    return vault_key
+
+
+# 暗号化したトークン情報の保存処理
+# Note: レコードごとに、一覧表示・検索用の項目(head)と秘密鍵などの
+#       項目(body)を別々にAES-GCMで暗号化する
+#       起動時はheadのみ復号し、bodyは行の表示などで必要になった時点で復号
+#       並び順のindexは暗号化せず、移動時は再暗号化しない
+#       ファイル上のレコードはランダムなidで管理し、名前は暗号文にのみ含める
+class EncryptedTokenStore(TokenStore):
+    SNAPSHOT_FILE_NAME = VAULT_FILE_NAME
+    JOURNAL_FILE_NAME = VAULT_JOURNAL_FILE_NAME
+    ENCRYPTED = True
+    STREAMING_LOAD = False
+
+    SUMMARY_FIELDS = ("index", "user", "issuer", "note")
+    HEAD_FIELDS = ("user", "issuer", "note")
+    BODY_FIELDS = ("secret", "auth_uri", "created_at", "updated_at")
+
+    def __init__(self, data_path: Path, vault_key: VaultKey,
+                 flush_delay: float = 0.5, compact_threshold: int = 500,
+                 read_only: bool = False):
+        super().__init__(
+            data_path, flush_delay=flush_delay,
+            compact_threshold=compact_threshold, read_only=read_only)
+        self.vault_key = vault_key
+        self.record_ids = {}
+        self.record_keys = {}
+        self.sealed = {}
+        self.bodies = {}
+
+    #
+    # 読み込み処理
+    #
+
+    def load(self):
+        with self.lock:
+            self.tokens = {}
+            self.record_ids = {}
+            self.record_keys = {}
+            self.sealed = {}
+            self.bodies = {}
+            if self.snapshot_path.exists():
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    document = json.load(f)
+                if document["kdf"] != self.vault_key.kdf:
+                    raise VaultUnlockError("Vault key does not match")
+                self.vault_key.check_verifier(document["verifier"])
+                for record_id, record in document["records"].items():
+                    self.load_record(record_id, record)
+
+            self.journal_count = 0
+            if self.journal_path.exists():
+                self.replay_journal()
+            self.rebuild_order()
+            self.file_signature = self.get_file_signature()
+        return self
+
+    def open_read_only_copy(self):
+        return EncryptedTokenStore(
+            self.data_path, self.vault_key, read_only=True).load()
+
+    # 1レコード分の読み込み(headのみ復号)
+    def load_record(self, record_id: str, record: dict):
+        head = self.vault_key.open(
+            record["head"], self.make_aad(record_id, "head"))
+        key = head.pop("key")
+        old_key = self.record_keys.get(record_id)
+        if old_key is not None and old_key != key:
+            self.drop_record(old_key)
+
+        self.tokens[key] = dict(head, index=record["index"])
+        self.record_ids[key] = record_id
+        self.record_keys[record_id] = key
+        self.sealed[record_id] = {
+            "head": record["head"], "body": record["body"]}
+        self.bodies.pop(key, None)
+
+    def drop_record(self, key: str):
+        self.tokens.pop(key, None)
+        self.bodies.pop(key, None)
+        record_id = self.record_ids.pop(key, None)
+        if record_id is not None:
+            self.record_keys.pop(record_id, None)
+            self.sealed.pop(record_id, None)
+
+    # ジャーナルの1操作分の反映
+    def apply_op(self, op: dict):
+        kind = op["op"]
+        record_id = op.get("id")
+        if kind == "put":
+            self.load_record(record_id, op)
+        elif kind == "index":
+            key = self.record_keys.get(record_id)
+            if key is not None:
+                self.tokens[key]["index"] = op["index"]
+        elif kind == "delete":
+            key = self.record_keys.get(record_id)
+            if key is not None:
+                self.drop_record(key)
+        elif kind == "order":
+            gap = op.get("gap", 1)
+            for i, order_id in enumerate(op["ids"], start=1):
+                key = self.record_keys.get(order_id)
+                if key is not None:
+                    self.tokens[key]["index"] = i * gap
+
+    # 改ざん・入れ替え検知用の追加認証データ
+    def make_aad(self, record_id: str, part: str) -> bytes:
+        return f"{record_id}:{part}".encode("utf-8")
+
+    #
+    # 参照処理
+    #
+
+    # トークン情報の取得
+    # Note: bodyは初回のみ復号し、以降は復号結果を利用
+    def __getitem__(self, key: str) -> dict:
+        with self.lock:
+            summary = self.tokens[key]
+            body = self.bodies.get(key)
+            if body is None:
+                record_id = self.record_ids[key]
+                body = self.vault_key.open(
+                    self.sealed[record_id]["body"],
+                    self.make_aad(record_id, "body"))
+                self.bodies[key] = body
+            return dict(summary, **body)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        return [(key, self[key]) for key in self.order_keys]
+
+    # 全トークンの秘密鍵の一覧
+    # Note: 秘密鍵はbodyに含まれるため復号は必要だが、概要情報との結合は
+    #       行わずにロックの取得も1回で済ませる(復号結果はbodiesへ保持)
+    def get_secrets(self) -> list:
+        with self.lock:
+            secrets = []
+            for key, record_id in self.record_ids.items():
+                body = self.bodies.get(key)
+                if body is None:
+                    body = self.vault_key.open(
+                        self.sealed[record_id]["body"],
+                        self.make_aad(record_id, "body"))
+                    self.bodies[key] = body
+                secrets.append(body["secret"])
+            return secrets
+
+    # バックアップ用の変更確認値
+    # Note: 更新日時はbodyに含まれるため、復号せずにbodyの暗号文の末尾
+    #       (AES-GCMの認証タグ)で変更を判定する(内容の変更時のみ再暗号化)
+    def get_change_marks(self) -> dict:
+        with self.lock:
+            return {
+                key: [self.sealed[self.record_ids[key]]["body"][-24:],
+                      summary["index"]]
+                for key, summary in self.tokens.items()}
+
+    # 保存ファイルの監視用の変更確認値
+    # Note: 復号しないよう、bodyの暗号文とindexで判定する
+    #       (同じ内容でも暗号化し直すと値が変わる)
+    def get_revisions(self) -> dict:
+        return self.get_change_marks()
+
+    # 一覧表示用の概要情報
+    def make_summary(self, item: dict, key: str = None) -> dict:
+        return {
+            field: item[field]
+            for field in self.SUMMARY_FIELDS if field in item
+        }
+
+    def update_summary(self, summary: dict, fields: dict):
+        summary.update(self.make_summary(fields))
+
+    # 他のインスタンスによる変更の反映
+    # Note: 暗号化し直してメモリ上のみ更新し、次回の書き出し時に保存する
+    def apply_external(self, key: str, item):
+        with self.lock:
+            if item is not None:
+                record_id = self.record_ids.get(key) or uuid.uuid4().hex
+                self.record_ids[key] = record_id
+                self.record_keys[record_id] = key
+                self.seal_record(key, record_id, item)
+        super().apply_external(key, item)
+        if item is None:
+            with self.lock:
+                self.bodies.pop(key, None)
+                record_id = self.record_ids.pop(key, None)
+                if record_id is not None:
+                    self.record_keys.pop(record_id, None)
+                    self.sealed.pop(record_id, None)
+
+    #
+    # 保存処理
+    #
+
+    # レコードの暗号化
+    def seal_record(self, key: str, record_id: str, item: dict) -> dict:
+        head = {field: item.get(field) for field in self.HEAD_FIELDS}
+        head["key"] = key
+        body = {field: item.get(field) for field in self.BODY_FIELDS}
+        sealed = {
+            "head": self.vault_key.seal(
+                head, self.make_aad(record_id, "head")),
+            "body": self.vault_key.seal(
+                body, self.make_aad(record_id, "body")),
+        }
+        self.sealed[record_id] = sealed
+        self.bodies[key] = body
+        return sealed
+
+    # 変更操作の暗号化およびジャーナルへの記録
+    # Note: ジャーナルには暗号化済みのレコードのみを記録する
+    def record_op(self, op: dict):
+        self.check_writable()
+        self.mark_dirty(op)
+        kind = op["op"]
+        key = op.get("key")
+        if kind == "put":
+            record_id = self.record_ids.get(key) or uuid.uuid4().hex
+            self.record_ids[key] = record_id
+            self.record_keys[record_id] = key
+            sealed = self.seal_record(key, record_id, op["item"])
+            op = dict(
+                sealed, op="put", id=record_id, index=op["item"]["index"])
+        elif kind == "patch" and set(op["fields"]) <= {"index"}:
+            op = {
+                "op": "index", "id": self.record_ids[key],
+                "index": op["fields"]["index"]}
+        elif kind == "patch":
+            record_id = self.record_ids[key]
+            item = dict(self[key], **op["fields"])
+            sealed = self.seal_record(key, record_id, item)
+            op = dict(sealed, op="put", id=record_id, index=item["index"])
+        elif kind == "delete":
+            record_id = self.record_ids.pop(key)
+            self.record_keys.pop(record_id, None)
+            self.sealed.pop(record_id, None)
+            self.bodies.pop(key, None)
+            op = {"op": "delete", "id": record_id}
+        elif kind == "order":
+            op = {
+                "op": "order", "gap": op.get("gap", 1),
+                "ids": [self.record_ids[k] for k in op["keys"]]}
+        super().record_op(op)
+
+    # 暗号化保存ファイルへの書き出しおよびジャーナルの削除
+    def compact(self):
+        with self.lock, perf_monitor.measure("store.compact"):
+            self.check_writable()
+            self.data_path.mkdir(parents=True, exist_ok=True)
+            self.pending_ops = []
+            records = {
+                self.record_ids[key]: dict(
+                    self.sealed[self.record_ids[key]],
+                    index=self.tokens[key]["index"])
+                for key in self.order_keys
+            }
+            document = {
+                "version": 1,
+                "kdf": self.vault_key.kdf,
+                "verifier": self.vault_key.make_verifier(),
+                "records": records,
+            }
+            write_file_atomic(self.snapshot_path, json.dumps(document))
+            os.chmod(self.snapshot_path, 0o600)
+            if self.journal_path.exists():
+                self.journal_path.unlink()
+            self.journal_count = 0
+            self.mark_flushed()
+
+
+# 平文の保存ファイルから暗号化保存ファイルへの移行
+# Note: 移行後に読み直して内容を確認してから、平文のファイル
+#       (JSON・ジャーナル・SQLite・QRコード画像のキャッシュ)を削除する
+def migrate_to_vault(data_path: Path, passphrase: str,
+                     backend: str = None) -> EncryptedTokenStore:
+    if is_vault(data_path):
+        raise ValueError(f"Vault already exists: {data_path}")
+
+    source_store = open_token_store(data_path, backend)
+    source_items = [(key, dict(item)) for key, item in source_store.items()]
+    source_store.close()
+
+    vault_key = VaultKey.derive(passphrase)
+    vault_store = EncryptedTokenStore(data_path, vault_key).load()
+    with vault_store.lock:
+        for key, item in source_items:
+            vault_store.put_item(key, dict(item))
+        vault_store.compact()
+
+    check_store = EncryptedTokenStore(
+        data_path, vault_key, read_only=True).load()
+    for key, item in source_items:
+        if check_store[key]["secret"] != item["secret"]:
+            raise RuntimeError(f"Vault verification failed: {key}")
+
+    remove_plaintext_files(data_path)
+    return vault_store
+
+
+def remove_plaintext_files(data_path: Path):
+    import shutil
+    from qr_export import QrExporter
+
+    for name in (TokenStore.SNAPSHOT_FILE_NAME,
+                 TokenStore.SNAPSHOT_FILE_NAME + ".migrated",
+                 TokenStore.JOURNAL_FILE_NAME,
+                 SQLITE_FILE_NAME, SQLITE_FILE_NAME + "-wal",
+                 SQLITE_FILE_NAME + "-shm"):
+        data_path.joinpath(name).unlink(missing_ok=True)
+    shutil.rmtree(
+        data_path.joinpath(QrExporter.CACHE_DIR_NAME), ignore_errors=True)
@@ -1,18 +1,20 @@
 import flet as ft
 from pathlib import Path
-from datetime import datetime
-from urllib.parse import urlparse, parse_qsl
-from PIL import Image
-import pyzbar.pyzbar as pyzbar
+
+from otp_migration import MigrationBatchTracker
+from qr_import import BulkQrImporter, iter_token_infos
+from token_record import make_timestamp_text
 
 
 # ft.Viewを継承してクラス化
 class ViewAdd(ft.View):
     # イニシャライザ定義
-    def __init__(self, token_dict: dict):
+    def __init__(self, token_store, qr_decoder):
         super().__init__()
         self.appbar = ft.AppBar(title=ft.Text("新規登録"))
-        self.token_dict = token_dict
+        self.scroll = ft.ScrollMode.AUTO
+        self.token_store = token_store
+        self.qr_decoder = qr_decoder
         self.define_view_components()
 
     #
@@ -45,44 +47,122 @@ class ViewAdd(ft.View):
             self.text_field_qrcode_file_path.value = input_file_path
             self.text_field_qrcode_file_path.update()
 
-            # QRコード画像の読み込み・OTP auth URI取得
-            img = Image.open(input_file_path)
-            decoded_objects = pyzbar.decode(img)
-            if decoded_objects:
-                # OTP auth URIの取得
-                otp_auth_uri = decoded_objects[0].data.decode("utf-8")
-
-                # 内容の解析および各入力項目への入力
-                u = urlparse(otp_auth_uri)
-                params = dict(parse_qsl(u.query))
-
-                self.text_field_user.value = u.path[1:]
-                self.text_field_secret.value = params["secret"]
-                self.text_field_issuer.value = params["issuer"]
-                self.text_field_auth_uri.value = otp_auth_uri
-                self.switch_button_register_new_token()
-
-                self.update()
-            else:
-                # 読み取り失敗時のダイアログ表示
-                dialog = ft.AlertDialog(
-                    content=ft.Text(
-                        "有効なファイルをアップロードしてください。"),
-                    actions=[ft.TextButton(
-                        "OK",
-                        on_click=lambda _: self.page.close(dialog))],
-                    actions_alignment=ft.MainAxisAlignment.CENTER
-                )
-                self.page.open(dialog)
+            # QRコード画像の読み込み
+            # Note: デコード処理はUIスレッド外で実行
+            self.page.run_thread(self.run_decode_qrcode, input_file_path)
         else:
             print("Notice: QRコードファイル指定がキャンセルされました")
 
+    # QRコード画像の読み込み・OTP auth URI取得
+    def run_decode_qrcode(self, input_file_path: str):
+        self.button_select_qrcode_file.disabled = True
+        self.button_select_qrcode_file.update()
+        try:
+            uris = self.qr_decoder.decode(input_file_path)
+        except Exception:
+            uris = []
+        self.button_select_qrcode_file.disabled = False
+        self.button_select_qrcode_file.update()
+
+        # Note: 複数アカウントを含む場合・対応していない形式のトークンを
+        #       含む場合は入力欄を使わずにまとめて登録し、結果を表示
+        batch_tracker = MigrationBatchTracker()
+        unsupported = []
+        token_infos = list(iter_token_infos(uris, batch_tracker, unsupported))
+        if len(token_infos) > 1 or unsupported:
+            importer = BulkQrImporter(self.token_store, self.qr_decoder)
+            result = importer.import_token_infos(token_infos)
+            result.incomplete_batches = \
+                batch_tracker.get_incomplete_batches()
+            result.unsupported_tokens = unsupported
+            self.show_import_result_dialog(result)
+        elif token_infos:
+            # 内容の解析および各入力項目への入力
+            token_info = token_infos[0]
+            self.text_field_user.value = token_info["user"]
+            self.text_field_secret.value = token_info["secret"]
+            self.text_field_issuer.value = token_info["issuer"]
+            self.text_field_auth_uri.value = token_info["auth_uri"]
+            self.switch_button_register_new_token()
+
+            self.update()
+        else:
+            # 読み取り失敗時のダイアログ表示
+            dialog = ft.AlertDialog(
+                content=ft.Text(
+                    "有効なファイルをアップロードしてください。"),
+                actions=[ft.TextButton(
+                    "OK",
+                    on_click=lambda _: self.page.close(dialog))],
+                actions_alignment=ft.MainAxisAlignment.CENTER
+            )
+            self.page.open(dialog)
+
+    # 一括インポート対象のファイル・フォルダの指定
+    def event_select_bulk_import_paths(self, e: ft.FilePickerResultEvent):
+        if e.files:
+            paths = [f.path for f in e.files]
+        elif e.path:
+            paths = [e.path]
+        else:
+            print("Notice: 一括インポート対象の指定がキャンセルされました")
+            return
+
+        # Note: デコード処理はUIスレッド外で実行
+        self.page.run_thread(self.run_bulk_import, paths)
+
+    # 一括インポート処理
+    def run_bulk_import(self, paths: list):
+        self.button_select_bulk_import_files.disabled = True
+        self.button_select_bulk_import_folder.disabled = True
+        self.progress_bar_bulk_import.value = 0
+        self.text_bulk_import_status.value = "QRコードを読み込み中..."
+        self.update()
+
+        importer = BulkQrImporter(self.token_store, self.qr_decoder)
+        result = importer.run(
+            paths, on_progress=self.update_bulk_import_progress)
+
+        self.button_select_bulk_import_files.disabled = False
+        self.button_select_bulk_import_folder.disabled = False
+        self.text_bulk_import_status.value = ""
+        self.update()
+        self.show_import_result_dialog(result)
+
+    # インポート結果のダイアログ表示
+    def show_import_result_dialog(self, result):
+        message = (
+            f"登録: {len(result.imported_keys)}件 / "
+            f"重複: {result.duplicate_count}件 / "
+            f"読み取り失敗: {len(result.failed_paths)}件")
+        for _, received, total in result.incomplete_batches:
+            message += \
+                f"\nエクスポート画像が不足しています({received}/{total}枚)"
+        for name, kind in result.unsupported_tokens:
+            message += f"\n未対応の形式のため登録できません({kind}): {name}"
+
+        dialog = ft.AlertDialog(
+            content=ft.Text(message),
+            actions=[ft.TextButton(
+                "OK",
+                on_click=lambda _: [
+                    self.page.close(dialog), self.page.go("/")])],
+            actions_alignment=ft.MainAxisAlignment.CENTER
+        )
+        self.page.open(dialog)
+
+    # 一括インポートの進捗表示
+    def update_bulk_import_progress(self, count: int, total: int, path: str):
+        self.progress_bar_bulk_import.value = count / total
+        self.text_bulk_import_status.value = \
+            f"{count}/{total}: {Path(path).name}"
+        self.update()
+
     # OTPトークンの新規登録処理
     def event_add_new_token(self):
-        # dictへのトークン情報の追加
-        dt_now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # ストアへのトークン情報の追加
+        dt_now_str = make_timestamp_text()
         token_item = {
-            "index": len(self.token_dict) + 1,
             "user": self.text_field_user.value,
             "secret": self.text_field_secret.value,
             "issuer": self.text_field_issuer.value,
@@ -91,7 +171,7 @@ class ViewAdd(ft.View):
             "created_at": dt_now_str,
             "updated_at": dt_now_str
         }
-        self.token_dict[self.text_field_user.value] = token_item
+        self.token_store.add(self.text_field_user.value, token_item)
 
         # ページ移動処理
         self.page.go("/")
@@ -107,8 +187,6 @@ class ViewAdd(ft.View):
     # View内のUIオブジェクト定義
     # Note: 他のメソッドやイベントから呼び出されるものはselfつきで宣言
     def define_view_components(self):
-        token_dict = self.token_dict
-
         # FilePickerの定義
         # Note: viewもしくはpageへの追加がないとエラー発生
         dialog_select_qrcode_file = ft.FilePicker(
@@ -132,6 +210,30 @@ class ViewAdd(ft.View):
             )
         )
 
+        # 一括インポート項目の作成
+        dialog_select_bulk_import_paths = ft.FilePicker(
+            on_result=self.event_select_bulk_import_paths)
+        self.controls.append(dialog_select_bulk_import_paths)
+        self.button_select_bulk_import_files = ft.ElevatedButton(
+            "ファイル選択",
+            on_click=lambda _: dialog_select_bulk_import_paths.pick_files(
+                "QRコードファイル指定(複数可)",
+                allow_multiple=True,
+                allowed_extensions=["jpg", "jpeg", "png", "gif"],
+                initial_directory=str(Path.home()),
+            )
+        )
+        self.button_select_bulk_import_folder = ft.ElevatedButton(
+            "フォルダ選択",
+            on_click=lambda _:
+                dialog_select_bulk_import_paths.get_directory_path(
+                    "QRコードフォルダ指定",
+                    initial_directory=str(Path.home()),
+                )
+        )
+        self.progress_bar_bulk_import = ft.ProgressBar(width=400, value=0)
+        self.text_bulk_import_status = ft.Text("")
+
         # 直接入力項目の作成
         self.text_field_user = ft.TextField(
             label="認証対象者", width=400, read_only=True,
@@ -162,6 +264,15 @@ class ViewAdd(ft.View):
         row_select_qrcode_file = ft.Row(
             controls=[self.text_field_qrcode_file_path,
                       self.button_select_qrcode_file])
+        row_bulk_import_header = ft.Row(
+            controls=[ft.Text("QRコード一括インポート", size=20)])
+        row_bulk_import_buttons = ft.Row(
+            controls=[self.button_select_bulk_import_files,
+                      self.button_select_bulk_import_folder])
+        row_bulk_import_progress = ft.Row(
+            controls=[self.progress_bar_bulk_import])
+        row_bulk_import_status = ft.Row(
+            controls=[self.text_bulk_import_status])
         row_otp_token_info_header = ft.Row(
             controls=[ft.Text("OTPトークン情報", size=20)])
         row_text_field_user = ft.Row(
@@ -183,6 +294,11 @@ class ViewAdd(ft.View):
             row_checkbox_enable_qrcode,
             row_select_qrcode_file,
             row_spacer,
+            row_bulk_import_header,
+            row_bulk_import_buttons,
+            row_bulk_import_progress,
+            row_bulk_import_status,
+            row_spacer,
             row_otp_token_info_header,
             row_text_field_user,
             row_text_field_secret,
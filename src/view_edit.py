@@ -1,14 +1,15 @@
 import flet as ft
-from datetime import datetime
+
+from token_record import make_timestamp_text
 
 
 # ft.Viewを継承してクラス化
 class ViewEdit(ft.View):
     # イニシャライザ定義
-    def __init__(self, token_dict: dict, key: str):
+    def __init__(self, token_store, key: str):
         super().__init__()
         self.appbar = ft.AppBar(title=ft.Text("更新"))
-        self.token_dict = token_dict
+        self.token_store = token_store
         self.key = key
         self.define_view_components()
 
@@ -16,9 +17,9 @@ class ViewEdit(ft.View):
     def event_edit_token(self, e):
         key = e.control.data
 
-        # dict内のトークン情報の更新
-        dt_now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.token_dict[key].update({
+        # ストア内のトークン情報の更新
+        dt_now_str = make_timestamp_text()
+        self.token_store.patch(key, {
             "note": self.text_field_note.value,
             "updated_at": dt_now_str
         })
@@ -29,28 +30,28 @@ class ViewEdit(ft.View):
     # View内のUIオブジェクト定義
     # Note: 他のメソッドやイベントから呼び出されるものはselfつきで宣言
     def define_view_components(self):
-        token_dict = self.token_dict
         key = self.key
+        token_info = self.token_store[key]
 
         # 直接入力項目の作成
         text_field_user = ft.TextField(
             label="認証対象者", width=400, read_only=True,
-            value=token_dict[key]["user"])
+            value=token_info["user"])
         text_field_secret = ft.TextField(
             label="秘密鍵", width=400, read_only=True,
-            value=token_dict[key]["secret"])
+            value=token_info["secret"])
         text_field_issuer = ft.TextField(
             label="発行者", width=400, read_only=True,
-            value=token_dict[key]["issuer"])
+            value=token_info["issuer"])
         text_field_auth_uri = ft.TextField(
             label="認証URI", width=400, read_only=True,
-            value=token_dict[key]["auth_uri"])
+            value=token_info["auth_uri"])
 
         # Note: Noteのみイベントから呼び出せるようにselfつきで宣言
         self.text_field_note = ft.TextField(
             label="説明文・メモ書き", width=400,
             multiline=True, min_lines=3,
-            value=token_dict[key]["note"])
+            value=token_info["note"])
 
         # ボタンの定義
         button_edit_token = ft.CupertinoFilledButton(